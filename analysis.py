@@ -0,0 +1,428 @@
+"""
+Vectorized analyses of the simulation results over the cells x timesteps arrays (see cell_time_array() in inputs.py).
+"""
+
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+import shapely
+from shapely import Point, Polygon
+
+from inputs import cell_time_array, SurfaceMesh
+from interpolation import TemporalInterpolator, SimulationInterpolator
+
+
+class Exceedance():
+    """
+    Counts values over thresholds for many areas of interest at once. The values of each area of interest are selected
+    (one bulk spatial index query for all new AOIs) and sorted only once, any threshold is then answered by binary search.
+
+    The values are the same as in Frequency.count_frequency(): for a point all the timesteps of the nearest cell, for a polygon
+    the mean over time of each cell inside the polygon.
+
+    Attributes
+    ----------
+    gdf : gpd.GeoDataFrame
+        Points (Ferda folder: surface_point_shp.shp).
+    df : pd.DataFrame
+        Data of the points (Ferda folder: surface_data_2021_07_15.csv).
+    variable_name : str
+        Variable to count.
+    """
+
+    def __init__(self, gdf : gpd.GeoDataFrame, df : pd.DataFrame, variable_name : str) -> None:
+        self.gdf = gdf
+        self.df = df
+        self.variable_name = variable_name
+
+        self.values = cell_time_array(df, variable_name, cell_IDs=gdf["cell_ID"].values)
+        self.sorted_values = {}  # wkb of the aoi -> sorted values (without nans)
+
+    def _add_aois(self, aois):
+        """ Selects and sorts the values of the aois which were not added yet. """
+
+        new = list({aoi.wkb: aoi for aoi in aois if aoi.wkb not in self.sorted_values}.values())
+        if len(new) == 0:
+            return
+
+        for aoi in new:
+            if not isinstance(aoi, (Point, Polygon)):
+                raise ValueError("AOI must be a Point or Polygon.")
+
+        # points: all timesteps of the nearest cell
+        points = [aoi for aoi in new if isinstance(aoi, Point)]
+        if len(points) > 0:
+            aoi_idx, cell_idx = self.gdf.sindex.nearest(gpd.GeoSeries(points, crs=self.gdf.crs), return_all=False)
+            for i, c in zip(aoi_idx, cell_idx):
+                values = self.values[c]
+                self.sorted_values[points[i].wkb] = np.sort(values[~np.isnan(values)])
+
+        # polygons: mean over time of each cell within the polygon
+        polygons = [aoi for aoi in new if isinstance(aoi, Polygon)]
+        if len(polygons) > 0:
+            aoi_idx, cell_idx = self.gdf.sindex.query(gpd.GeoSeries(polygons, crs=self.gdf.crs), predicate="contains")
+            with np.errstate(all="ignore"):
+                means = np.nanmean(self.values, axis=1)  # nan for cells without any value
+            for i, polygon in enumerate(polygons):
+                values = means[cell_idx[aoi_idx == i]]
+                self.sorted_values[polygon.wkb] = np.sort(values[~np.isnan(values)])
+
+    def get_values(self, aoi):
+        """ Sorted values of the aoi. """
+        self._add_aois([aoi])
+        return self.sorted_values[aoi.wkb]
+
+    def count(self, aois, thresholds):
+        """
+        Counts values below and above (or equal to) the thresholds for each aoi.
+
+        Params:
+        -------
+        - aois: list of shapely Points or Polygons
+        - thresholds: list of thresholds
+
+        Returns:
+        --------
+        tuple of np.ndarrays (below, above) of shape (len(aois), len(thresholds)).
+        """
+
+        self._add_aois(aois)
+        thresholds = np.atleast_1d(np.asarray(thresholds, dtype=float))
+
+        below = np.array([np.searchsorted(self.sorted_values[aoi.wkb], thresholds, side="left") for aoi in aois]).reshape(len(aois), len(thresholds))
+        sizes = np.array([len(self.sorted_values[aoi.wkb]) for aoi in aois]).reshape(-1, 1)
+
+        return below, sizes - below
+
+    def curve(self, aois, thresholds):
+        """
+        Share of values above (or equal to) each threshold for each aoi (exceedance curve).
+
+        Returns:
+        --------
+        np.ndarray of shape (len(aois), len(thresholds)) with values between 0 and 1 (nan for aois without values).
+        """
+
+        below, above = self.count(aois, thresholds)
+        with np.errstate(all="ignore"):
+            return above / (below + above)
+
+    def hours_above(self, thresholds):
+        """
+        Number of timesteps with values above (or equal to) each threshold for every cell (one reduction over the
+        cells x timesteps array per threshold).
+
+        Returns:
+        --------
+        np.ndarray of shape (len(thresholds), cells) in the order of the cells in gdf.
+        """
+
+        thresholds = np.atleast_1d(np.asarray(thresholds, dtype=float))
+        with np.errstate(invalid="ignore"):
+            return np.stack([(self.values >= threshold).sum(axis=1) for threshold in thresholds])
+
+
+class ZonalStatistics():
+    """
+    Statistics (count, mean, min, max and percentiles) of the variables for each polygon (e.g. parcels or blocks),
+    timestep and simulation (scenario). The cells of all the polygons are found with a single bulk spatial index
+    query, the statistics are computed with grouped reductions over the cells x timesteps arrays (no plotting).
+
+    Attributes
+    ----------
+    gdf : gpd.GeoDataFrame
+        Points (Ferda folder: surface_point_shp.shp).
+    zones : gpd.GeoDataFrame
+        Polygons (e.g. read from a shapefile with thousands of parcels).
+    id_column : str
+        Column of zones used as the id of the polygons in the output (defaults to the index of zones).
+    """
+
+    def __init__(self, gdf : gpd.GeoDataFrame, zones : gpd.GeoDataFrame, id_column : str = None) -> None:
+        self.gdf = gdf
+        self.zones = zones if isinstance(zones, gpd.GeoDataFrame) else gpd.GeoDataFrame(geometry=list(zones), crs=gdf.crs)
+        self.id_column = id_column
+
+        self.simulations = []  # list of tuples (name, pd.DataFrame | Scenario)
+        self.variables = []
+        self.percentiles = [5, 50, 95]
+        self.times = None  # times between the timesteps, see set_times()
+        self.interpolation = "linear"
+
+        # membership of the cells in the zones (pairs of zone and cell position, sorted by zone)
+        zone_idx, cell_idx = gdf.sindex.query(self.zones.geometry, predicate="contains")
+        order = np.argsort(zone_idx, kind="stable")
+        self.zone_idx, self.cell_idx = zone_idx[order], cell_idx[order]
+
+    def add_simulation(self, simulation, name : str = None):
+        """ Add simulation (pd.DataFrame | Scenario). """
+        if name is None:
+            name = getattr(simulation, "name", None) or f"Simulation {len(self.simulations) + 1}"
+        self.simulations.append((name, simulation))
+
+    def add_variable(self, variable_name : str):
+        self.variables.append(variable_name)
+
+    def set_percentiles(self, percentiles : list):
+        self.percentiles = percentiles
+
+    def set_times(self, times : list, interpolation : str = "linear"):
+        """
+        Computes the statistics at these times instead of the timesteps (e.g. timestamps of measurements), the values of
+        the cells are interpolated between the timesteps first (see TemporalInterpolator in interpolation.py).
+
+        Params:
+        -------
+        - times: list of times (None for the timesteps)
+        - interpolation: "linear" or "cubic" (monotone)
+        """
+        self.times = None if times is None else np.atleast_1d(np.asarray(times, dtype=float))
+        self.interpolation = interpolation
+
+    def _zone_statistics(self, values):
+        """
+        Statistics of a cells x timesteps array for every zone.
+
+        Returns:
+        --------
+        dict {statistic: np.ndarray of shape (zones, timesteps)}.
+        """
+
+        n_zones, n_times = len(self.zones), values.shape[1]
+        stats = {name: np.full((n_zones, n_times), np.nan) for name in ["mean", "min", "max"] + [f"p{p}" for p in self.percentiles]}
+        stats["count"] = np.zeros((n_zones, n_times), dtype=int)
+
+        if len(self.zone_idx) == 0:
+            return stats
+
+        v = values[self.cell_idx]  # values of the (zone, cell) pairs
+        valid = ~np.isnan(v)
+        starts = np.flatnonzero(np.r_[True, self.zone_idx[1:] != self.zone_idx[:-1]])
+        zones = self.zone_idx[starts]
+
+        count = np.add.reduceat(valid, starts, axis=0)
+        stats["count"][zones] = count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stats["mean"][zones] = np.add.reduceat(np.where(valid, v, 0), starts, axis=0) / count
+        stats["min"][zones] = np.fmin.reduceat(v, starts, axis=0)
+        stats["max"][zones] = np.fmax.reduceat(v, starts, axis=0)
+
+        # percentiles: sort values within each zone (nans last), then interpolate linearly between the ranks
+        for t in range(n_times):
+            sorted_values = v[np.lexsort((v[:, t], self.zone_idx)), t]
+            n = count[:, t]
+            for p in self.percentiles:
+                rank = p / 100 * np.maximum(n - 1, 0)
+                lower, upper = np.floor(rank).astype(int), np.ceil(rank).astype(int)
+                low, high = sorted_values[starts + lower], sorted_values[starts + upper]
+                stats[f"p{p}"][zones, t] = np.where(n > 0, low + (high - low) * (rank - lower), np.nan)
+
+        return stats
+
+    def compute(self):
+        """
+        Computes the statistics for all the zones, simulations, variables and timesteps.
+
+        Returns:
+        --------
+        pd.DataFrame in long format (zone, simulation, variable, Time, count, mean, min, max, percentiles).
+        """
+
+        ids = self.zones[self.id_column].values if self.id_column is not None else self.zones.index.values
+        cell_IDs = self.gdf["cell_ID"].values
+
+        tables = []
+        for name, simulation in self.simulations:
+            timesteps = np.unique(simulation["Time"].values)
+            for variable_name in self.variables:
+                values = cell_time_array(simulation, variable_name, cell_IDs, timesteps)
+                if self.times is not None:
+                    values = TemporalInterpolator(timesteps, values, self.interpolation, SimulationInterpolator.PERIODS.get(variable_name))(self.times)
+                stats = self._zone_statistics(values)
+
+                times = timesteps if self.times is None else self.times
+                table = pd.DataFrame({
+                    "zone": np.repeat(ids, len(times)),
+                    "simulation": name,
+                    "variable": variable_name,
+                    "Time": np.tile(times, len(ids)),
+                })
+                for statistic, array in stats.items():
+                    table[statistic] = array.ravel()
+                tables.append(table)
+
+        return pd.concat(tables, ignore_index=True)
+
+    def export(self, path):
+        """ Computes the statistics and saves them to a parquet (.parquet) or csv (any other suffix) file. """
+
+        table = self.compute()
+        if str(path).endswith(".parquet"):
+            table.to_parquet(path, index=False)
+        else:
+            table.to_csv(path, index=False)
+
+        return table
+
+
+class Hotspots():
+    """
+    Contiguous hot zones: connected regions of triangles of the surface mesh (sharing an edge) with values above a
+    threshold. The regions are labelled at once for all the timesteps with sparse connected components, with
+    temporal=True the same triangle in consecutive timesteps is linked too, so a region is a hot zone over its whole duration.
+
+    Attributes
+    ----------
+    surfmesh : gpd.GeoDataFrame | SurfaceMesh
+        Triangles (Ferda folder: surface_triangle_shp.shp).
+    df : pd.DataFrame | Scenario
+        Surface data (Ferda folder: surface_data_2021_07_15.csv).
+    variable_name : str
+        Variable for the threshold (e.g. "UTCI" or "Tsurf").
+    """
+
+    def __init__(self, surfmesh, df, variable_name : str = "UTCI", threshold : float = 32, temporal : bool = True) -> None:
+        self.surfmesh = surfmesh if isinstance(surfmesh, SurfaceMesh) else SurfaceMesh(surfmesh, df)
+        self.df = df
+        self.variable_name = variable_name
+        self.threshold = threshold
+        self.temporal = temporal
+        self.min_area = 0
+
+        self.output_folder = None
+        self.timesteps = None
+        self.labels = None  # region of each triangle (columns, same order as surfmesh) for each timestep (rows), -1 if not hot
+        self.regions = None
+
+    def set_output_folder(self, output_folder):
+        self.output_folder = output_folder
+
+    def set_threshold(self, threshold : float):
+        self.threshold = threshold
+        self.labels = None
+
+    def set_min_area(self, min_area : float):
+        """ Regions with smaller area (m2) are ignored. """
+        self.min_area = min_area
+        self.labels = None
+
+    def set_temporal(self, temporal : bool):
+        self.temporal = temporal
+        self.labels = None
+
+    def detect(self):
+        """
+        Labels the hot regions and computes their characteristics.
+
+        Returns:
+        --------
+        pd.DataFrame with one row for each region (region, start, end, duration in timesteps, n_cells, area of all
+        its triangles, max_area at a single timestep, peak value and peak_time).
+        """
+
+        from scipy import sparse
+        from scipy.sparse.csgraph import connected_components
+
+        mesh = self.surfmesh.surfmesh
+        areas = self.surfmesh.get_triangle_areas().values
+        adjacency = sparse.triu(self.surfmesh.get_adjacency()).tocoo()
+
+        self.timesteps = np.unique(self.df["Time"].values)
+        values = cell_time_array(self.df, self.variable_name, mesh["cell_ID"].values, self.timesteps).T  # timesteps x cells
+        n_times, n_cells = values.shape
+        with np.errstate(invalid="ignore"):
+            hot = values > self.threshold
+
+        # one graph for all the timesteps, node of triangle i at timestep t is t * n_cells + i
+        t, k = np.nonzero(hot[:, adjacency.row] & hot[:, adjacency.col])
+        rows, cols = [t * n_cells + adjacency.row[k]], [t * n_cells + adjacency.col[k]]
+        if self.temporal:
+            t, i = np.nonzero(hot[:-1] & hot[1:])
+            rows.append(t * n_cells + i)
+            cols.append((t + 1) * n_cells + i)
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+
+        n_nodes = n_times * n_cells
+        graph = sparse.coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n_nodes, n_nodes))
+        _, components = connected_components(graph, directed=False)
+
+        # hot nodes only, regions numbered from 0
+        t, i = np.nonzero(hot)
+        _, region = np.unique(components[t * n_cells + i], return_inverse=True)
+        n_regions = region.max() + 1 if len(region) else 0
+
+        # area of each region at each timestep, area of all the triangles of each region
+        area_time = np.zeros((n_regions, n_times))
+        np.add.at(area_time, (region, t), areas[i])
+        cells = np.unique(region * n_cells + i)
+        area = np.bincount(cells // n_cells, weights=areas[cells % n_cells], minlength=n_regions)
+
+        # regions smaller than min_area are dropped
+        keep = area >= self.min_area
+        new_ids = np.cumsum(keep) - 1
+        selected = keep[region]
+        t, i, region = t[selected], i[selected], new_ids[region[selected]]
+        area_time, area = area_time[keep], area[keep]
+        n_regions = int(keep.sum())
+
+        self.labels = np.full((n_times, n_cells), -1, dtype=np.int64)
+        self.labels[t, i] = region
+        self.region_cells = np.unique(region * n_cells + i)  # region * n_cells + triangle position
+
+        start = np.full(n_regions, n_times)
+        end = np.zeros(n_regions, dtype=int)
+        np.minimum.at(start, region, t)
+        np.maximum.at(end, region, t)
+
+        # peak: the last value of each region after sorting by region and value
+        order = np.lexsort((values[t, i], region))
+        last = order[np.r_[region[order][1:] != region[order][:-1], True]] if len(order) else order
+
+        self.regions = pd.DataFrame({
+            "region": np.arange(n_regions),
+            "start": self.timesteps[start] if n_regions else [],
+            "end": self.timesteps[end] if n_regions else [],
+            "duration": end - start + 1,
+            "n_cells": np.bincount(self.region_cells // n_cells, minlength=n_regions),
+            "area": area,
+            "max_area": area_time.max(axis=1) if n_regions else [],
+            "peak": values[t[last], i[last]],
+            "peak_time": self.timesteps[t[last]],
+        })
+
+        return self.regions
+
+    def outlines(self):
+        """
+        Outlines of the regions (union of the footprints of their triangles, walls are slightly buffered).
+
+        Returns:
+        --------
+        gpd.GeoDataFrame with the characteristics of the regions (see detect()).
+        """
+
+        if self.labels is None:
+            self.detect()
+
+        mesh = self.surfmesh.surfmesh
+        n_cells = len(mesh)
+        triangles = shapely.force_2d(mesh.geometry.values[self.region_cells % n_cells])
+        walls = shapely.area(triangles) == 0
+        triangles[walls] = shapely.buffer(triangles[walls], 0.001)
+
+        gdf = gpd.GeoDataFrame({"region": self.region_cells // n_cells}, geometry=triangles, crs=mesh.crs)
+        gdf = gdf.dissolve(by="region").reset_index()
+
+        return gdf.merge(self.regions, on="region")
+
+    def export(self):
+        """ Saves the characteristics (csv) and the outlines (shapefile) of the regions to the output folder. """
+
+        if self.output_folder is None:
+            raise ValueError("Output folder is not set.")
+
+        outlines = self.outlines()
+        self.regions.to_csv(f"{self.output_folder}/hotspots_{self.variable_name}.csv", index=False)
+        outlines.to_file(f"{self.output_folder}/hotspots_{self.variable_name}.shp")
+
+        return outlines
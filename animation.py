@@ -0,0 +1,223 @@
+"""
+Streaming animation output of the time series exports: the rendered frames go straight into an animated GIF or APNG
+(Pillow) or an MP4 (piped into ffmpeg where it is installed) instead of one PNG per hour, optionally with blended
+frames between the hours for smooth playback.
+
+    tsd.set_animation("gif", fps=2, interpolation_steps=3)
+    tsd.export()                    # <output_folder>/timeseries.gif
+
+    with AnimationWriter("paraviewplus/figs/map.mp4", fps=2) as writer:
+        for time in timesteps:
+            ...                     # plot the frame
+            writer.add_figure()
+            plt.close()
+"""
+
+import shutil
+import subprocess
+from pathlib import Path
+
+import numpy as np
+import matplotlib
+from PIL import Image
+
+from profiling import span, count
+from pipeline import render_rgba
+
+
+FORMATS = ("gif", "apng", "mp4")
+
+
+def ffmpeg_path():
+    """ Path of the ffmpeg executable (matplotlib's animation.ffmpeg_path setting), None if it is not installed. """
+    return shutil.which(matplotlib.rcParams["animation.ffmpeg_path"])
+
+
+class AnimationWriter:
+    """
+    Writes frames into one animation file as they are rendered.
+
+    GIF and APNG are assembled by Pillow when the writer is closed (GIF frames are kept palette-quantized, 1 byte per
+    pixel), MP4 frames are streamed into an ffmpeg process and never kept in memory.
+
+    Attributes
+    ----------
+    path : Path
+        Animation file (.gif, .png/.apng or .mp4).
+    fps : float
+        Frames of data (hours) per second of playback, the blended frames play in between.
+    interpolation_steps : int
+        Blended frames inserted between two consecutive frames (0 = none).
+    frames : int
+        Frames written so far (including the blended frames).
+    """
+
+    def __init__(self, path, fps : float = 2, interpolation_steps : int = 0, loop : int = 0):
+        """
+        Params:
+        -------
+        - path: str, .gif, .png/.apng or .mp4 file
+        - fps: float, frames of data per second of playback
+        - interpolation_steps: int, blended frames inserted between two consecutive frames
+        - loop: int, number of loops of GIF and APNG (0 = forever)
+        """
+
+        self.path = Path(path)
+        self.format = {".gif": "gif", ".png": "apng", ".apng": "apng", ".mp4": "mp4"}.get(self.path.suffix.lower())
+        if self.format is None:
+            raise ValueError(f"Invalid animation file {path}, available suffixes: .gif, .png, .apng, .mp4")
+        if self.format == "mp4" and ffmpeg_path() is None:
+            raise RuntimeError("MP4 animations need ffmpeg (not found), write a GIF or APNG instead.")
+        if fps <= 0:
+            raise ValueError("fps has to be positive")
+
+        self.fps = fps
+        self.interpolation_steps = max(int(interpolation_steps), 0)
+        self.loop = loop
+        self.frames = 0
+        self._previous = None
+        self._size = None
+        self._images = []
+        self._process = None
+
+    @property
+    def frame_rate(self):
+        """ Frames per second of the file (including the blended frames). """
+        return self.fps * (self.interpolation_steps + 1)
+
+    def add_figure(self, fig=None):
+        """ Renders a figure (defaults to the current figure) and adds it as the next frame. """
+        self.add_frame(render_rgba(fig))
+
+    def add_frame(self, rgba : np.ndarray):
+        """
+        Adds the next frame.
+
+        Params:
+        -------
+        - rgba: np.ndarray (height x width x 4 or 3, uint8); frames of another size are scaled to the first frame
+        """
+
+        rgba = np.asarray(rgba, dtype=np.uint8)
+        if rgba.shape[2] == 3:
+            rgba = np.dstack([rgba, np.full(rgba.shape[:2], 255, np.uint8)])
+        if self._size is None:
+            self._size = (rgba.shape[1], rgba.shape[0])
+        elif (rgba.shape[1], rgba.shape[0]) != self._size:
+            rgba = np.asarray(Image.fromarray(rgba, "RGBA").resize(self._size, Image.Resampling.LANCZOS))
+
+        if self._previous is not None and self.interpolation_steps > 0:
+            with span("blend frames"):
+                previous, current = self._previous.astype(np.float32), rgba.astype(np.float32)
+                for step in range(1, self.interpolation_steps + 1):
+                    weight = step / (self.interpolation_steps + 1)
+                    self._write((previous + weight * (current - previous) + 0.5).astype(np.uint8))
+        self._write(rgba)
+        self._previous = rgba
+
+    def _write(self, rgba):
+        with span("encode frame"):
+            if self.format == "mp4":
+                if self._process is None:
+                    self._start_ffmpeg()
+                self._process.stdin.write(np.ascontiguousarray(rgba).tobytes())
+            elif self.format == "gif":
+                # quantized right away, so the frames take a quarter of the memory until the file is written
+                self._images.append(Image.fromarray(rgba, "RGBA").convert("RGB").quantize(256))
+            else:
+                self._images.append(Image.fromarray(rgba, "RGBA"))
+        self.frames += 1
+        count("animation frames")
+
+    def _start_ffmpeg(self):
+        width, height = self._size
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        command = [ffmpeg_path(), "-y", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", "rgba", "-s", f"{width}x{height}", "-r", str(self.frame_rate), "-i", "-",
+                   "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",  # yuv420p needs an even width and height
+                   "-c:v", "libx264", "-pix_fmt", "yuv420p", str(self.path)]
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def close(self):
+        """ Finishes the animation file. """
+
+        with span("write animation"):
+            if self._process is not None:
+                self._process.stdin.close()
+                error = self._process.stderr.read().decode()
+                if self._process.wait() != 0:
+                    raise RuntimeError(f"ffmpeg failed: {error}")
+                self._process = None
+            elif self._images:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                duration = 1000 / self.frame_rate
+                first, *rest = self._images
+                first.save(self.path, format="GIF" if self.format == "gif" else "PNG", save_all=True, append_images=rest,
+                           duration=duration, loop=self.loop)
+                self._images = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        elif self._process is not None:
+            self._process.kill()
+        return False
+
+
+class Animated:
+    """ Mixin of the time series exports: set_animation() streams the frames of the export into one animation. """
+
+    animation = None
+    interpolated_frames = False  # the export can render frames between the timesteps from temporally interpolated data
+
+    def set_animation(self, format : str = "gif", fps : float = 2, interpolation_steps : int = 0, blend : bool = True):
+        """
+        Streams the timestep frames of the export into one animation instead of saving a figure per timestep.
+
+        Params:
+        -------
+        - format: str, "gif", "apng" or "mp4" (needs ffmpeg), None saves a figure per timestep again
+        - fps: float, timesteps per second of playback
+        - interpolation_steps: int, frames between two timesteps for smooth playback
+        - blend: bool, the frames between the timesteps blend the rendered timesteps (fast). With False, they are
+          rendered from the data interpolated in time (see set_interpolation()) where the export supports it
+        """
+
+        if format is None:
+            self.animation = None
+            return
+        if format not in FORMATS:
+            raise ValueError(f"Invalid animation format {format}, available: {', '.join(FORMATS)}")
+        if format == "mp4" and ffmpeg_path() is None:
+            raise RuntimeError("MP4 animations need ffmpeg (not found), use 'gif' or 'apng' instead.")
+        self.animation = {"format": format, "fps": fps, "interpolation_steps": interpolation_steps, "blend": blend}
+
+    def _rendered_between(self):
+        """ Whether the frames between the timesteps are rendered from interpolated data. """
+        return (self.animation is not None and not self.animation["blend"] and self.interpolated_frames
+                and self.animation["interpolation_steps"] > 0)
+
+    def _animation_times(self, timesteps):
+        """ Times of the frames: the timesteps, and the times between them if those frames are rendered. """
+
+        if not self._rendered_between():
+            return list(timesteps)
+
+        steps = self.animation["interpolation_steps"] + 1
+        times = [t0 + (t1 - t0) * step / steps for t0, t1 in zip(timesteps[:-1], timesteps[1:]) for step in range(steps)]
+        return times + [timesteps[-1]]
+
+    def _animation_writer(self, folder, name):
+        """ AnimationWriter of <folder>/<name>.<format>, None without an animation. """
+
+        if self.animation is None:
+            return None
+        suffix = {"gif": ".gif", "apng": ".png", "mp4": ".mp4"}[self.animation["format"]]
+        path = Path(folder) / f"{name}{suffix}"
+        if self._rendered_between():
+            # every frame is rendered, the playback speed stays the same
+            return AnimationWriter(path, self.animation["fps"] * (self.animation["interpolation_steps"] + 1))
+        return AnimationWriter(path, self.animation["fps"], self.animation["interpolation_steps"])
@@ -0,0 +1,489 @@
+"""
+Benchmark suite: times the export path of every analysis class on a dataset (e.g. generated with synthetic.py) and
+records the runtime and the peak memory (traced python and numpy allocations, in a separate untimed run) to JSON.
+
+The regression gate stores the results of the main entry points (with the times of their profiled stages) as the baseline
+of the machine and compares later runs against it, exiting with a non-zero code if any case or stage got slower than the
+tolerance:
+
+    python synthetic.py bench/10k --cells 10000 --timesteps 24
+    python benchmark.py run bench/10k --output bench/10k/benchmark.json
+    python benchmark.py baseline bench/10k --repeat 3
+    python benchmark.py compare bench/10k --repeat 3 --tolerance 0.2
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+from shapely import LineString, box
+
+from graphmaker import (AOIsOnMap, TimeSeriesDemonstration, SimulationResults, UTCICategory, SimulationComparison,
+                        Windrose, Slice, Frequency, ComparisonMap)
+from inputs import SurfaceMesh, Scenario
+from analysis import ZonalStatistics, Hotspots
+from profiling import profiler
+from memory import budget
+from pipeline import pipeline
+
+import matplotlib.pyplot as plt
+plt.switch_backend("Agg")  # offline, no display (graphmaker selects TkAgg)
+
+
+def load_dataset(folder, date : str = "2021_07_15"):
+    """
+    Reads a Ferda-like dataset from <folder>/paraviewplus/shp.
+
+    Returns:
+    --------
+    dict with surfpoints, surfmesh, airpoints (gpd.GeoDataFrame), surfdata, airdata (pd.DataFrame) and the areas of interest.
+    """
+
+    shp = Path(folder) / "paraviewplus" / "shp"
+    data = {
+        "surfpoints": gpd.read_file(shp / "surface_point_SHP.shp"),
+        "surfmesh": gpd.read_file(shp / "surface_triangle_SHP.shp"),
+        "airpoints": gpd.read_file(shp / "air_point_SHP.shp"),
+        "surfdata": pd.read_csv(shp / f"surface_data_{date}.csv"),
+        "airdata": pd.read_csv(shp / f"air_data_{date}.csv"),
+    }
+
+    # areas of interest: two quarters of the area
+    xmin, ymin, xmax, ymax = data["surfpoints"].total_bounds
+    data["aois"] = [box(xmin, ymin, (xmin + xmax) / 2, (ymin + ymax) / 2), box((xmin + xmax) / 2, (ymin + ymax) / 2, xmax, ymax)]
+
+    return data
+
+
+def _scenario(data):
+    """ Design variant of the surface data (+2 °C air temperature). """
+    scenario = Scenario(data["surfdata"], "+2 °C")
+    scenario.add_delta("Tair", 2)
+    return scenario
+
+
+def _classify_surfaces(data, output_folder):
+    for name in ["walls", "ground", "rooftops"]:  # remove the cache of the surfaces of this dataset
+        for path in Path("paraviewplus/cache").glob(f"{name}.*"):
+            path.unlink()
+    SurfaceMesh(data["surfmesh"], data["surfdata"])._classify_surfaces()
+
+
+def _aois_on_map(data, output_folder):
+    aoimap = AOIsOnMap(data["surfpoints"], data["surfdata"], data["surfmesh"])
+    for aoi in data["aois"]:
+        aoimap.add_area_of_interest(aoi)
+    aoimap.set_output_folder(output_folder)
+    aoimap.export()
+
+
+def _time_series_demonstration(data, output_folder):
+    tsd = TimeSeriesDemonstration(data["surfpoints"], data["surfdata"], data["airpoints"], data["airdata"], data["surfmesh"], "15.07.2021")
+    tsd.add_variable("Tair")
+    tsd.add_variable("UTCI")
+    tsd.set_output_folder(output_folder)
+    tsd.export()
+
+
+def _simulation_results(data, output_folder):
+    sr = SimulationResults(data["surfpoints"], data["surfdata"], "Tair")
+    for aoi in data["aois"]:
+        sr.add_area_of_interest(aoi)
+    sr.set_output_folder(output_folder)
+    sr.export()
+
+
+def _simulation_comparison(data, output_folder):
+    sc = SimulationComparison(data["surfpoints"], data["surfdata"])
+    for aoi in data["aois"]:
+        sc.add_aoi(aoi)
+    sc.add_simulation(_scenario(data))
+    sc.add_variable("Tair")
+    sc.add_variable("UTCI")
+    sc.set_output_folder(output_folder)
+    sc.export()
+
+
+def _utci_category(data, output_folder):
+    utci = UTCICategory(data["surfpoints"], data["surfdata"], data["surfmesh"])
+    utci.set_output_folder(output_folder)
+    utci.export_all_categories()
+
+
+def _windrose(data, output_folder):
+    wr = Windrose(data["airpoints"], data["airdata"])
+    wr.set_output_folder(output_folder)
+    wr.export()
+
+
+def _slice(data, output_folder):
+    xmin, ymin, xmax, ymax = data["airpoints"].total_bounds
+    sl = Slice(data["airpoints"], data["airdata"], LineString([(xmin, ymin), (xmax, ymax)]), "Tair")
+    sl.set_output_folder(output_folder)
+    sl.export()
+
+
+def _frequency(data, output_folder):
+    fr = Frequency(data["surfpoints"], data["surfdata"], "Tair", data["surfmesh"])
+    fr.set_threshold(26)
+    for aoi in data["aois"]:
+        fr.add_area_of_interest(aoi)
+    fr.set_output_folder(output_folder)
+    fr.export()
+    fr.export_map(thresholds=[26, 30])
+
+
+def _frequency_bar_plot(data, output_folder):
+    fr = Frequency(data["surfpoints"], data["surfdata"], "Tair")
+    fr.set_threshold(26)
+    for aoi in data["aois"]:
+        fr.add_area_of_interest(aoi)
+    fr.bar_plot()
+
+
+def _slice_create_plot(data, output_folder):
+    xmin, ymin, xmax, ymax = data["airpoints"].total_bounds
+    Slice(data["airpoints"], data["airdata"], LineString([(xmin, ymin), (xmax, ymax)]), "Tair")._create_plot()
+
+
+def _comparison_map(data, output_folder):
+    cm = ComparisonMap(data["surfpoints"], data["surfdata"])
+    cm.add_simulation(_scenario(data))
+    cm.set_variable("Tair")
+    cm.set_output_folder(output_folder)
+    cm.export()
+
+
+def _zonal_statistics(data, output_folder):
+    zs = ZonalStatistics(data["surfpoints"], gpd.GeoDataFrame(geometry=data["aois"], crs=data["surfpoints"].crs))
+    zs.add_simulation(data["surfdata"], "Existing")
+    zs.add_simulation(_scenario(data), "New design")
+    zs.add_variable("Tair")
+    zs.add_variable("UTCI")
+    zs.export(f"{output_folder}/zonal_statistics.csv")
+
+
+def _hotspots(data, output_folder):
+    hs = Hotspots(data["surfmesh"], data["surfdata"], "UTCI", threshold=32)
+    hs.set_output_folder(output_folder)
+    hs.export()
+
+
+# name: function(data, output_folder) running the export path of the analysis
+CASES = {
+    "classify_surfaces": _classify_surfaces,
+    "aois_on_map": _aois_on_map,
+    "time_series_demonstration": _time_series_demonstration,
+    "simulation_results": _simulation_results,
+    "simulation_comparison": _simulation_comparison,
+    "utci_category": _utci_category,
+    "windrose": _windrose,
+    "slice": _slice,
+    "frequency": _frequency,
+    "frequency_bar_plot": _frequency_bar_plot,
+    "slice_create_plot": _slice_create_plot,
+    "comparison_map": _comparison_map,
+    "zonal_statistics": _zonal_statistics,
+    "hotspots": _hotspots,
+}
+
+# main entry points checked by the regression gate (baseline and compare)
+GATE_CASES = ["comparison_map", "time_series_demonstration", "simulation_comparison", "frequency_bar_plot",
+              "slice_create_plot", "classify_surfaces"]
+
+
+def machine_info():
+    """ Description of the machine the benchmarks run on. """
+    return {"node": platform.node(), "system": platform.system(), "machine": platform.machine(),
+            "processor": platform.processor(), "cpus": os.cpu_count(), "python": platform.python_version(),
+            "numpy": np.__version__, "pandas": pd.__version__, "geopandas": gpd.__version__}
+
+
+def _run(case, data, output_folder):
+    """ Runs the case once, returns the runtime (s) and the error (None if the case finished). """
+
+    error = None
+    start = time.perf_counter()
+    try:
+        CASES[case](data, output_folder)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    runtime = time.perf_counter() - start
+    plt.close("all")
+
+    return runtime, error
+
+
+def stage_totals(stages):
+    """
+    Total time of every stage of a timing tree (see profiling.Profiler.to_dict()).
+
+    Returns:
+    --------
+    dict {path of the stage, e.g. "ComparisonMap.export/tricontourf": total (s)}
+    """
+
+    totals = {}
+
+    def walk(nodes, prefix):
+        for node in nodes:
+            path = f"{prefix}/{node['name']}" if prefix else node["name"]
+            totals[path] = totals.get(path, 0) + node["total"]
+            walk(node["children"], path)
+
+    walk(stages["tree"], "")
+
+    return totals
+
+
+def run_case(case, data, output_folder, profile : bool = False, repeat : int = 1):
+    """
+    Runs one benchmark case: the timed runs first, then one run tracing the allocations with tracemalloc for the peak
+    memory. Tracing slows down allocation-heavy code severalfold, so the traced run is not timed.
+
+    Params:
+    -------
+    - case: str, name of the case (see CASES)
+    - data: dict (see load_dataset())
+    - output_folder: str, folder of the figures
+    - profile: bool, record the timing tree of the stages of each timed run
+    - repeat: int, number of timed runs
+
+    Returns:
+    --------
+    dict with runtime (s, minimum of the timed runs), peak_memory (bytes of traced allocations) and error (None if the
+    case finished). With profile, also the timing tree of the stages and the counters of the fastest run (see
+    profiling.Profiler) and the minimum time of each stage over the timed runs (stage_totals).
+    """
+
+    runs = []
+    for _ in range(repeat):
+        if profile:
+            profiler.reset()
+            profiler.enable()
+        runtime, error = _run(case, data, output_folder)
+        if profile:
+            profiler.disable()
+        runs.append({"runtime": runtime, "error": error, "stages": profiler.to_dict() if profile else None})
+
+    fastest = min(runs, key=lambda run: run["runtime"])
+    result = {"runtime": fastest["runtime"], "error": runs[-1]["error"]}
+
+    tracemalloc.start()
+    _run(case, data, output_folder)
+    result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    if profile:
+        result["stages"] = fastest["stages"]
+        totals = [stage_totals(run["stages"]) for run in runs]
+        result["stage_totals"] = {stage: min(t.get(stage, np.inf) for t in totals) for stage in totals[-1]}
+
+    return result
+
+
+def run_benchmarks(dataset_folder, output : str = None, cases : list = None, repeat : int = 1, profile : bool = False,
+                   print_stages : bool = False):
+    """
+    Runs the benchmark cases on a dataset and saves the results to JSON.
+
+    The cases run inside the dataset folder, so the caches (paraviewplus/cache) and the figures (paraviewplus/bench_figs)
+    belong to the dataset. The runtime is the minimum over the repeats, the peak memory is traced in a separate run.
+
+    Params:
+    -------
+    - dataset_folder: str, folder with paraviewplus/shp (and synthetic.json if generated with synthetic.py)
+    - output: str, path of the JSON file (defaults to <dataset_folder>/benchmark.json)
+    - cases: list of case names (defaults to all, see CASES)
+    - repeat: int, number of runs of each case
+    - profile: bool, record the timing tree of the stages of each case
+    - print_stages: bool, print the timing tree of each case (with profile)
+
+    Returns:
+    --------
+    dict with the machine, the dataset and the results of the cases.
+    """
+
+    dataset_folder = Path(dataset_folder).resolve()
+    output = Path(output).resolve() if output is not None else dataset_folder / "benchmark.json"
+    cases = list(CASES) if cases is None else cases
+
+    metadata_path = dataset_folder / "synthetic.json"
+    dataset = json.loads(metadata_path.read_text()) if metadata_path.is_file() else {}
+    dataset.pop("files", None)
+
+    results = {}
+    with contextlib.chdir(dataset_folder):
+        data = load_dataset(".", dataset.get("date", "2021_07_15"))
+        dataset.update({"n_cells": len(data["surfpoints"]), "n_air": len(data["airpoints"]),
+                        "n_timesteps": int(data["surfdata"]["Time"].nunique())})
+
+        output_folder = Path("paraviewplus/bench_figs")
+        if output_folder.exists():
+            shutil.rmtree(output_folder)
+        output_folder.mkdir(parents=True)
+        Path("paraviewplus/cache").mkdir(parents=True, exist_ok=True)
+        SurfaceMesh(data["surfmesh"], data["surfdata"])._classify_surfaces()  # classes files used by the cases without a mesh
+
+        for case in cases:
+            results[case] = run_case(case, data, str(output_folder), profile, repeat)
+            print(f"{case:<28} {results[case]['runtime']:8.2f} s {results[case]['peak_memory'] / 2**20:9.1f} MB"
+                  + (f"  {results[case]['error']}" if results[case]["error"] else ""))
+            if profile and print_stages:
+                print(profiler.report(min_share=0.01))
+            if budget.active:
+                print(budget.report())
+                budget.reset_peaks()
+
+    report = {"created": datetime.now().isoformat(timespec="seconds"), "machine": machine_info(), "dataset": dataset,
+              "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, "results": results}
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+
+    return report
+
+
+def machine_key():
+    """ Name of the baseline file of this machine. """
+    return f"{platform.node()}_{platform.system()}_{platform.machine()}".replace(" ", "-").lower()
+
+
+def baseline_path(dataset_folder, baseline_folder : str = None):
+    """ Baseline of this machine: <baseline_folder>/<machine_key()>.json, baseline_folder defaults to <dataset_folder>/baselines. """
+    folder = Path(baseline_folder) if baseline_folder is not None else Path(dataset_folder) / "baselines"
+    return folder / f"{machine_key()}.json"
+
+
+def save_baseline(dataset_folder, baseline_folder : str = None, cases : list = None, repeat : int = 3):
+    """ Runs the gate cases and stores the results as the baseline of this machine. """
+
+    path = baseline_path(dataset_folder, baseline_folder)
+    report = run_benchmarks(dataset_folder, path, GATE_CASES if cases is None else cases, repeat, profile=True)
+    print(f"Baseline saved to {path}")
+
+    return report
+
+
+def compare(report : dict, baseline : dict, tolerance : float = 0.2, min_difference : float = 0.05):
+    """
+    Compares benchmark results with the baseline: the runtime of each case, and the time of each profiled stage of the
+    case (where both were run with profile, see stage_totals()).
+
+    Params:
+    -------
+    - report, baseline: dict (see run_benchmarks())
+    - tolerance: float, allowed relative slowdown (0.2 = 20 %)
+    - min_difference: float, slowdowns smaller than this (s) are ignored (timer noise of fast cases and stages)
+
+    Returns:
+    --------
+    list of dicts with the regressions (case, stage (None for the whole case), baseline and current time, ratio, reason).
+    """
+
+    regressions = []
+    for case, current in report["results"].items():
+        if case not in baseline["results"]:
+            continue
+        reference = baseline["results"][case]
+        ratio = current["runtime"] / reference["runtime"] if reference["runtime"] > 0 else np.inf
+
+        reason = None
+        if current["error"] is not None and reference["error"] is None:
+            reason = f"fails: {current['error']}"
+        elif current["error"] is None and ratio > 1 + tolerance and current["runtime"] - reference["runtime"] > min_difference:
+            reason = f"{100 * (ratio - 1):.0f} % slower"
+
+        print(f"{case:<28} {reference['runtime']:8.2f} s -> {current['runtime']:8.2f} s ({ratio:5.2f}x)"
+              f" {reference['peak_memory'] / 2**20:8.1f} MB -> {current['peak_memory'] / 2**20:8.1f} MB" + (f"  REGRESSION {reason}" if reason else ""))
+        if reason:
+            regressions.append({"case": case, "stage": None, "baseline": reference["runtime"], "current": current["runtime"], "ratio": ratio, "reason": reason})
+
+        if current["error"] is not None or "stage_totals" not in current or "stage_totals" not in reference:
+            continue
+        for stage, total in current["stage_totals"].items():
+            before = reference["stage_totals"].get(stage)
+            if before is None:
+                continue
+            stage_ratio = total / before if before > 0 else np.inf
+            if stage_ratio > 1 + tolerance and total - before > min_difference:
+                reason = f"stage {stage} {100 * (stage_ratio - 1):.0f} % slower"
+                print(f"  {stage:<60} {before:8.2f} s -> {total:8.2f} s ({stage_ratio:5.2f}x)  REGRESSION")
+                regressions.append({"case": case, "stage": stage, "baseline": before, "current": total, "ratio": stage_ratio, "reason": reason})
+
+    return regressions
+
+
+def check(dataset_folder, baseline_folder : str = None, cases : list = None, repeat : int = 3, tolerance : float = 0.2,
+          min_difference : float = 0.05, output : str = None):
+    """
+    Runs the cases of the baseline of this machine and compares them with it.
+
+    Returns:
+    --------
+    list of the regressions (see compare()).
+    """
+
+    path = baseline_path(dataset_folder, baseline_folder)
+    if not path.is_file():
+        raise FileNotFoundError(f"No baseline for this machine ({path}), create it with: python benchmark.py baseline {dataset_folder}")
+
+    baseline = json.loads(path.read_text())
+    if cases is None:
+        cases = list(baseline["results"])
+    if output is None:
+        output = Path(dataset_folder) / "benchmark_compare.json"
+
+    report = run_benchmarks(dataset_folder, output, cases, repeat, profile=True)
+    regressions = compare(report, baseline, tolerance, min_difference)
+    print(f"{len(regressions)} regression{'s' if len(regressions) != 1 else ''} (tolerance {100 * tolerance:.0f} %)")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times the export path of the analysis classes on a dataset.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and save the results")
+    baseline_parser = subparsers.add_parser("baseline", help="save the results of the gate cases as the baseline of this machine")
+    compare_parser = subparsers.add_parser("compare", help="compare with the baseline of this machine, exit code 1 on regressions")
+
+    for subparser in (run_parser, baseline_parser, compare_parser):
+        subparser.add_argument("dataset_folder")
+        subparser.add_argument("--cases", nargs="+", default=None, choices=list(CASES))
+        subparser.add_argument("--repeat", type=int, default=1 if subparser is run_parser else 3)
+    run_parser.add_argument("--output", default=None, help="JSON file (default: <dataset_folder>/benchmark.json)")
+    run_parser.add_argument("--profile", action="store_true", help="record the timing tree of the stages of each case")
+    run_parser.add_argument("--max-memory", default=None, help="memory budget of the exports, e.g. 2GB (float32 data, chunked processing)")
+    run_parser.add_argument("--writers", type=int, default=0, help="write the figures in this many background threads (pipelined export)")
+    run_parser.add_argument("--compress-level", type=int, default=6, help="PNG compression level 0-9 of the pipelined export")
+    run_parser.add_argument("--format", default="png", choices=pipeline.FORMATS, help="image format of the pipelined export")
+    for subparser in (baseline_parser, compare_parser):
+        subparser.add_argument("--baseline-folder", default=None, help="folder of the baselines (default: <dataset_folder>/baselines)")
+    compare_parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown (default 0.2 = 20 %%)")
+    compare_parser.add_argument("--min-difference", type=float, default=0.05, help="ignored slowdowns in seconds (default 0.05)")
+    compare_parser.add_argument("--output", default=None, help="JSON file (default: <dataset_folder>/benchmark_compare.json)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        budget.set_max_memory(args.max_memory)
+        if args.writers > 0:
+            pipeline.enable(args.writers, compress_level=args.compress_level, format=args.format)
+        run_benchmarks(args.dataset_folder, args.output, args.cases, args.repeat, args.profile, args.profile)
+    elif args.command == "baseline":
+        save_baseline(args.dataset_folder, args.baseline_folder, args.cases, args.repeat)
+    else:
+        regressions = check(args.dataset_folder, args.baseline_folder, args.cases, args.repeat, args.tolerance, args.min_difference, args.output)
+        sys.exit(1 if regressions else 0)
@@ -6,19 +6,63 @@ import matplotlib
 matplotlib.use("TkAgg")
 from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg, NavigationToolbar2Tk)
 import matplotlib.pyplot as plt
+import matplotlib.tri as tri
 from matplotlib.colors import ListedColormap, BoundaryNorm
 from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 from windrose import WindroseAxes
 from shapely import LineString, Point
-import scipy.interpolate as interp
 import tkinter as tk
 import customtkinter as ctk
-from datetime import datetime
+from datetime import datetime, timedelta
 from shapely import Polygon, Point
 import os
 
 
-from inputs import SurfaceMesh, AirPoints, SurfacePoints, VariableChars
+from inputs import SurfaceMesh, AirPoints, SurfacePoints, VariableChars, Scenario, cell_time_array, data_version
+from analysis import Exceedance
+from interpolation import PointProbe, TemporalInterpolator
+from profiling import span, timed, count
+from memory import budgeted, budget
+from manifest import manifest, fingerprint
+from pipeline import pipeline, pipelined
+from animation import Animated
+from contextlib import nullcontext
+
+
+def _base_date(base_date):
+    """ Time 0 of the data as datetime: "15.7.2021" or a datetime (e.g. SimulationCatalog.base_date for several days). """
+    return datetime.strptime(base_date, "%d.%m.%Y") if isinstance(base_date, str) else pd.Timestamp(base_date).to_pydatetime()
+
+
+def _time_title(time, base_date=None):
+    """ Title of a time of the data: date and time of day if the base date (Time 0) is known, the hours otherwise. """
+    if base_date is None:
+        return f"Time: {time:g}"
+    when = base_date + timedelta(hours=float(time))
+    return f"Date: {when.strftime('%d.%m.%Y')} Time: {when.hour}H{when.minute}M"
+
+
+def _savefig(path, key : str = None, writer=None):
+    """
+    Saves the current figure (the save stage: Agg rendering, PNG encoding and writing) and records its fingerprint.
+    With the export pipeline enabled, only the rendering runs here and a writer thread encodes and writes the figure.
+    With an animation writer (see animation.py), the figure is added as its next frame instead.
+    """
+    if writer is not None:
+        writer.add_figure()
+        return
+
+    on_written = None if key is None else (lambda output: manifest.record(output, key))
+    if pipeline.enabled:
+        pipeline.submit(path, on_written)
+        return
+
+    with span("savefig"):
+        plt.savefig(path)
+    count("frames written")
+    if on_written is not None:
+        on_written(path)
+
 
 def create_folder_structure():
 
@@ -104,15 +148,24 @@ class AOIsOnMap(SurfacePoints, SurfaceMesh):
         self._create_plot()
         plt.show()
 
+    @budgeted
+    @timed()
+    @pipelined
     def export(self):
-        """ Export the plot. """
+        """ Export the plot (skipped if the areas of interest and the map did not change, see manifest.py). """
+
+        path = f"{self.output_folder}/aois_{self.plot_type}.png"
+        key = fingerprint(type(self).__name__, self.plot_type, self.aois,
+                          self.surfpoints if self.plot_type == "points" else self.surfmesh.geometry) if manifest.enabled else None
+        if self.output_folder is not None and manifest.is_current(pipeline.output_path(path), key):
+            return
 
         self._create_plot()
         if self.output_folder is not None:
-            plt.savefig(f"{self.output_folder}/aois_{self.plot_type}")
+            _savefig(path, key)
             plt.close()
 
-class TimeSeriesDemonstration(SurfaceMesh, SurfacePoints, AirPoints, VariableChars):
+class TimeSeriesDemonstration(SurfaceMesh, SurfacePoints, AirPoints, VariableChars, Animated):
     """
     A class to visualize time-series simulation data on a 2D mesh, specifically for
     surface and air properties across multiple variables.
@@ -131,15 +184,17 @@ class TimeSeriesDemonstration(SurfaceMesh, SurfacePoints, AirPoints, VariableCha
         Surface mesh. (Ferda folder: surface_triangle_shp.shp)
     """
 
+    interpolated_frames = True  # animation frames between the timesteps can be rendered from interpolated data
+
     def __init__(self, surfpoints : gpd.GeoDataFrame, surfdata : pd.DataFrame, airpoints : gpd.GeoDataFrame, airdata : pd.DataFrame, surfmesh : gpd.GeoDataFrame, 
-                 base_date : str) -> None:
+                 base_date : str | datetime) -> None:
 
         self.surfpoints = surfpoints
         self.surfdata = surfdata
         self.airpoints = airpoints
         self.airdata = airdata
         self.surfmesh = surfmesh
-        self.base_date = datetime.strptime(base_date, "%d.%m.%Y")
+        self.base_date = _base_date(base_date)
 
         SurfacePoints.__init__(self, self.surfpoints, self.surfdata)
         AirPoints.__init__(self, self.airpoints, self.airdata)
@@ -152,7 +207,7 @@ class TimeSeriesDemonstration(SurfaceMesh, SurfacePoints, AirPoints, VariableCha
         self.output_folder = None
         self.vars = []
 
-        self.time = 1
+        self.time = self.get_timesteps()[0]
 
     def add_variable(self, variable_name):
         if len(self.vars) > 4:
@@ -163,10 +218,9 @@ class TimeSeriesDemonstration(SurfaceMesh, SurfacePoints, AirPoints, VariableCha
         self.output_folder = output_folder
 
     def set_time(self, time):
-        if time not in self.get_timesteps():
-            raise ValueError(f"Selected time not in timesteps!! You selected {time} but timesteps are: {self.get_timesteps()}")
-        else:
-            self.time = time
+        """ Set the time of the plot: a timestep or any time in between (interpolated, see set_interpolation()). """
+        self._check_time(time)
+        self.time = time
     
     def _walls_rooftops(self):
         """ 
@@ -222,30 +276,36 @@ class TimeSeriesDemonstration(SurfaceMesh, SurfacePoints, AirPoints, VariableCha
         - time: current timestep
         """
 
-        if variable_name in self.surfdata.columns:
-            merged = gpd.GeoDataFrame(pd.merge(self.surfdata, self.surfpoints[["cell_ID", "geometry"]])).dropna()
-            subset = merged[merged["Time"] == self.time]
-        else:
-            merged = gpd.GeoDataFrame(pd.merge(self.airdata, self.airpoints[["cell_ID", "geometry"]])).dropna()
-            subset = merged[merged["Time"] == self.time]
+        # select the timestep before merging, the colour scale is looked up in the statistics catalog (same for all timesteps)
+        with span("merge"):
+            if variable_name in self.surfdata.columns:
+                subset = gpd.GeoDataFrame(pd.merge(self.get_timestep_data(self.time, [variable_name], self.surfdata), self.surfpoints[["cell_ID", "geometry"]])).dropna()
+                dataset, data = "surface", self.surfdata
+            else:
+                subset = gpd.GeoDataFrame(pd.merge(self.get_timestep_data(self.time, [variable_name], self.airdata), self.airpoints[["cell_ID", "geometry"]])).dropna()
+                dataset, data = "air", self.airdata
+        value_range = self.get_catalog({dataset: data}).get_range(variable_name, [dataset])
 
         # plot the surface
         import matplotlib.tri as tri
-        triang = tri.Triangulation(subset.geometry.x, subset.geometry.y)
+        with span("triangulation"):
+            triang = tri.Triangulation(subset.geometry.x, subset.geometry.y)
+        count("points rendered", len(subset))
         if variable_name == "UTCI":
             levels = [9, 26, 32, 38, 46, 50]  # levels same as ticks for utci
             ticks = levels
             norm = BoundaryNorm(levels, ncolors=cmap.N, clip=True)
-            contour = ax.tricontourf(triang, subset[variable_name], levels=levels, cmap=cmap, norm=norm)
+            with span("tricontourf"):
+                contour = ax.tricontourf(triang, subset[variable_name], levels=levels, cmap=cmap, norm=norm)
         elif variable_name == "WindDirection":
-            self.plot_windflow(self.time)
+            self.plot_windflow(self.time, surfacemesh=self.surfmesh)
         else: 
             if variable_name == "WindSpeed":
-                min_value = 5 * (min(merged[variable_name]) // 5)
-                max_value = 5 * (max(merged[variable_name]) // 5)
+                min_value = 5 * (value_range[0] // 5)
+                max_value = 5 * (value_range[1] // 5)
             else: 
-                min_value = 10 * (min(merged[variable_name]) // 10)
-                max_value = 10 * (max(merged[variable_name]) // 10)
+                min_value = 10 * (value_range[0] // 10)
+                max_value = 10 * (value_range[1] // 10)
 
             if variable_name == "Tair":
                 levels = np.arange(min_value, max_value + 1, 1)
@@ -257,11 +317,13 @@ class TimeSeriesDemonstration(SurfaceMesh, SurfacePoints, AirPoints, VariableCha
                 levels = np.arange(0, 1.1, 0.1)
                 ticks = np.arange(0, 1.1, 0.2)
 
-            contour = ax.tricontourf(triang, subset[variable_name], levels=levels, cmap=cmap)
+            with span("tricontourf"):
+                contour = ax.tricontourf(triang, subset[variable_name], levels=levels, cmap=cmap)
         
         # plot the buildings (walls)
-        self.walls.plot(ax=ax, edgecolor='black', linewidth=0.5)
-        self.rooftops.plot(ax=ax, edgecolor='black', linewidth=0.5, color='white')
+        with span("overlay"):
+            self.walls.plot(ax=ax, edgecolor='black', linewidth=0.5)
+            self.rooftops.plot(ax=ax, edgecolor='black', linewidth=0.5, color='white')
 
         if variable_name != "WindDirection":
             self._layout_time_series_sim(fig, ax, contour, levels, ticks, variable_name)
@@ -310,24 +372,42 @@ class TimeSeriesDemonstration(SurfaceMesh, SurfacePoints, AirPoints, VariableCha
                 plt.subplot(n, m, i+1) 
                 self._plot_time_series_sim(fig, ax, name, cmap)
 
-        from datetime import timedelta
-
-        new_datetime = self.base_date + timedelta(hours=int(self.time))
-
-        plt.suptitle(f"Date: {new_datetime.strftime("%d.%m.%Y")} Time: {new_datetime.hour}H{new_datetime.minute}M", fontsize = 40)
+        plt.suptitle(_time_title(self.time, self.base_date), fontsize = 40)
 
     def plot(self):
         """ Show the plot. """
         self._create_plot()
         plt.show()
 
+    @budgeted
+    @timed()
+    @pipelined
     def export(self):
-        """ Save the plot as figure in output folder. """
-        for time in self.get_timesteps():
-            self.time = time
-            self._create_plot()
-            plt.savefig(f"{self.output_folder}/timeseries_{self.time}.png")
-            plt.close()
+        """
+        Save the plot as figure in output folder (timesteps whose data and settings did not change are skipped, see
+        manifest.py), or all the timesteps as one animation (see set_animation()).
+        """
+
+        # the colour scales use the range of all timesteps, the maps the data of the timestep
+        writer = self._animation_writer(self.output_folder, "timeseries")
+        keyed = writer is None and manifest.enabled
+        if keyed:
+            datasets = [("surface", self.surfdata) if variable_name in self.surfdata.columns else ("air", self.airdata) for variable_name in self.vars]
+            ranges = [self.get_catalog({name: data}).get_range(variable_name, [name]) for (name, data), variable_name in zip(datasets, self.vars)
+                      if variable_name in data.columns]
+            static = fingerprint(type(self).__name__, self.vars, self.base_date, ranges, self.surfpoints.geometry, self.airpoints.geometry,
+                                 self.walls.geometry, self.rooftops.geometry)
+
+        with writer or nullcontext():
+            for time in self._animation_times(self.get_timesteps()):
+                path = f"{self.output_folder}/timeseries_{time}.png"
+                key = fingerprint(static, time, [data[data["Time"] == time] for name, data in dict(datasets).items()]) if keyed else None
+                if writer is None and manifest.is_current(pipeline.output_path(path), key):
+                    continue
+                self.time = time
+                self._create_plot()
+                _savefig(path, key, writer)
+                plt.close()
         
 class SimulationResults(SurfacePoints, VariableChars):
     """ Plots the simulation results for the chosen areas of interest in one plot for each selected variable. """
@@ -394,6 +474,19 @@ class SimulationResults(SurfacePoints, VariableChars):
 
         plot_frame = ctk.CTkFrame(master)
 
+        self._create_plot()
+
+        self.canvas = FigureCanvasTkAgg(self.fig, master=plot_frame)
+        self.canvas.draw()
+        self.canvas.get_tk_widget().pack()
+
+        #self.root.update()
+
+        return plot_frame
+
+    def _create_plot(self):
+        """ Creates the figure of the variable over time for all AOIs (shown by update_plot(), saved by export()). """
+
         self.fig, self.ax = plt.subplots(figsize=(12, 5), facecolor='#F2F2F2')
 
         colors = self.get_colors()
@@ -408,28 +501,31 @@ class SimulationResults(SurfacePoints, VariableChars):
         self.ax.set_title(self.title, fontsize=18, fontweight='bold', y=1.1)
         plt.subplots_adjust(top=0.85, bottom=0.2)
 
-        self.canvas = FigureCanvasTkAgg(self.fig, master=plot_frame)
-        self.canvas.draw()
-        self.canvas.get_tk_widget().pack()
-
-        #self.root.update()
-
-        return plot_frame
-
     # def show(self):
     #     self.update_plot()
     #     self.root.mainloop()
 
+    @budgeted
+    @timed()
+    @pipelined
     def export(self):
-        self.plot()
-        plt.savefig(f'{self.output_folder}/' + f'{self.variable_name}.png')  
+        """ Save the plot as figure in output folder (skipped if the data and settings did not change, see manifest.py). """
+
+        path = f'{self.output_folder}/' + f'{self.variable_name}.png'
+        key = fingerprint(type(self).__name__, self.variable_name, self.title, self.get_colors(), self.areas_of_interest,
+                          self.surfdata[["cell_ID", "Time", self.variable_name]]) if manifest.enabled else None
+        if manifest.is_current(pipeline.output_path(path), key):
+            return
+
+        self._create_plot()
+        _savefig(path, key)
         plt.close()
     
     def exit(self):
         self.root.destroy()
 
 
-class UTCICategory(SurfacePoints, SurfaceMesh):
+class UTCICategory(SurfacePoints, SurfaceMesh, Animated):
 
     def __init__(self, surfpoints : gpd.GeoDataFrame, surfdata : pd.DataFrame, surfmesh : gpd.GeoDataFrame) -> None:
         self.surfpoints = surfpoints
@@ -439,10 +535,25 @@ class UTCICategory(SurfacePoints, SurfaceMesh):
         SurfacePoints.__init__(self, surfpoints, surfdata)
 
         self.categories = []
-    
+
+        # Define UTCI categories and plotting colors (ordered from the lowest to the highest bounds)
+        self.utci = {
+            'no': {'bounds': (9, 26), 'color': 'lightgreen'},
+            'moderate': {'bounds': (26, 32), 'color': 'orange'},
+            'strong': {'bounds': (32, 38), 'color': 'orangered'},
+            'very_strong': {'bounds': (38, 46), 'color': 'red'},
+            'extreme': {'bounds': (46, 50), 'color': 'darkred'}
+        }
+        self.category_names = list(self.utci.keys())
+
         # creates walls and rooftops dataframes for plotting
         self.walls, self.rooftops = self._walls_rooftops()
 
+        # category of each cell (rows, same order as surfpoints) for each timestep (columns), computed only once
+        self.timesteps = self.get_timesteps()
+        self.category_index = self._category_index()
+        self.triang = None  # triangulation of the points, created with the first map
+
         self.output_folder = None
 
     def set_output_folder(self, output_folder):
@@ -458,6 +569,27 @@ class UTCICategory(SurfacePoints, SurfaceMesh):
 
         return walls, rooftops
 
+    def _category_index(self):
+        """
+        Classifies UTCI of every cell and timestep into the UTCI categories.
+
+        Returns:
+        --------
+        np.ndarray (int8) of shape (cells, timesteps) with the position of the category in self.category_names.
+        Values below the lowest bound and nans are -1, values above the highest bound belong to the highest category.
+        """
+
+        cell_IDs = self.surfpoints["cell_ID"].values
+        bounds = [self.utci[cat]['bounds'][0] for cat in self.category_names]
+
+        # under a memory budget, chunks of timesteps (pivoted values and digitized indices: about 16 bytes per cell)
+        index = np.empty((len(cell_IDs), len(self.timesteps)), dtype=np.int8)
+        for chunk in budget.chunks(16 * len(cell_IDs), len(self.timesteps)):
+            values = cell_time_array(self.surfdata, "UTCI", cell_IDs=cell_IDs, timesteps=self.timesteps[chunk])
+            index[:, chunk] = np.where(np.isnan(values), -1, np.digitize(values, bounds) - 1)
+
+        return index
+
     def add_category(self, category):
         """ Add category to list of categories to plot. """
         self.categories.append(category)
@@ -466,45 +598,193 @@ class UTCICategory(SurfacePoints, SurfaceMesh):
         """ Remove category from list of categories to plot. """
         self.categories.remove(category)
 
-    def _create_plot(self, cat, time):
+    def _masked_triangulation(self, valid):
+        """ Masks the triangles which have a vertex without a valid value (nans or not classified cells). """
 
-        # Define UTCI categories and plotting colors
-        utci = {
-            'extreme': {'bounds': (46, 50), 'color': 'darkred'},
-            'very_strong': {'bounds': (38, 46), 'color': 'red'},
-            'strong': {'bounds': (32, 38), 'color': 'orangered'},
-            'moderate': {'bounds': (26, 32), 'color': 'orange'},
-            'no': {'bounds': (9, 26), 'color': 'lightgreen'}
-        }
+        if self.triang is None:
+            with span("triangulation"):
+                self.triang = tri.Triangulation(self.surfpoints.geometry.x.values, self.surfpoints.geometry.y.values)
+        self.triang.set_mask(~valid[self.triang.triangles].all(axis=1))
+        count("points rendered", int(valid.sum()))
 
-        fig, ax = plt.subplots()
+        return self.triang
+
+    def _export_key(self, *parts):
+        """ Fingerprint of the settings and the map shared by all the figures and parts (None without a manifest, see manifest.py). """
+        if not manifest.enabled:
+            return None
+        return fingerprint(type(self).__name__, self.utci, self.timesteps, self.surfpoints.geometry, self.walls.geometry, self.rooftops.geometry, *parts)
+
+    def _plot_buildings(self, ax):
+        """ Plots the buildings (walls and rooftops) above the map. """
 
-        # extract area with UTCI according to selected temperature
-        temps = self.surfdata[["cell_ID", "UTCI", "Time"]].dropna()
-        temps = temps.where(temps["Time"] == time).dropna()
+        with span("overlay"):
+            self.walls.plot(ax=ax, edgecolor='black', linewidth=0.5)
+            self.rooftops.plot(ax=ax, edgecolor='black', linewidth=0.5, color='white')
+        ax.axis('off')
+
+    def _create_plot(self, cat, time):
 
-        # merge csv with gpd
-        subset = gpd.GeoDataFrame(pd.merge(temps, self.surfpoints[["cell_ID", "geometry"]]))
+        fig, ax = plt.subplots()
+
+        # extract area with UTCI according to selected category
+        index = self.category_index[:, self.timesteps.index(time)]
+        triang = self._masked_triangulation(index >= 0)
 
         # plot the UTCI category
-        contour = ax.tricontourf(subset.geometry.x, subset.geometry.y, subset.UTCI, levels=utci[cat]['bounds'], colors=utci[cat]["color"])
+        with span("tricontourf"):
+            contour = ax.tricontourf(triang, (index == self.category_names.index(cat)).astype(float), levels=(0.5, 1.5), colors=self.utci[cat]["color"])
 
         # plot the surface (walls)
-        self.walls.plot(ax=ax, edgecolor='black', linewidth=0.5)
-        self.rooftops.plot(ax=ax, edgecolor='black', linewidth=0.5, color='white')
-        ax.axis('off')
+        self._plot_buildings(ax)
         plt.title(f'UTCI: {cat} (hour {time})')
 
+    def _create_plot_all_categories(self, time):
+        """ Plots all the UTCI categories in one map for the selected time. """
+
+        fig, ax = plt.subplots()
+
+        index = self.category_index[:, self.timesteps.index(time)]
+        triang = self._masked_triangulation(index >= 0)
+
+        levels = np.arange(len(self.category_names) + 1) - 0.5
+        colors = [self.utci[cat]['color'] for cat in self.category_names]
+        with span("tricontourf"):
+            contour = ax.tricontourf(triang, index.astype(float), levels=levels, colors=colors)
+
+        # legend with the category colors
+        from matplotlib.patches import Patch
+        handles = [Patch(color=self.utci[cat]['color'], label=cat) for cat in self.category_names]
+        ax.legend(handles=handles, loc='lower left', fontsize=6, frameon=False)
+
+        self._plot_buildings(ax)
+        plt.title(f'UTCI categories (hour {time})')
+
+    def _create_plot_duration(self, cat):
+        """ Plots the number of hours the cells spend in the selected category. """
+
+        fig, ax = plt.subplots()
+
+        hours = (self.category_index == self.category_names.index(cat)).sum(axis=1)
+        triang = self._masked_triangulation((self.category_index >= 0).any(axis=1))
+
+        levels = np.arange(len(self.timesteps) + 2) - 0.5
+        with span("tricontourf"):
+            contour = ax.tricontourf(triang, hours.astype(float), levels=levels, cmap='Reds')
+        cbar = fig.colorbar(contour, ax=ax, shrink=0.6, ticks=np.arange(0, len(self.timesteps) + 1, 2))
+        cbar.ax.set_ylabel('Hours', fontsize=8)
+
+        self._plot_buildings(ax)
+        plt.title(f'UTCI: hours in {cat}')
+
+    def _create_plot_heat_stress_hour(self, which):
+        """ 
+        Plots the first or last hour of heat stress (moderate or higher category) of each cell.
+
+        Params:
+        -------
+        - which: str ("first" or "last")
+        """
+
+        fig, ax = plt.subplots()
+
+        stress = self.category_index >= self.category_names.index('moderate')
+        if which == "first":
+            position = np.argmax(stress, axis=1)
+        else:
+            position = len(self.timesteps) - 1 - np.argmax(stress[:, ::-1], axis=1)
+        hour = np.asarray(self.timesteps, dtype=float)[position]
+
+        # cells without any heat stress are left out
+        triang = self._masked_triangulation(stress.any(axis=1))
+
+        levels = np.arange(self.timesteps[0], self.timesteps[-1] + 2) - 0.5
+        with span("tricontourf"):
+            contour = ax.tricontourf(triang, hour, levels=levels, cmap='viridis')
+        cbar = fig.colorbar(contour, ax=ax, shrink=0.6, ticks=self.timesteps[::max(2, len(self.timesteps) // 12)])
+        cbar.ax.set_ylabel('Hour', fontsize=8)
+
+        self._plot_buildings(ax)
+        plt.title(f'UTCI: {which} hour of heat stress')
+
+    def _utci_folder(self):
+        """ Creates the output directory for the UTCI plots if it doesn't exist yet. """
+
+        dir = Path(f"{self.output_folder}/utci/")
+        if not dir.exists():
+            os.mkdir(dir)
+
+        return dir
+
+    @budgeted
+    @timed()
+    @pipelined
     def export(self):
+        dir = self._utci_folder()
+        static = self._export_key()
         for cat in self.categories:
-            for time in self.get_timesteps():
-                self._create_plot(cat, time)
-                plt.savefig(self.output_folder + f"/utci/utci_{cat}_{time}.png")
+            writer = self._animation_writer(dir, f"utci_{cat}")
+            with writer or nullcontext():
+                for i, time in enumerate(self.timesteps):
+                    path = dir / Path(f"utci_{cat}_{time}.png")
+                    key = fingerprint(static, cat, time, self.category_index[:, i]) if writer is None and manifest.enabled else None
+                    if writer is None and manifest.is_current(pipeline.output_path(path), key):
+                        continue
+                    self._create_plot(cat, time)
+                    _savefig(path, key, writer)
+                    plt.close()
+
+    @budgeted
+    @timed()
+    @pipelined
+    def export_all_categories(self):
+        """ Export one map with all the UTCI categories for each timestep. """
+        dir = self._utci_folder()
+        static = self._export_key()
+        writer = self._animation_writer(dir, "utci_categories")
+        with writer or nullcontext():
+            for i, time in enumerate(self.timesteps):
+                path = dir / Path(f"utci_categories_{time}.png")
+                key = fingerprint(static, "categories", time, self.category_index[:, i]) if writer is None and manifest.enabled else None
+                if writer is None and manifest.is_current(pipeline.output_path(path), key):
+                    continue
+                self._create_plot_all_categories(time)
+                _savefig(path, key, writer)
                 plt.close()
 
+    @budgeted
+    @timed()
+    @pipelined
+    def export_duration(self):
+        """ Export map of hours spent in the category for each selected category. """
+        dir = self._utci_folder()
+        static = self._export_key(self.category_index)
+        for cat in self.categories:
+            path, key = dir / Path(f"utci_{cat}_hours.png"), fingerprint(static, "hours", cat) if manifest.enabled else None
+            if manifest.is_current(pipeline.output_path(path), key):
+                continue
+            self._create_plot_duration(cat)
+            _savefig(path, key)
+            plt.close()
+
+    @budgeted
+    @timed()
+    @pipelined
+    def export_heat_stress_hours(self):
+        """ Export maps of the first and last hour of heat stress. """
+        dir = self._utci_folder()
+        static = self._export_key(self.category_index)
+        for which in ["first", "last"]:
+            path, key = dir / Path(f"utci_heat_stress_{which}_hour.png"), fingerprint(static, "heat stress", which) if manifest.enabled else None
+            if manifest.is_current(pipeline.output_path(path), key):
+                continue
+            self._create_plot_heat_stress_hour(which)
+            _savefig(path, key)
+            plt.close()
+
     def show(self):
         cat = self.categories[0]
-        time = self.get_timesteps()[0]
+        time = self.timesteps[0]
         self._create_plot(cat, time)
         plt.show()
 
@@ -531,13 +811,13 @@ class SimulationComparison(SurfacePoints, VariableChars):
     def set_output_folder(self, output_folder):
         self.output_folder = output_folder
 
-    def add_simulation(self, simulation : pd.DataFrame):
+    def add_simulation(self, simulation : pd.DataFrame | Scenario):
         """ 
         Add simulations to the list of simulations. These will be compared with the simulation given during initializing. 
         
         Params:
         ------
-        - simulation : list of tuples [(pd.DataFrame, str)] | tuple (pd.DataFrame, str)
+        - simulation : pd.DataFrame | Scenario (scenario stores only the changed variables of the baseline simulation)
         """
         self.simulations.append(simulation)
 
@@ -553,18 +833,15 @@ class SimulationComparison(SurfacePoints, VariableChars):
     def add_aoi(self, aoi):
         self.aois.append(aoi)
         
-    def _create_plot(self, variable_name, aoi):
-        
+    def _create_plot(self, variable_name, aoi, means=None):
+        """ Plots the AOI means of the simulations (means: the (timesteps, values) of each simulation if already computed). """
+
+        if means is None:
+            # plot values (area weighted if set_area_weighting() was called)
+            means = [self._aoi_mean(simulation, aoi, variable_name) for simulation in self.simulations]
+
         fig, ax = plt.subplots(figsize=(12, 6))
-        for i, simulation in enumerate(self.simulations):
-            # plot values
-            cell_IDs = self.surfpoints[self.surfpoints.within(aoi, align=True)]["cell_ID"].values.tolist()
-            subset = simulation[simulation['cell_ID'].isin(cell_IDs)].dropna()
-
-            cell_IDs = np.unique(subset['cell_ID'].values).tolist()  # reinitiate cell_IDs without nans
-            timesteps = np.unique(subset.Time.values).tolist()  # get time steps
-            avg_values = np.mean([subset[subset['cell_ID'] == id][variable_name].values for id in cell_IDs], axis=0)
-            
+        for i, (timesteps, avg_values) in enumerate(means):
             plt.plot(timesteps, avg_values, c=self.colors[i], label=f"Simulation {i+1}" if len(self.simulation_names) < len(self.simulations) else self.simulation_names[i])
 
         # apply layouts
@@ -579,14 +856,24 @@ class SimulationComparison(SurfacePoints, VariableChars):
         
         return
 
+    @budgeted
+    @timed()
+    @pipelined
     def export(self):
         if self.output_folder is None:
             raise ValueError("Output folder is not set.")
         """ Function for exporting. """
+        static = fingerprint(type(self).__name__, self.colors, self.simulation_names, len(self.simulations))
         for variable_name in self.variable_list:
             for i, aoi in enumerate(self.aois):
-                self._create_plot(variable_name, aoi)
-                plt.savefig(f"{self.output_folder}/comparison_{variable_name}_area{self.letters[i]}.png")
+                # the plotted series are the inputs of the figure
+                path = f"{self.output_folder}/comparison_{variable_name}_area{self.letters[i]}.png"
+                means = [self._aoi_mean(sim, aoi, variable_name) for sim in self.simulations]
+                key = fingerprint(static, variable_name, aoi, means) if manifest.enabled else None
+                if manifest.is_current(pipeline.output_path(path), key):
+                    continue
+                self._create_plot(variable_name, aoi, means)
+                _savefig(path, key)
                 plt.close()
 
     def show(self, variable_name="Tair", aoi=None):
@@ -635,10 +922,11 @@ class Windrose(AirPoints):
         # assign wind directions
         self.airdata["WindDirection"]= wd
 
-    def _calculate_levels(self, ws):
+    def _calculate_levels(self):
 
-        # calculate levels
-        levels = np.arange(int(np.floor(min(ws))), int(np.ceil(max(ws))) + 1, (min(ws) + max(ws)) / 10)
+        # calculate levels from the range of wind speeds in the statistics catalog
+        min_ws, max_ws = self.get_catalog({"air": self.airdata}).get_range("WindSpeed", ["air"])
+        levels = np.arange(int(np.floor(min_ws)), int(np.ceil(max_ws)) + 1, (min_ws + max_ws) / 10)
         levels = np.unique(np.round(levels).astype(int))
 
         # set levels
@@ -668,7 +956,7 @@ class Windrose(AirPoints):
 
         # calculate the levels if not specified
         if self.levels is None:
-            self._calculate_levels(ws)
+            self._calculate_levels()
 
         # Set up the windrose plot
         ax = WindroseAxes.from_ax()
@@ -679,9 +967,17 @@ class Windrose(AirPoints):
         # Add legend
         ax.set_legend(title="Wind Speed (m/s)", loc=self.legend_loc)
 
+    @budgeted
+    @timed()
+    @pipelined
     def export(self):
+        path = f"{self.output_folder}/windrose.png"
+        key = fingerprint(type(self).__name__, self.cmap, self.levels, self.legend_loc,
+                          self.airdata[["WindX", "WindY", "WindSpeed"]]) if manifest.enabled else None
+        if manifest.is_current(pipeline.output_path(path), key):
+            return
         self._create_plot()
-        plt.savefig(f"{self.output_folder}/windrose.png")
+        _savefig(path, key)
         plt.close()
 
     def show(self):
@@ -703,12 +999,18 @@ class Slice(AirPoints, SurfacePoints, VariableChars):
 
         self.resolution = 10
         self.buffer = 1
+        self.time = self.get_timesteps()[0]
 
         self.output_folder = ""
 
     def add_variable(self, variable_name):
         self.variable_list.append(variable_name)
 
+    def set_time(self, time):
+        """ Set the time of the slice (defaults to the first timestep): a timestep or any time in between (interpolated). """
+        self._check_time(time)
+        self.time = time
+
     def set_resolution(self, resolution):
         self.resolution = resolution
         
@@ -771,11 +1073,16 @@ class Slice(AirPoints, SurfacePoints, VariableChars):
         fig = plt.figure()
         ax = fig.add_subplot(projection='3d')
 
+        values = None
         if self.variable_name is not None:
-            data = pd.merge(self.gdf[["cell_ID"]], self.df)
-            data = data[data["Time"] == 1]
+            data = self.get_timestep_data(self.time, [self.variable_name])
+            values = cell_time_array(data, self.variable_name, self.gdf["cell_ID"].values, [self.time])[:, 0]
+
+        # points decimated to the export point budget (see set_point_budget())
+        xyz = np.column_stack([self.gdf.geometry.x, self.gdf.geometry.y, self.gdf.geometry.z])
+        idx = self._decimate("points", xyz, "export", values)
 
-        sc = ax.scatter(self.gdf.geometry.x, self.gdf.geometry.y, self.gdf.geometry.z, s=1, c=data[self.variable_name] if self.variable_name is not None else 'black',
+        sc = ax.scatter(xyz[idx, 0], xyz[idx, 1], xyz[idx, 2], s=1, c=values[idx] if self.variable_name is not None else 'black',
                         cmap="Spectral_r")
 
         # plot 3d slice
@@ -805,7 +1112,7 @@ class Slice(AirPoints, SurfacePoints, VariableChars):
         ax.set_zlim(0, 150)
 
         # Save figure, show if selected
-        plt.savefig("paraviewplus/figs/3dslice.png")
+        _savefig("paraviewplus/figs/3dslice.png")
         plt.show()
 
     def _create_plot(self):
@@ -813,13 +1120,10 @@ class Slice(AirPoints, SurfacePoints, VariableChars):
         # Create slice and extract relevant points along the line
         points_along_line = self._slice()
 
-        # Merge gdf with df
+        # Merge gdf with the data of the selected time (filtered before merging)
         points_along_line = points_along_line[["cell_ID", "geometry", "dist_from_origin"]]
-        merged = pd.merge(points_along_line, self.df, how="left", on="cell_ID")
-
-        # Filter data for the selected time
-        time = 1
-        subset = merged[merged["Time"] == time].sort_values("dist_from_origin").copy()
+        with span("merge"):
+            subset = pd.merge(points_along_line, self.get_timestep_data(self.time, [self.variable_name]), on="cell_ID").sort_values("dist_from_origin")
 
         # Create bounding box around the data points to cover the area with the fishnet
         min_x, min_y, max_x, max_y = (
@@ -850,7 +1154,9 @@ class Slice(AirPoints, SurfacePoints, VariableChars):
         )
 
         # Spatial join to match points to fishnet cells
-        joined = gpd.sjoin(points_gdf, fishnet_gdf, how='left', predicate='within')
+        with span("spatial join"):
+            joined = gpd.sjoin(points_gdf, fishnet_gdf, how='left', predicate='within')
+        count("points rendered", len(points_gdf))
 
         # Check if any points were joined
         print(joined['index_right'].isna().sum(), "points did not match any fishnet cell")
@@ -879,7 +1185,8 @@ class Slice(AirPoints, SurfacePoints, VariableChars):
         # Plot the fishnet grid colored by the average heights
         fig, ax = plt.subplots()
         fishnet_gdf = fishnet_gdf.set_geometry('geometry')
-        fishnet_gdf.plot(ax=ax, color=fishnet_gdf['color'], legend=True)
+        with span("fishnet"):
+            fishnet_gdf.plot(ax=ax, color=fishnet_gdf['color'], legend=True)
 
         # Add a colorbar to the plot
         sm = plt.cm.ScalarMappable(cmap=cmap, norm=norm)
@@ -891,9 +1198,17 @@ class Slice(AirPoints, SurfacePoints, VariableChars):
         plt.ylabel('Height')
         plt.title(f'Plot of {self.variable_name} using Fishnet Grid')
         
+    @budgeted
+    @timed()
+    @pipelined
     def export(self):
+        path = self.output_folder + f"/slice_{self.variable_name}.png"
+        key = fingerprint(type(self).__name__, self.slice, self.variable_name, self.resolution, self.buffer, self.gdf, self.time,
+                          self.get_timestep_data(self.time, [self.variable_name])) if manifest.enabled else None
+        if manifest.is_current(pipeline.output_path(path), key):
+            return
         self._create_plot()
-        plt.savefig(self.output_folder + f"/slice_{self.variable_name}.png")
+        _savefig(path, key)
         plt.close()
 
     def show(self):
@@ -901,15 +1216,17 @@ class Slice(AirPoints, SurfacePoints, VariableChars):
         plt.show()            
 
 
-class Frequency(SurfacePoints):
+class Frequency(SurfacePoints, SurfaceMesh):
     """
     Class for creating visualizations (pie chart or bar chart) that show the frequency (percentage) of 
-    time steps when the selected variable exceeds a given threshold.
+    time steps when the selected variable exceeds a given threshold. The map of the number of time steps
+    over the threshold for every cell needs the surface mesh (for plotting the buildings).
     """
 
-    def __init__(self, gdf : gpd.GeoDataFrame, df : pd.DataFrame, variable_name : str):
+    def __init__(self, gdf : gpd.GeoDataFrame, df : pd.DataFrame, variable_name : str, surfmesh : gpd.GeoDataFrame = None):
         super().__init__(gdf, df)
         VariableChars.__init__(self)
+        SurfaceMesh.__init__(self, surfmesh, df)
 
         self.gdf = gdf
         self.df = df
@@ -934,40 +1251,45 @@ class Frequency(SurfacePoints):
         """Set the output folder for saving charts."""
         self.output_folder = output_folder
 
+    def _get_exceedance(self):
+        """ Exceedance counter of the variable (values of each aoi are selected and sorted only once). """
+        if getattr(self, "exceedance", None) is None or self.exceedance.variable_name != self.variable_name:
+            self.exceedance = Exceedance(self.gdf, self.df, self.variable_name)
+        return self.exceedance
+
+    def _walls_rooftops(self):
+        """ 
+        Check if walls and rooftop files exist. If not, create walls and rooftop files. 
+        Uses the function _classify_surfaces() from SurfaceMesh.
+        """
+
+        if self.surfmesh is None:
+            raise ValueError("Surface mesh is needed for plotting maps, add it when initiating the class.")
+
+        walls, ground, rooftops = self._classify_surfaces()
+
+        return walls, rooftops
+
     def count_frequency(self, aoi):
         """
         Count the number of time steps where the variable exceeds the threshold.
         Returns a list: [count_below_threshold, count_above_threshold].
         """
 
-        if isinstance(aoi, Point):
-            # Handle AOI as a single point
-            cell_id = self.gdf[self.gdf.geometry.within(aoi)] ["cell_ID"].values[0]
-            values = self.df[self.df['cell_ID'] == cell_id][self.variable_name].values
-        elif isinstance(aoi, Polygon):
-            # Handle AOI as a polygon
-            cell_ids = self.gdf[self.gdf.geometry.within(aoi)]["cell_ID"].values.tolist()
-            subset = self.df[self.df['cell_ID'].isin(cell_ids)].dropna()
-            values = subset.groupby('cell_ID')[self.variable_name].mean().values
-        else:
-            raise ValueError("AOI must be a Point or Polygon.")
-        
-        frequency_l = sum(value < self.threshold for value in values)
-        frequency_u = sum(value >= self.threshold for value in values)
+        below, above = self._get_exceedance().count([aoi], [self.threshold])
 
-        return [frequency_l, frequency_u]
+        return [int(below[0, 0]), int(above[0, 0])]
 
     def pie_chart(self):
         """Create a pie chart for a single AOI."""
         aoi = self.aois[0]
 
         if isinstance(aoi, Point):
-            # Expand point to a small polygon buffer
-            aoi_buffer = aoi.buffer(10)
-            points_within_buffer = self.gdf[self.gdf.geometry.within(aoi_buffer)]
-            points_within_buffer['distance'] = points_within_buffer.geometry.distance(aoi)
-            nearest_3 = points_within_buffer.nsmallest(3, 'distance')
-            aoi = Polygon(list(nearest_3.geometry)).buffer(0.00001)
+            # Expand point to a small polygon of the 3 nearest points (KD-tree query)
+            if getattr(self, "point_probe", None) is None:
+                self.point_probe = PointProbe(self.gdf, self.df, variables=[self.variable_name])
+            distances, positions = self.point_probe.nearest([aoi], k=3)
+            aoi = Polygon(list(self.gdf.geometry.iloc[positions[0]])).buffer(0.00001)
     
         labels = [f'< {self.threshold} °C', f'> {self.threshold} °C']
         sizes = self.count_frequency(aoi)  # count frequency
@@ -979,7 +1301,8 @@ class Frequency(SurfacePoints):
     def bar_plot(self):
         """Create a bar chart for multiple AOIs."""
         labels = [f'Area {i+1}' for i in range(len(self.aois))]
-        counts = [self.count_frequency(aoi)[1] for aoi in self.aois]
+        below, above = self._get_exceedance().count(self.aois, [self.threshold])
+        counts = above[:, 0]
 
         fig, ax = plt.subplots()
         ax.bar(labels, counts, color='darkred')
@@ -994,21 +1317,143 @@ class Frequency(SurfacePoints):
             self.bar_plot()
         plt.show()
 
+    @budgeted
+    @timed()
+    @pipelined
     def export(self):
         """Save the appropriate chart to the output folder."""
         if not self.output_folder:
             raise ValueError("Output folder is not set.")
 
+        path, key = f'{self.output_folder}/chart.png', self._export_key("chart")
+        if manifest.is_current(pipeline.output_path(path), key):
+            return
+
         if len(self.aois) == 1:
             self.pie_chart()
         elif len(self.aois) > 1:
             self.bar_plot()
-        plt.savefig(f'{self.output_folder}/chart.png')
+        _savefig(path, key)
+
+    def threshold_plot(self, thresholds):
+        """
+        Create a line chart of the share of values above each threshold (exceedance curve) for all AOIs.
+
+        Params:
+        -------
+        - thresholds: list of thresholds
+        """
+
+        shares = self._get_exceedance().curve(self.aois, thresholds)
+
+        fig, ax = plt.subplots()
+        for i in range(len(self.aois)):
+            ax.plot(thresholds, 100 * shares[i], label=f'Area {i+1}')
+        ax.set_xlabel(f'Threshold ({self.get_units(self.variable_name)})')
+        ax.set_ylabel('Share Above Threshold (%)')
+        ax.set_ylim(0, 100)
+        ax.set_title(f'Frequency of {self.get_title(self.variable_name)} above threshold')
+        if len(self.aois) <= 10:
+            ax.legend(fontsize=8, frameon=False)
+
+    def map_plot(self, thresholds=None, simulations=None):
+        """
+        Create maps of the number of time steps above (or equal to) the thresholds for every cell. One row of maps for each
+        simulation and one column for each threshold.
+
+        Params:
+        -------
+        - thresholds: list of thresholds (defaults to the threshold set by set_threshold())
+        - simulations: list of simulations (pd.DataFrame | Scenario) with the same cells (defaults to the simulation of the class)
+        """
+
+        if thresholds is None:
+            thresholds = [self.threshold]
+        if simulations is None:
+            simulations = [self.df]
+
+        walls, rooftops = self._walls_rooftops()
+        with span("triangulation"):
+            triang = tri.Triangulation(self.gdf.geometry.x.values, self.gdf.geometry.y.values)
 
+        fig, axs = plt.subplots(len(simulations), len(thresholds), squeeze=False, figsize=(4 * len(thresholds), 4 * len(simulations)))
 
-class ComparisonMap(SurfacePoints, AirPoints, VariableChars, SurfaceMesh):
+        for i, sim in enumerate(simulations):
+            exceedance = self._get_exceedance() if sim is self.df else Exceedance(self.gdf, sim, self.variable_name)
+            hours = exceedance.hours_above(thresholds)
+            timesteps = exceedance.values.shape[1]
 
-    def __init__(self, gdf : gpd.GeoDataFrame, df : pd.DataFrame):
+            # leave out cells without any value
+            valid = ~np.isnan(exceedance.values).all(axis=1)
+            triang.set_mask(~valid[triang.triangles].all(axis=1))
+            count("points rendered", len(thresholds) * int(valid.sum()))
+
+            for j, threshold in enumerate(thresholds):
+                ax = axs[i, j]
+                with span("tricontourf"):
+                    contour = ax.tricontourf(triang, hours[j].astype(float), levels=np.arange(timesteps + 2) - 0.5, cmap='Reds', zorder=1)
+
+                # plot the buildings (walls and rooftops)
+                with span("overlay"):
+                    walls.plot(ax=ax, edgecolor='black', linewidth=0.5, zorder=2)
+                    rooftops.plot(ax=ax, edgecolor='black', linewidth=0.5, color='white', zorder=3)
+
+                name = sim.name if isinstance(sim, Scenario) and sim.name is not None else f"Simulation {i + 1}"
+                ax.set_title(f"{name}: {self.variable_name} >= {threshold}", fontsize=8)
+                ax.axis('off')
+
+        cbar = fig.colorbar(contour, ax=axs, shrink=0.6, ticks=np.arange(0, timesteps + 1, 2))
+        cbar.ax.set_ylabel('Time Steps Above Threshold', fontsize=8)
+        cbar.outline.set_visible(False)
+
+    def _export_key(self, *parts):
+        """
+        Fingerprint of the figure inputs: the settings, the areas of interest and the data of the variable (None without a
+        manifest, see manifest.py).
+        """
+        if not manifest.enabled:
+            return None
+        return fingerprint(type(self).__name__, self.variable_name, self.threshold, self.aois, self.df[["cell_ID", "Time", self.variable_name]], *parts)
+
+    @budgeted
+    @timed()
+    @pipelined
+    def export_map(self, thresholds=None, simulations=None):
+        """Save the maps of the number of time steps above the thresholds to the output folder."""
+        if not self.output_folder:
+            raise ValueError("Output folder is not set.")
+
+        path = f'{self.output_folder}/exceedance_map_{self.variable_name}.png'
+        key = self._export_key("map", thresholds, simulations, self.gdf.geometry)
+        if manifest.is_current(pipeline.output_path(path), key):
+            return
+
+        self.map_plot(thresholds, simulations)
+        _savefig(path, key)
+        plt.close()
+
+    @budgeted
+    @timed()
+    @pipelined
+    def export_threshold_plot(self, thresholds):
+        """Save the exceedance curves for the thresholds to the output folder."""
+        if not self.output_folder:
+            raise ValueError("Output folder is not set.")
+
+        path, key = f'{self.output_folder}/threshold_chart.png', self._export_key("thresholds", thresholds)
+        if manifest.is_current(pipeline.output_path(path), key):
+            return
+
+        self.threshold_plot(thresholds)
+        _savefig(path, key)
+        plt.close()
+
+
+class ComparisonMap(SurfacePoints, AirPoints, VariableChars, SurfaceMesh, Animated):
+
+    interpolated_frames = True  # animation frames between the timesteps can be rendered from interpolated data
+
+    def __init__(self, gdf : gpd.GeoDataFrame, df : pd.DataFrame, base_date : str | datetime = None):
         super().__init__(gdf, df)
 
         VariableChars.__init__(self)
@@ -1025,7 +1470,8 @@ class ComparisonMap(SurfacePoints, AirPoints, VariableChars, SurfaceMesh):
 
         self.simulations.append(df)  # append first simulation, add more with add_simulation(), max number of simulations is 6
 
-        self.time = 1
+        self.time = self.get_timesteps()[0]
+        self.base_date = None if base_date is None else _base_date(base_date)  # titles with the date and time of day (see set_base_date())
 
         self.walls, self.rooftops = self._walls_rooftops()
 
@@ -1036,7 +1482,14 @@ class ComparisonMap(SurfacePoints, AirPoints, VariableChars, SurfaceMesh):
 
         self.ax_list = []
 
-        base_date="30.7.2018"
+        # difference mode (scenario - baseline), see set_mode()
+        self.mode = "absolute"
+        self.percentile = 98  # percentile of absolute differences used as the limit of the diverging colour scale
+        self.diff_cmap = "RdBu_r"
+        self._differences = None  # cached (key, differences) computed for all timesteps at once
+        self._hourly_levels = None  # cached (key, levels, ticks) of the per-hour difference maps
+        self._difference_interpolation = None  # cached (key, TemporalInterpolator) of the differences between the timesteps
+        self.triang = None
 
     def set_cmap(self, cmap):
         self.cmap = cmap
@@ -1052,16 +1505,29 @@ class ComparisonMap(SurfacePoints, AirPoints, VariableChars, SurfaceMesh):
         self.variable_name = variable_name
 
     def set_ax_list(self):
-        self.ax_list = [i for ax in self.axs for i in ax]
+        self.ax_list = list(np.atleast_1d(self.axs).ravel())
+
+    def set_mode(self, mode):
+        """ Set mode of the maps: "absolute" (values of each simulation) or "difference" (simulation - first simulation). """
+        if mode not in ["absolute", "difference"]:
+            raise ValueError(f"Mode can only be 'absolute' or 'difference', not {mode}.")
+        self.mode = mode
+
+    def set_percentile(self, percentile):
+        """ Set percentile of absolute differences which is used as the limit of the colour scale in difference mode. """
+        self.percentile = percentile
 
     def set_time(self, time):
-        if time not in self.get_timesteps():
-            raise ValueError(f"Selected time not in timesteps!! You selected {time} but timesteps are: {self.get_timesteps()}")
-        else:
-            self.time = time
+        """ Set the time of the plot: a timestep or any time in between (interpolated, see set_interpolation()). """
+        self._check_time(time)
+        self.time = time
+
+    def set_base_date(self, base_date):
+        """ Set Time 0 of the data ("15.7.2021" or a datetime, e.g. SimulationCatalog.base_date), the titles show the date. """
+        self.base_date = None if base_date is None else _base_date(base_date)
 
-    def add_simulation(self, simulation : pd.DataFrame):
-        # add another simulation 
+    def add_simulation(self, simulation : pd.DataFrame | Scenario):
+        # add another simulation (pd.DataFrame or Scenario)
         if len(self.simulations) > 6:
             raise ValueError("Maximum of 6 simulations for comparison is allowed, otherwise you have to add more if statements to 'create_plot()'")
         else:
@@ -1076,10 +1542,11 @@ class ComparisonMap(SurfacePoints, AirPoints, VariableChars, SurfaceMesh):
         self.output_folder = output_folder
 
     def set_title(self):
-        plt.suptitle(f"Time: {self.time}")
+        plt.suptitle(_time_title(self.time, self.base_date))
 
-    def _create_plot_layout(self):
-        l = len(self.simulations)
+    def _create_plot_layout(self, l=None):
+        if l is None:
+            l = len(self.simulations)
 
         # create figure with subplots based on number of simulations
         if l == 0:
@@ -1121,13 +1588,13 @@ class ComparisonMap(SurfacePoints, AirPoints, VariableChars, SurfaceMesh):
         # set colormap for the whole thing
         cmap = self.get_cmap(self.variable_name)
 
-        # set mins aand maxs for the whole thing
-        all_values = pd.concat([d[self.variable_name] for d in self.simulations])
-        #min_value = 10 * (min(all_values) // 10)
-        #max_value = 10 * (max(all_values) // 10)
+        # set mins aand maxs for the whole thing (range over all simulations from the statistics catalog)
+        names = [self._simulation_name(i) for i in range(len(self.simulations))]
+        catalog = self.get_catalog(dict(zip(names, self.simulations)))
+        value_range = catalog.get_range(self.variable_name, names)
 
-        self.set_min_value(all_values)
-        self.set_max_value(all_values)
+        self.set_min_value(value_range)
+        self.set_max_value(value_range)
         self.set_cmap(cmap)
 
         # loop through the uploaded simulations
@@ -1135,8 +1602,9 @@ class ComparisonMap(SurfacePoints, AirPoints, VariableChars, SurfaceMesh):
             ax = self.ax_list[i]  # take according axis from the list
             
             # plot walls and rooftops
-            self.walls.plot(ax=ax, edgecolor='black', linewidth=0.5, zorder=2)  # zorder puts this above the variable
-            self.rooftops.plot(ax=ax, edgecolor='black', linewidth=0.5, color='white', zorder=3)  # zorder puts this above the variable and the walls
+            with span("overlay"):
+                self.walls.plot(ax=ax, edgecolor='black', linewidth=0.5, zorder=2)  # zorder puts this above the variable
+                self.rooftops.plot(ax=ax, edgecolor='black', linewidth=0.5, color='white', zorder=3)  # zorder puts this above the variable and the walls
 
             # set title of plot
             self.set_title()
@@ -1161,18 +1629,21 @@ class ComparisonMap(SurfacePoints, AirPoints, VariableChars, SurfaceMesh):
         for i, sim in enumerate(self.simulations):
             ax = self.ax_list[i]  # select axis from list of axes (generated in when creating plot layout)
 
-            # merge the simulation with the geodataframe TODO could be a better way to do this?
-            merged = gpd.GeoDataFrame(pd.merge(sim[["cell_ID", self.variable_name, "Time"]], self.gdf[["cell_ID", "geometry"]])).dropna()
-            subset = merged[merged["Time"] == self.time]  # select subset for the selected timestep
+            # select subset for the selected timestep (scenarios materialize only this timestep) and merge it with the geodataframe
+            with span("merge"):
+                subset = gpd.GeoDataFrame(pd.merge(self._timestep(sim, self.time), self.gdf[["cell_ID", "geometry"]])).dropna()
 
             # plot the surface
             import matplotlib.tri as tri
-            triang = tri.Triangulation(subset.geometry.x, subset.geometry.y)
+            with span("triangulation"):
+                triang = tri.Triangulation(subset.geometry.x, subset.geometry.y)
+            count("points rendered", len(subset))
             if self.variable_name == "UTCI":
                 self.levels = [9, 26, 32, 38, 46, 50]  # levels same as ticks for utci
                 self.ticks = self.levels
                 norm = BoundaryNorm(self.levels, ncolors=self.cmap.N, clip=True)
-                self.contour = ax.tricontourf(triang, subset[self.variable_name], levels=self.levels, cmap=self.cmap, norm=norm, zorder=1)
+                with span("tricontourf"):
+                    self.contour = ax.tricontourf(triang, subset[self.variable_name], levels=self.levels, cmap=self.cmap, norm=norm, zorder=1)
             else: 
                 if self.variable_name == "Tair":
                     self.levels = np.arange(self.min_value, self.max_value + 1, 1)
@@ -1184,8 +1655,20 @@ class ComparisonMap(SurfacePoints, AirPoints, VariableChars, SurfaceMesh):
                     self.levels = np.arange(0, 1.1, 0.1)
                     self.ticks = np.arange(0, 1.1, 0.2)
 
-                self.contour = ax.tricontourf(triang, subset[self.variable_name], levels=self.levels, cmap=self.cmap, zorder=1)
+                with span("tricontourf"):
+                    self.contour = ax.tricontourf(triang, subset[self.variable_name], levels=self.levels, cmap=self.cmap, zorder=1)
     
+    def _timestep(self, sim, time):
+        """
+        cell_ID and the selected variable of the simulation at the time (scenarios materialize only this timestep, times
+        between the timesteps are interpolated).
+        """
+        if time not in self.get_timesteps():
+            return self.get_timestep_data(time, [self.variable_name], sim)[["cell_ID", self.variable_name]]
+        if isinstance(sim, Scenario):
+            return sim.get_timestep(time, ["cell_ID", self.variable_name])
+        return sim.loc[sim["Time"] == time, ["cell_ID", self.variable_name]]
+
     def _walls_rooftops(self):
         """ 
         Check if walls and rooftop files exist. If not, create walls and rooftop files. 
@@ -1196,9 +1679,153 @@ class ComparisonMap(SurfacePoints, AirPoints, VariableChars, SurfaceMesh):
 
         return walls, rooftops  # TODO make this more effective also together with timeseriesdemonstration
 
+    def _simulation_name(self, idx):
+        sim = self.simulations[idx]
+        if isinstance(sim, Scenario) and sim.name is not None:
+            return sim.name
+        return f"Simulation {idx + 1}"
+
+    def _calculate_differences(self):
+        """
+        Computes differences (simulation - first simulation) of the selected variable for all the simulations and timesteps
+        in one pass on cells aligned with the geodataframe. The result is cached until the simulations or the variable change.
+
+        Returns:
+        --------
+        np.ndarray of shape (simulations - 1, cells, timesteps).
+        """
+
+        key = (self.variable_name, tuple(data_version(sim) for sim in self.simulations))
+        if self._differences is not None and self._differences[0] == key:
+            return self._differences[1]
+
+        cell_IDs = self.gdf["cell_ID"].values
+        timesteps = self.get_timesteps()
+
+        baseline = cell_time_array(self.simulations[0], self.variable_name, cell_IDs, timesteps)
+        differences = np.empty((len(self.simulations) - 1, *baseline.shape), dtype=baseline.dtype)
+        for i, sim in enumerate(self.simulations[1:]):
+            differences[i] = cell_time_array(sim, self.variable_name, cell_IDs, timesteps)
+            differences[i] -= baseline
+
+        self._differences = (key, differences)
+
+        return differences
+
+    def _diverging_levels(self, values):
+        """ Symmetric levels around zero with the limit at the selected percentile of the absolute values. """
+
+        limit = np.nanpercentile(np.abs(values), self.percentile) if np.isfinite(values).any() else 1
+        if limit == 0:
+            limit = 1
+
+        self.levels = np.linspace(-limit, limit, 21)
+        self.ticks = np.linspace(-limit, limit, 5)
+
+        return self.levels
+
+    def _plot_difference(self, ax, values, levels):
+        """ Plots map of differences (one value for each cell) on ax. """
+
+        if self.triang is None:
+            with span("triangulation"):
+                self.triang = tri.Triangulation(self.gdf.geometry.x.values, self.gdf.geometry.y.values)
+
+        valid = np.isfinite(values)
+        self.triang.set_mask(~valid[self.triang.triangles].all(axis=1))
+        count("points rendered", int(valid.sum()))
+        with span("tricontourf"):
+            self.contour = ax.tricontourf(self.triang, np.where(valid, values, 0), levels=levels, cmap=self.diff_cmap, extend='both', zorder=1)
+
+        with span("overlay"):
+            self.walls.plot(ax=ax, edgecolor='black', linewidth=0.5, zorder=2)
+            self.rooftops.plot(ax=ax, edgecolor='black', linewidth=0.5, color='white', zorder=3)
+
+        ax.set_xticks([])
+        ax.set_yticks([])
+        ax.set_frame_on(False)
+
+    def _difference_frame(self, frame):
+        """
+        Differences and colour levels of a frame of the difference maps.
+
+        Params:
+        -------
+        - frame: timestep (or time between the timesteps, interpolated), "max_cooling" (lowest difference over all timesteps)
+          or "mean_change" (mean difference over all timesteps)
+
+        Returns:
+        --------
+        tuple (values of shape (simulations - 1, cells), levels, title)
+        """
+
+        if len(self.simulations) < 2:
+            raise ValueError("Difference mode needs at least 2 simulations.")
+
+        differences = self._calculate_differences()
+
+        if frame == "max_cooling":
+            values = np.nanmin(differences, axis=2)
+            title = "Max cooling"
+        elif frame == "mean_change":
+            values = np.nanmean(differences, axis=2)
+            title = "Mean change"
+        elif frame in self.get_timesteps():
+            values = differences[:, :, self.get_timesteps().index(frame)]
+            title = _time_title(frame, self.base_date)
+        else:
+            values = self._difference_interpolator()(frame)
+            title = _time_title(frame, self.base_date)
+
+        # the per-hour maps share one scale (percentile over all timesteps, computed once), summary frames have their own
+        if frame in ["max_cooling", "mean_change"]:
+            levels = self._diverging_levels(values)
+        else:
+            if self._hourly_levels is None or self._hourly_levels[0] != self._differences[0]:
+                self._hourly_levels = (self._differences[0], self._diverging_levels(differences), self.ticks)
+            self.levels, self.ticks = self._hourly_levels[1], self._hourly_levels[2]
+            levels = self.levels
+
+        return values, levels, title
+
+    def _difference_interpolator(self):
+        """ Temporal interpolator of the differences (see set_interpolation()), created once per differences and method. """
+
+        key = (self._differences[0], self.interpolation)
+        if self._difference_interpolation is None or self._difference_interpolation[0] != key:
+            self._difference_interpolation = (key, TemporalInterpolator(self.get_timesteps(), self._differences[1], key[1]))
+
+        return self._difference_interpolation[1]
+
+    def _create_difference_plot(self, values, levels, title):
+        """
+        Creates plot of differences against the first simulation for all the other simulations.
+
+        Params:
+        -------
+        - values, levels, title: differences and colour levels of the frame (see _difference_frame())
+        """
+
+        self._create_plot_layout(len(self.simulations) - 1)
+        for i in range(len(self.simulations) - 1):
+            ax = self.ax_list[i]
+            self._plot_difference(ax, values[i], levels)
+            ax.set_title(f"{self._simulation_name(i + 1)} - {self._simulation_name(0)}", fontsize=8)
+
+        plt.suptitle(title)
+
+        # add cbar
+        cbar = self.fig.colorbar(self.contour, ax=self.axs, orientation='vertical', shrink=0.8, aspect=30, ticks=self.ticks)
+        cbar.ax.tick_params(labelsize=8)
+        cbar.ax.set_ylabel(f"Change of {self.get_title(self.variable_name)} ({self.get_units(self.variable_name)})", fontsize=8)
+        cbar.outline.set_visible(False)
+
     def run(self):
         """ Create and show the plot. """
-        self._create_plot()
+        if self.mode == "difference":
+            self._create_difference_plot(*self._difference_frame(self.time))
+        else:
+            self._create_plot()
         plt.show()
 
     def update(self):
@@ -1207,6 +1834,9 @@ class ComparisonMap(SurfacePoints, AirPoints, VariableChars, SurfaceMesh):
         self.set_title()
         #plt.show()
 
+    @budgeted
+    @timed()
+    @pipelined
     def export(self):
         """ Export plots for all existing timesteps. """
 
@@ -1215,12 +1845,51 @@ class ComparisonMap(SurfacePoints, AirPoints, VariableChars, SurfaceMesh):
         if not dir.exists():
             os.mkdir(dir)
 
-        # create and export the plots
-        for time in self.get_timesteps():
-            self.time = time
-            self._create_plot()
-            plt.savefig(dir / Path(f"comparisontimeseries_{self.time}.png"))
-            plt.close()  # close so that the memory does not get overloaded
+        if self.mode == "difference":
+            self._export_difference(dir)
+            return
+
+        # the colour scale uses the range of all simulations and timesteps, the maps the data of the timestep
+        writer = self._animation_writer(dir, "comparisontimeseries")
+        keyed = writer is None and manifest.enabled
+        if keyed:
+            names = [self._simulation_name(i) for i in range(len(self.simulations))]
+            value_range = self.get_catalog(dict(zip(names, self.simulations))).get_range(self.variable_name, names)
+            static = fingerprint(type(self).__name__, self.variable_name, self.get_cmap(self.variable_name), names, value_range,
+                                 self.gdf.geometry, self.walls.geometry, self.rooftops.geometry)
+
+        # create and export the plots (timesteps whose inputs did not change are skipped, see manifest.py)
+        with writer or nullcontext():
+            for time in self._animation_times(self.get_timesteps()):
+                path = dir / Path(f"comparisontimeseries_{time}.png")
+                key = fingerprint(static, time, [self._timestep(sim, time) for sim in self.simulations]) if keyed else None
+                if writer is None and manifest.is_current(pipeline.output_path(path), key):
+                    continue
+                self.time = time
+                self._create_plot()
+                _savefig(path, key, writer)
+                plt.close()  # close so that the memory does not get overloaded
+
+    def _export_difference(self, dir):
+        """ Export difference maps for all existing timesteps and the summary maps (max cooling, mean change). """
+
+        names = [self._simulation_name(i) for i in range(len(self.simulations))]
+        static = fingerprint(type(self).__name__, "difference", self.variable_name, self.percentile, self.diff_cmap, names,
+                             self.gdf.geometry, self.walls.geometry, self.rooftops.geometry) if manifest.enabled else None
+
+        # with an animation, the hourly maps are its frames and the summary maps are saved as figures
+        writer = self._animation_writer(dir, "comparisondifference")
+        with writer or nullcontext():
+            for frame in self._animation_times(self.get_timesteps()) + ["max_cooling", "mean_change"]:
+                path = dir / Path(f"comparisondifference_{frame}.png")
+                frame_writer = writer if not isinstance(frame, str) else None
+                values, levels, title = self._difference_frame(frame)
+                key = fingerprint(static, frame, values, levels) if manifest.enabled else None
+                if frame_writer is None and manifest.is_current(pipeline.output_path(path), key):
+                    continue
+                self._create_difference_plot(values, levels, title)
+                _savefig(path, key, frame_writer)
+                plt.close()
 
         
 
@@ -1,16 +1,258 @@
 import geopandas as gpd
 import pandas as pd
 import numpy as np
+import shapely
 import os
+import re
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 from mpl_toolkits.axes_grid1.inset_locator import inset_axes
 from matplotlib.colors import ListedColormap, BoundaryNorm
 from matplotlib import rcParams
+from profiling import span, timed, count
+from memory import budget
 rcParams['font.family'] = 'DejaVu Sans'
 
 
+@timed("cell_time_array")
+def cell_time_array(df, variable_name, cell_IDs=None, timesteps=None, dtype=None):
+    """
+    Pivots long format Ferda data (one row per cell and timestep) into a 2D array of cells x timesteps.
+
+    Params:
+    -------
+    - df: pd.DataFrame with the columns cell_ID, Time and variable_name
+    - variable_name: str (column to pivot)
+    - cell_IDs: order of the rows (defaults to the sorted unique cell_IDs in df)
+    - timesteps: order of the columns (defaults to the sorted unique timesteps in df)
+    - dtype: dtype of the returned array (defaults to float64, float32 under a memory budget)
+
+    Returns:
+    --------
+    np.ndarray of shape (len(cell_IDs), len(timesteps)). Missing values are nan. Under a memory budget, the rows of df are
+    indexed in chunks that fit into the free budget.
+    """
+
+    if cell_IDs is None:
+        cell_IDs = np.unique(df["cell_ID"].values)
+    if timesteps is None:
+        timesteps = np.unique(df["Time"].values)
+
+    if dtype is None:
+        dtype = budget.dtype
+
+    cell_index, time_index = pd.Index(cell_IDs), pd.Index(timesteps)
+    cell_values, time_values, values = df["cell_ID"].values, df["Time"].values, df[variable_name].values
+
+    array = np.full((len(cell_IDs), len(timesteps)), np.nan, dtype=dtype)
+    for chunk in budget.chunks(40, len(df), minimum=2**16):  # indexers, mask and selected values: about 40 bytes per row
+        rows = cell_index.get_indexer(cell_values[chunk])
+        cols = time_index.get_indexer(time_values[chunk])
+        valid = (rows >= 0) & (cols >= 0)  # rows of df outside of the requested cells/timesteps
+        array[rows[valid], cols[valid]] = values[chunk][valid]
+
+    return array
+
+
+def triangle_vertices(geometry):
+    """
+    Vertex array of the triangles of the surface mesh.
+
+    Params:
+    -------
+    - geometry: array or GeoSeries of triangles (polygons with 3 vertices, z defaults to 0)
+
+    Returns:
+    --------
+    np.ndarray of shape (n, 3, 3): triangles x vertices x (x, y, z).
+    """
+
+    geometry = np.asarray(geometry)
+    coords = np.nan_to_num(shapely.get_coordinates(geometry, include_z=True))
+    starts = np.r_[0, np.cumsum(shapely.get_num_coordinates(geometry))[:-1]]
+
+    return coords[starts[:, None] + np.arange(3)]  # first three vertices of each triangle
+
+
+def triangle_areas(geometry):
+    """
+    Areas of the (3D) triangles of the surface mesh, computed at once from the vertex array.
+
+    Params:
+    -------
+    - geometry: array or GeoSeries of triangles (polygons with 3 vertices, z defaults to 0)
+
+    Returns:
+    --------
+    np.ndarray of the areas (in the units of the crs squared).
+    """
+
+    vertices = triangle_vertices(geometry)
+
+    return 0.5 * np.linalg.norm(np.cross(vertices[:, 1] - vertices[:, 0], vertices[:, 2] - vertices[:, 0]), axis=1)
+
+
+def triangle_adjacency(geometry, decimals=3):
+    """
+    Adjacency of the triangles of the surface mesh (triangles sharing an edge), built at once from the vertex array.
+
+    Params:
+    -------
+    - geometry: array or GeoSeries of triangles (polygons with 3 vertices)
+    - decimals: vertices closer than 10**-decimals are treated as the same vertex
+
+    Returns:
+    --------
+    scipy.sparse.csr_matrix of shape (n, n), symmetric, 1 where the triangles share an edge.
+    """
+
+    from scipy import sparse
+
+    vertices = triangle_vertices(geometry)
+    n = len(vertices)
+    vertices = vertices.reshape(-1, 3)
+
+    # shared vertex ids, edges as sorted pairs of vertex ids
+    _, vertex_ids = np.unique(np.round(vertices, decimals), axis=0, return_inverse=True)
+    vertex_ids = vertex_ids.reshape(n, 3)
+    edges = np.sort(np.stack([vertex_ids[:, [0, 1]], vertex_ids[:, [1, 2]], vertex_ids[:, [2, 0]]], axis=1).reshape(-1, 2), axis=1)
+    triangles = np.repeat(np.arange(n), 3)
+
+    # triangles with the same edge are next to each other after sorting, link consecutive ones
+    # (edges shared by more than two triangles, e.g. wall and ground, are linked as a chain)
+    order = np.lexsort((edges[:, 1], edges[:, 0]))
+    edges, triangles = edges[order], triangles[order]
+    same = np.all(edges[1:] == edges[:-1], axis=1)
+    rows, cols = triangles[:-1][same], triangles[1:][same]
+
+    adjacency = sparse.coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n)).tocsr()
+    adjacency = ((adjacency + adjacency.T) > 0).astype(np.int8)
+
+    return adjacency
+
+
+class LevelOfDetail():
+    """
+    Decimation of large point sets (e.g. ~144k air points) for 3D plots. The points are subsampled to a point budget
+    with a voxel grid (one point closest to the centre of each occupied voxel) or stratified (random points from each
+    voxel in proportion to its number of points). The lowest and highest values of the coloured variable are always kept.
+    The spatial selection is cached per budget, so previews (small budget) and exports (large budget) are computed once.
+
+    Attributes
+    ----------
+    xyz : np.ndarray
+        Coordinates of the points, shape (n, 3) (or (n, 2)).
+    method : str
+        "voxel" or "stratified".
+    """
+
+    def __init__(self, xyz, method : str = "voxel", seed : int = 0) -> None:
+        if method not in ("voxel", "stratified"):
+            raise ValueError(f"Unknown method {method}, use 'voxel' or 'stratified'.")
+
+        self.xyz = np.asarray(xyz, dtype=np.float64)
+        self.method = method
+        self.seed = seed
+        self.cache = {}  # {budget: positions of the points}
+
+    def __len__(self):
+        return len(self.xyz)
+
+    def _voxel_ids(self, size):
+        """ Voxel of each point for the voxel size (ids are not consecutive). """
+        cells = np.floor((self.xyz - self.xyz.min(axis=0)) / size).astype(np.int64)
+        shape = cells.max(axis=0) + 1
+        return np.ravel_multi_index(cells.T, shape)
+
+    def _voxel_size(self, n_voxels):
+        """ Smallest voxel size (bisection on log scale) with at most n_voxels occupied voxels. """
+
+        extent = np.ptp(self.xyz, axis=0).max()
+        low, high = extent / len(self) ** (1 / self.xyz.shape[1]) / 100, extent + 1
+        for _ in range(30):
+            size = np.sqrt(low * high)
+            if len(np.unique(self._voxel_ids(size))) > n_voxels:
+                low = size
+            else:
+                high = size
+            if high / low < 1.01:
+                break
+
+        return high
+
+    def _spatial(self, budget):
+        """ Positions of the spatially subsampled points (cached per budget). """
+
+        if budget in self.cache:
+            return self.cache[budget]
+
+        if self.method == "voxel":
+            size = self._voxel_size(budget)
+            ids = self._voxel_ids(size)
+
+            # point closest to the centre of its voxel
+            centres = (np.floor((self.xyz - self.xyz.min(axis=0)) / size) + 0.5) * size + self.xyz.min(axis=0)
+            order = np.lexsort((np.linalg.norm(self.xyz - centres, axis=1), ids))
+            first = np.r_[True, ids[order][1:] != ids[order][:-1]]
+            positions = np.sort(order[first])
+        else:
+            # strata are coarse voxels (~8 selected points per voxel), points are selected randomly in each stratum
+            ids = self._voxel_ids(self._voxel_size(max(budget // 8, 1)))
+            _, ids, counts = np.unique(ids, return_inverse=True, return_counts=True)
+            rng = np.random.default_rng(self.seed)
+
+            order = np.lexsort((rng.random(len(self)), ids))
+            starts = np.r_[0, np.cumsum(counts)[:-1]]
+            rank = np.arange(len(self)) - starts[ids[order]]
+            quota = np.maximum(np.round(budget * counts / len(self)), 1)
+            positions = order[rank < quota[ids[order]]]
+            if len(positions) > budget:
+                positions = rng.choice(positions, budget, replace=False)
+            positions = np.sort(positions)
+
+        self.cache[budget] = positions
+
+        return positions
+
+    def select(self, budget : int, values=None, keep_extremes : float = 0.02):
+        """
+        Positions of the points to plot.
+
+        Params:
+        -------
+        - budget: int, maximum number of points (None for all the points)
+        - values: np.ndarray, values of the coloured variable (same order as xyz)
+        - keep_extremes: float, share of the budget used for the lowest and highest values (half each)
+
+        Returns:
+        --------
+        np.ndarray of sorted positions.
+        """
+
+        if budget is None or budget >= len(self):
+            return np.arange(len(self))
+
+        n_extremes = int(keep_extremes * budget) // 2 if values is not None else 0
+        positions = self._spatial(budget - 2 * n_extremes)
+
+        if n_extremes > 0:
+            values = np.asarray(values, dtype=np.float64)
+            valid = np.flatnonzero(~np.isnan(values))
+            n_extremes = min(n_extremes, len(valid) // 2)
+            if n_extremes > 0:
+                order = np.argpartition(values[valid], [n_extremes - 1, len(valid) - n_extremes])
+                extremes = valid[np.r_[order[:n_extremes], order[len(valid) - n_extremes:]]]
+                positions = np.union1d(positions, extremes)
+
+        return positions
+
+
 class VariableChars:
 
     def __init__(self) -> None:
@@ -150,49 +392,152 @@ class VariableChars:
 
 
 class DataPoints(VariableChars):
+
+    interpolation = "linear"  # temporal interpolation between the timesteps, see set_interpolation()
+
     def __init__(self, gdf, df):
         self.gdf = gdf
         self.df = df
         self.output_folder = "paraviewplus/figs"
+        self._interpolators = {}  # {(id of the data, method): (data_version(), SimulationInterpolator)}
     
     def get_timesteps(self):
         """ Return the time steps in the dataset """
         return [x for x in np.unique(self.df.Time)]
+
+    def set_interpolation(self, method : str):
+        """ Method of the temporal interpolation at times between the timesteps: "linear" or "cubic" (monotone). """
+        if method not in ["linear", "cubic"]:
+            raise ValueError(f"Interpolation can only be 'linear' or 'cubic', not {method}.")
+        self.interpolation = method
+
+    def _check_time(self, time):
+        """ Raises ValueError if the time is outside of the timesteps (times between the timesteps are interpolated). """
+        timesteps = self.get_timesteps()
+        if not timesteps[0] <= time <= timesteps[-1]:
+            raise ValueError(f"Selected time outside of the timesteps!! You selected {time} but timesteps are: {timesteps}")
+
+    def get_timestep_data(self, time, variables : list = None, df=None):
+        """
+        Rows of the cells at a time. Times between the timesteps are interpolated in time (see set_interpolation()),
+        the variables are pivoted only once for all the interpolated times.
+
+        Params:
+        -------
+        - time: timestep or any time between the first and the last timestep
+        - variables: list of variables (defaults to all columns)
+        - df: pd.DataFrame | Scenario (defaults to the data of the points)
+
+        Returns:
+        --------
+        pd.DataFrame with the columns cell_ID, Time and the variables.
+        """
+
+        df = self.df if df is None else df
+        columns = None if variables is None else ["cell_ID", "Time"] + [v for v in variables if v not in ["cell_ID", "Time"]]
+
+        times = df.get_variable("Time") if isinstance(df, Scenario) else df["Time"].values
+        if np.any(times == time):
+            if isinstance(df, Scenario):
+                return df.get_timestep(time, columns)
+            return df.loc[df["Time"] == time, columns] if columns is not None else df[df["Time"] == time]
+
+        from interpolation import SimulationInterpolator
+
+        # one interpolator (pivoted arrays) per dataset and method, built again after a scenario changed
+        key, version = (id(df), self.interpolation), data_version(df)
+        cached = self._interpolators.get(key)
+        if cached is None or cached[0] != version or cached[1].df is not df:
+            cached = self._interpolators[key] = (version, SimulationInterpolator(df, method=self.interpolation))
+
+        return cached[1].frame(time, None if variables is None else columns[2:])
     
     def get_columns(self):
         """ Get the columns (variables) of chosen dataset"""
         return [x for x in self.df.columns]
 
+    def set_catalog(self, catalog):
+        """ Use precomputed statistics (StatisticsCatalog) for colour scales and axis limits. """
+        self.catalog = catalog
+
+    def get_catalog(self, datasets):
+        """
+        Returns the statistics catalog with the datasets added (computed only if they are not in the catalog yet).
+
+        Params:
+        -------
+        - datasets: dict {name: pd.DataFrame | Scenario}
+        """
+
+        if getattr(self, "catalog", None) is None:
+            self.catalog = StatisticsCatalog()
+
+        for name, data in datasets.items():
+            if not self.catalog.has_dataset(name, data):
+                self.catalog.add_dataset(data, name)
+
+        return self.catalog
+
+    def set_point_budget(self, preview : int = None, export : int = None, method : str = None):
+        """
+        Maximum number of points (or arrows) sent to the 3D plots, see LevelOfDetail (None keeps the current value).
+
+        Params:
+        -------
+        - preview: int, budget for plots that are only shown (default 20 000)
+        - export: int, budget for plots that are saved (default 200 000)
+        - method: str, "voxel" or "stratified"
+        """
+
+        budgets = getattr(self, "point_budget", {"preview": 20_000, "export": 200_000, "method": "voxel"})
+        for key, value in {"preview": preview, "export": export, "method": method}.items():
+            if value is not None:
+                budgets[key] = value
+        self.point_budget = budgets
+        self.lods = {}
+
+    def _decimate(self, key, xyz, budget, values=None):
+        """
+        Positions of the points to plot for the budget ("preview" or "export"), the decimation of each point set (key) is cached.
+        """
+
+        if getattr(self, "point_budget", None) is None:
+            self.set_point_budget()
+
+        lod = self.lods.get(key)
+        if lod is None or len(lod) != len(xyz):
+            lod = LevelOfDetail(xyz, self.point_budget["method"])
+            self.lods[key] = lod
+
+        return lod.select(self.point_budget[budget], values)
+
     def plot_points_3d(self, colorby=None):
+        """ 3D scatterplot of the points (decimated to the preview point budget), colored by the variable at the first timestep. """
 
+        values = None
         if colorby is not None:
-            gdf = pd.merge(self.gdf, self.df)
-            gdf = gdf[gdf["Time"] == 1]
+            values = cell_time_array(self.df, colorby, self.gdf["cell_ID"].values, [np.min(self.df["Time"].values)])[:, 0]
 
+        xyz = np.column_stack([self.gdf.geometry.x, self.gdf.geometry.y, self.gdf.geometry.z])
+        idx = self._decimate("points", xyz, "preview", values)
 
         fig = plt.figure() 
         ax = fig.add_subplot(111, projection='3d') 
 
-        ax.scatter(self.gdf.geometry.x, self.gdf.geometry.y, self.gdf.geometry.z, c=gdf[colorby] if colorby is not None else None, s=1)
+        ax.scatter(xyz[idx, 0], xyz[idx, 1], xyz[idx, 2], c=values[idx] if colorby is not None else None, s=1)
         ax.set_zlim(0,150)
 
         plt.show()
 
     def _plot_multisurface(self, ax, multipolygon, color='lightgrey'):
-        """ Plots multipolygon on ax. """
+        """ Plots multipolygon on ax (all the polygons in a single collection). """
 
         from mpl_toolkits.mplot3d.art3d import Poly3DCollection
-        for polygon in multipolygon.iloc[0].geometry.geoms:
-            # Get the exterior coordinates of the Polygon
-            poly_coords = np.array(polygon.exterior.coords)
-            x_surface = poly_coords[:, 0]
-            y_surface = poly_coords[:, 1]
-            try:
-                z_surface = poly_coords[:, 2]
-            except:
-                print(polygon)
-            # Create a 3D polygon and add it to the plot
-            verts = [list(zip(x_surface, y_surface, z_surface))]
+
+        geometry = multipolygon.iloc[0].geometry
+        polygons = geometry.geoms if hasattr(geometry, "geoms") else [geometry]
+        verts = [np.array(polygon.exterior.coords) for polygon in polygons if polygon.has_z]
+        if len(verts) > 0:
             ax.add_collection3d(Poly3DCollection(verts, color=color, alpha=0.5, linewidths=0.2, edgecolors='gray'))
 
         return
@@ -207,6 +552,84 @@ class SurfacePoints(DataPoints):
 
         self.output_folder = None
 
+        # area weighting of the AOI means (see set_area_weighting())
+        self.weighting_mesh = None
+        self.clip_aois = False
+        self.aoi_weights = {}  # {aoi.wkb: (cell_IDs, weights)}
+
+    def set_area_weighting(self, surfmesh, clip : bool = False):
+        """
+        Weights the means of the areas of interest by the areas of the surface triangles (points are much denser on
+        the building edges than on open ground, equal weights bias the means towards the facades).
+
+        Params:
+        -------
+        - surfmesh: gpd.GeoDataFrame | SurfaceMesh (Ferda folder: surface_triangle_shp.shp), None for equal weights
+        - clip: bool, triangles partially inside an area of interest are weighted by their share inside
+        """
+
+        if surfmesh is not None and not isinstance(surfmesh, SurfaceMesh):
+            surfmesh = SurfaceMesh(surfmesh, self.df)
+        if surfmesh is not None:
+            surfmesh.get_triangle_areas()  # computed once per mesh
+
+        self.weighting_mesh = surfmesh
+        self.clip_aois = clip
+        self.aoi_weights = {}
+
+    def _get_aoi_weights(self, aoi):
+        """ Returns the cell_IDs of the area of interest and their weights (computed once per aoi). """
+
+        if aoi.wkb in self.aoi_weights:
+            return self.aoi_weights[aoi.wkb]
+
+        mesh = self.weighting_mesh
+        if mesh is not None and self.clip_aois:
+            # all the triangles touching the aoi, weighted by the share of their footprint inside
+            idx = mesh.surfmesh.sindex.query(aoi, predicate="intersects")
+            triangles = mesh.surfmesh.geometry.values[idx]
+            cell_IDs = mesh.surfmesh["cell_ID"].values[idx]
+
+            footprint = shapely.area(triangles)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                share = shapely.area(shapely.intersection(triangles, aoi)) / footprint
+
+            # vertical triangles (walls) have no footprint, they count if their point is inside
+            walls = footprint == 0
+            points = self.gdf.geometry.values[pd.Index(self.gdf["cell_ID"].values).get_indexer(cell_IDs[walls])]
+            share[walls] = shapely.within(points, aoi)
+
+            weights = mesh.areas.reindex(cell_IDs).values * share
+        else:
+            cell_IDs = self.gdf[self.gdf.within(aoi, align=True)]["cell_ID"].values
+            weights = np.ones(len(cell_IDs)) if mesh is None else mesh.areas.reindex(cell_IDs).values
+
+        self.aoi_weights[aoi.wkb] = (cell_IDs, np.nan_to_num(weights))
+
+        return self.aoi_weights[aoi.wkb]
+
+    @timed("aoi_mean")
+    def _aoi_mean(self, simulation, aoi, variable_name):
+        """
+        Mean of the variable over the area of interest for each timestep (weighted by the triangle areas if
+        set_area_weighting() was called, nans are left out).
+
+        Returns:
+        --------
+        tuple (timesteps, mean values)
+        """
+
+        cell_IDs, weights = self._get_aoi_weights(aoi)
+        timesteps = np.unique(simulation["Time"].values)
+        values = cell_time_array(simulation, variable_name, cell_IDs, timesteps)
+
+        valid = ~np.isnan(values)
+        weights = np.where(valid, weights[:, None], 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = (np.where(valid, values, 0) * weights).sum(axis=0) / weights.sum(axis=0)
+
+        return timesteps, means
+
     def get_layout(self, layout_item, variable_name):
 
         layouts = {
@@ -326,12 +749,21 @@ class SurfacePoints(DataPoints):
         if ((x is None) | (y is None)) & (cell_ID is None):
             raise ValueError("Either (x and y) coordinates or cell_ID must be specified.")
         
+        # extract data with the point probe (the data is pivoted and the KD-tree is built only once)
+        from interpolation import PointProbe
+        if getattr(self, "point_probe", None) is None:
+            self.point_probe = PointProbe(self.gdf, self.df)
+
         if cell_ID is not None:
-            x, y = self.surfpoints[self.surfpoints['cell_ID'] == cell_ID].geometry.x.tolist()[0], self.surfpoints[self.surfpoints['cell_ID'] == cell_ID].geometry.y.tolist()[0]
-    
-        # extract data
-        values = [x for x in self.surfdata[self.surfdata['cell_ID'] == cell_ID][[variable_name]].values]
-        timesteps = [x for x in self.surfdata[self.surfdata['cell_ID'] == cell_ID][["Time"]].values]
+            point = self.gdf[self.gdf['cell_ID'] == cell_ID].geometry.iloc[0]
+            x, y = point.x, point.y
+            series = self.point_probe.cell_series(cell_ID)
+        else:
+            series = self.point_probe.probe([(x, y)])[0]
+            cell_ID = f"{x}_{y}"
+
+        values = series[:, self.point_probe.variables.index(variable_name)]
+        timesteps = self.point_probe.timesteps
         
         fig, ax = plt.subplots(figsize=(10, 6))
 
@@ -377,15 +809,9 @@ class SurfacePoints(DataPoints):
         if not variable_name in df.columns:
             print("Invalid variable.")
 
-        # plot values for each aoi
+        # plot values for each aoi (area weighted if set_area_weighting() was called)
         for idx, aoi in enumerate(aois):
-            # subset
-            cell_IDs = gdf[gdf.within(aoi, align=True)]["cell_ID"].values.tolist()
-            subset = df[df['cell_ID'].isin(cell_IDs)].dropna()
-
-            cell_IDs = np.unique(subset['cell_ID'].values).tolist()  # reinitiate cell_IDs without nans
-            timesteps = np.unique(subset.Time.values).tolist()  # get time steps
-            avg_values = np.mean([subset[subset['cell_ID'] == id][variable_name].values for id in cell_IDs], axis=0)
+            timesteps, avg_values = self._aoi_mean(df, aoi, variable_name)
             plt.plot(timesteps, avg_values, color=colors[idx], label=f"Area {letters[idx]}")
 
         return
@@ -412,11 +838,11 @@ class SurfacePoints(DataPoints):
     def _plot_map(self, fig, ax, variable_name, cmap, time, walls, rooftops, airpoints=None, airdata=None):
 
         if airpoints is not None:
-            merged = gpd.GeoDataFrame(pd.merge(airdata, airpoints[["cell_ID", "geometry"]])).dropna()
-            subset = merged[merged["Time"] == time]
+            subset = gpd.GeoDataFrame(pd.merge(airdata[airdata["Time"] == time], airpoints[["cell_ID", "geometry"]])).dropna()
+            value_range = self.get_catalog({"air": airdata}).get_range(variable_name, ["air"])
         else:
-            merged = gpd.GeoDataFrame(pd.merge(self.df, self.gdf[["cell_ID", "geometry"]])).dropna()
-            subset = merged[merged["Time"] == time]
+            subset = gpd.GeoDataFrame(pd.merge(self.df[self.df["Time"] == time], self.gdf[["cell_ID", "geometry"]])).dropna()
+            value_range = self.get_catalog({"surface": self.df}).get_range(variable_name, ["surface"])
 
         # plot the surface
         import matplotlib.tri as tri
@@ -427,8 +853,8 @@ class SurfacePoints(DataPoints):
             norm = BoundaryNorm(levels, ncolors=cmap.N, clip=True)
             contour = ax.tricontourf(triang, subset[variable_name], levels=levels, cmap=cmap, norm=norm)
         else: 
-            min_value = 10 * (min(merged[variable_name]) // 10)
-            max_value = 10 * (max(merged[variable_name]) // 10)
+            min_value = 10 * (value_range[0] // 10)
+            max_value = 10 * (value_range[1] // 10)
             if variable_name == "Tair":
                 levels = np.arange(min_value, max_value + 1, 1)
                 ticks = np.arange(min_value, max_value + 1, 5)
@@ -486,6 +912,17 @@ class AirPoints(DataPoints):
         self.gdf = gdf
         self.df = df
 
+        # wind flow plots (see plot_windflow())
+        self.arrow_spacing = 10
+        self.windflow_points = {}  # {threshold: air points near the ground}
+        self.windflow_mesh = None  # SurfaceMesh of the wind flow plots (see _get_windflow_mesh())
+        self.windfield = None
+
+    def set_arrow_spacing(self, spacing : float):
+        """ Distance of the arrows (m) of the 2D wind flow plot (the wind is resampled onto a regular grid). """
+        self.arrow_spacing = spacing
+        self.windfield = None
+
     def _remove_buildings(self, surf):
         """
         Creates a subset of surface mesh (surface_points_shp) without buildings, only ground.
@@ -502,6 +939,7 @@ class AirPoints(DataPoints):
         # cache
         outpath = Path("paraviewplus/cache/surf.shp")
         if outpath.is_file():
+            count("cache hits")
             return gpd.read_file(outpath)
 
         surf['x'] = [str(x)[:-5] for x in surf.geometry.x]
@@ -532,6 +970,7 @@ class AirPoints(DataPoints):
             for id in drop_ids:
                 surf = surf[surf['cell_ID'] != id]
 
+        outpath.parent.mkdir(parents=True, exist_ok=True)
         surf.to_file(outpath)
 
         return surf
@@ -540,6 +979,7 @@ class AirPoints(DataPoints):
 
         outpath = Path(f"paraviewplus/cache/surfacepoints_{threshold}m.shp")
         if outpath.is_file():
+            count("cache hits")
             return gpd.read_file(outpath)
 
         # compute vertical distance
@@ -560,21 +1000,62 @@ class AirPoints(DataPoints):
         subset["cell_ID"] = subset["cell_ID_left"]
         subset = subset[["cell_ID", "geometry"]]
 
+        outpath.parent.mkdir(parents=True, exist_ok=True)
         subset.to_file(outpath)
 
         return subset
     
-    def plot_windflow(self, time, surfacemesh=gpd.read_file("paraviewplus/shp/surface_triangle_SHP.shp"),
-                        surfacepoints=gpd.read_file("paraviewplus/shp/surface_point_SHP.shp"),
-                        threshold=2,
-                        dims=3):
+    def _get_windflow_points(self, surfacepoints, threshold):
+        """ Air points at the threshold above the ground (computed only once per threshold). """
+
+        if threshold not in self.windflow_points:
+            if surfacepoints is None:
+                surfacepoints = gpd.read_file("paraviewplus/shp/surface_point_SHP.shp")
+            surf = self._remove_buildings(surfacepoints)
+            self.windflow_points[threshold] = self._above_surface(surf, threshold)
+
+        return self.windflow_points[threshold]
+
+    def _get_windflow_mesh(self, surfacemesh):
+        """ SurfaceMesh under the wind flow (read and built only once, unless another mesh is given). """
+
+        if self.windflow_mesh is None or (surfacemesh is not None and self.windflow_mesh.surfmesh is not surfacemesh):
+            if surfacemesh is None:
+                surfacemesh = gpd.read_file("paraviewplus/shp/surface_triangle_SHP.shp")
+            self.windflow_mesh = SurfaceMesh(surfacemesh, self.df)
 
-        surf = self._remove_buildings(surfacepoints)
-        subset = self._above_surface(surf, threshold)
+        return self.windflow_mesh
 
-        # prepare data
-        data = pd.merge(subset, self.df)
-        data = data[data["Time"] == time]
+    def get_windfield(self, surfacepoints=None, threshold=2):
+        """ Wind field of the air points near the ground resampled onto the grid (see set_arrow_spacing()). """
+
+        from interpolation import WindField
+
+        subset = self._get_windflow_points(surfacepoints, threshold)
+        if self.windfield is None or self.windfield.gdf is not subset:
+            self.windfield = WindField(subset, self.df, self.arrow_spacing)
+
+        return self.windfield
+
+    def plot_windflow(self, time, surfacemesh=None, surfacepoints=None, threshold=2, dims=3, streamlines=False):
+        """
+        Plots the wind flow near the ground at the timestep, in 3D (one arrow per air point, decimated to the export point
+        budget) or in 2D (arrows on a regular grid, see set_arrow_spacing(), and optionally streamlines).
+
+        Params:
+        -------
+        - time: timestep
+        - surfacemesh: gpd.GeoDataFrame, defaults to paraviewplus/shp/surface_triangle_SHP.shp (read only once)
+        - surfacepoints: gpd.GeoDataFrame, defaults to paraviewplus/shp/surface_point_SHP.shp (read only once)
+        - threshold: height above the ground (m)
+        - dims: 2 or 3
+        - streamlines: bool, draws streamlines in the 2D plot
+        """
+
+        subset = self._get_windflow_points(surfacepoints, threshold)
+
+        # prepare data (select the timestep before merging)
+        data = pd.merge(subset, self.get_timestep_data(time, [c for c in ["WindX", "WindY", "WindZ", "WindSpeed"] if c in self.df.columns]))
 
         # Define the grid for the flow 
         x = np.array(data.geometry.x.values, dtype=np.float32)
@@ -597,8 +1078,6 @@ class AirPoints(DataPoints):
             w = np.array(data.WindZ.values, dtype=np.float32) 
             w_normalized = w * wind_speed 
 
-        walls, ground, rooftops = self._classify_surfaces()
-
         # Create a 3D figure 
         fig = plt.figure(figsize=(12, 8)) 
 
@@ -616,22 +1095,35 @@ class AirPoints(DataPoints):
         if dims == 3:
             ax = fig.add_subplot(111, projection='3d')
 
-            self._plot_multisurface(ax, ground, 'grey')
-            #self._plot_multisurface(ax, walls, 'brown')
-            self._plot_multisurface(ax, rooftops, 'red')
+            # one collection for each surface class (walls are not plotted)
+            self._get_windflow_mesh(surfacemesh).plot_scene(ax, colors={'ground': 'grey', 'rooftops': 'red'})
 
-            # Plot the streamlines 
-            ax.quiver(x, y, z, u * wind_speed, v * wind_speed, w * wind_speed, length=5, normalize=False, color=cmap(norm(wind_speed)), linewidth=1)
+            # Plot the streamlines (decimated to the export point budget, the strongest and weakest winds are kept)
+            idx = self._decimate("windflow", np.column_stack([x, y, z]), "export", wind_speed)
+            ax.quiver(x[idx], y[idx], z[idx], (u * wind_speed)[idx], (v * wind_speed)[idx], (w * wind_speed)[idx], length=5, normalize=False,
+                      color=cmap(norm(wind_speed[idx])), linewidth=1)
             ax.view_init(elev=90, azim=45, roll=15)
             ax.set_zlim(0, 100)
             ax.set_zlabel('height')
         else:
             ax = fig.add_subplot()
-            surfacemesh.plot(ax=ax, color='gray', alpha=0.5, edgecolor='gray')
+
+            walls, ground, rooftops = self._get_windflow_mesh(surfacemesh)._classify_surfaces()
             ground.plot(ax=ax, color='lightgray', edgecolor='black', linewidth=0.5)
             walls.plot(ax=ax, color='lightgray', edgecolor='black', linewidth=0.5)
             rooftops.plot(ax=ax, color='lightgray', edgecolor='black', linewidth=0.5)
-            ax.quiver(x, y, u, v, color=cmap(norm(wind_speed)), linewidth=0.1, scale=80, headwidth=2, headlength=2)
+
+            # one arrow per grid node (wind resampled with cached weights)
+            windfield = self.get_windfield(surfacepoints, threshold)
+            X, Y, U, V, S = windfield.vectors(time)
+            valid = ~np.isnan(S)
+            ax.quiver(X[valid], Y[valid], U[valid], V[valid], color=cmap(norm(S[valid])), linewidth=0.1, scale=80, headwidth=2, headlength=2)
+
+            if streamlines:
+                from matplotlib.collections import LineCollection
+                paths = windfield.streamlines(time)
+                ax.add_collection(LineCollection([path[~np.isnan(path[:, 0])] for path in paths.transpose(1, 0, 2)],
+                                                 color='steelblue', linewidth=0.5, alpha=0.8))
             
         # Add a color bar to show the wind speed scale
         from mpl_toolkits.axes_grid1.inset_locator import inset_axes
@@ -644,9 +1136,169 @@ class AirPoints(DataPoints):
         ax.axis('off')
         
 class SurfaceMesh():
+    _classified = {}  # {(rooftops cache file, mtime): (walls, ground, rooftops)} read once per process
+
     def __init__(self, surfmesh : gpd.GeoDataFrame, surfdata : pd.DataFrame):
         self.surfmesh = surfmesh
         self.surfdata = surfdata
+        self.areas = None  # triangle areas indexed by cell_ID (see get_triangle_areas())
+        self.adjacency = None  # sparse triangle adjacency, same order as surfmesh (see get_adjacency())
+        self.surface_classes = None  # ground, rooftops or walls for each triangle (see get_surface_classes())
+        self.scenes = {}  # {classes: faces of each class} (see build_scene())
+
+    def get_triangle_areas(self):
+        """ Areas of the triangles as pd.Series indexed by cell_ID (computed only once per mesh). """
+        if self.areas is None:
+            self.areas = pd.Series(triangle_areas(self.surfmesh.geometry.values), index=self.surfmesh["cell_ID"].values)
+        return self.areas
+
+    def get_surface_classes(self):
+        """
+        Class of each triangle from its normal vector (same rules as _classify_surfaces(), without merging):
+        horizontal triangles are rooftops, vertical triangles are walls and the rest is ground.
+        """
+
+        if self.surface_classes is None:
+            vertices = triangle_vertices(self.surfmesh.geometry.values)
+            normals = np.cross(vertices[:, 1] - vertices[:, 0], vertices[:, 2] - vertices[:, 0])
+            with np.errstate(invalid="ignore", divide="ignore"):
+                nz = normals[:, 2] / np.linalg.norm(normals, axis=1)
+
+            self.surface_classes = np.where(np.abs(nz) == 1, "rooftops", np.where(nz == 0, "walls", "ground"))
+
+        return self.surface_classes
+
+    def build_scene(self, classes=("ground", "rooftops", "walls")):
+        """
+        Assembles the faces of each surface class into one vertex array (only once per mesh and classes).
+
+        Returns:
+        --------
+        dict {class: np.ndarray of shape (n, 3, 3)}
+        """
+
+        key = tuple(classes)
+        if key not in self.scenes:
+            vertices = triangle_vertices(self.surfmesh.geometry.values)
+            surface_classes = self.get_surface_classes()
+            self.scenes[key] = {name: vertices[surface_classes == name] for name in classes}
+
+        return self.scenes[key]
+
+    def plot_scene(self, ax, colors=None, alpha=0.5):
+        """
+        Plots the surface mesh on a 3D axis with a single Poly3DCollection for each surface class.
+
+        Params:
+        -------
+        - ax: 3D axis (projection='3d')
+        - colors: dict {class: color}, only the given classes are plotted (defaults to ground, rooftops and walls)
+        """
+
+        from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+
+        if colors is None:
+            colors = {"ground": "lightgrey", "rooftops": "red", "walls": "brown"}
+
+        for name, verts in self.build_scene(list(colors)).items():
+            if len(verts) > 0:
+                ax.add_collection3d(Poly3DCollection(verts, color=colors[name], alpha=alpha, linewidths=0.2, edgecolors='gray'))
+
+        return
+
+    def export_scene(self, path, colors=None):
+        """
+        Saves the surface mesh as a binary mesh file for external 3D viewers: glTF (.glb, one mesh for each surface
+        class) or PLY (any other suffix, faces coloured by class). The coordinates are stored relative to the minimum
+        corner of the mesh (float32), the offset is kept in the glTF node translation and in a PLY comment.
+
+        Params:
+        -------
+        - path: str (.glb or .ply)
+        - colors: dict {class: color} (defaults to ground, rooftops and walls)
+        """
+
+        from matplotlib.colors import to_rgba
+
+        if colors is None:
+            colors = {"ground": "lightgrey", "rooftops": "red", "walls": "brown"}
+
+        scene = self.build_scene(list(colors))
+        offset = np.concatenate([verts.reshape(-1, 3) for verts in scene.values()]).min(axis=0)
+        scene = {name: (verts - offset).astype(np.float32) for name, verts in scene.items()}
+
+        if str(path).endswith(".glb"):
+            self._write_glb(path, scene, {name: to_rgba(color) for name, color in colors.items()}, offset)
+        else:
+            self._write_ply(path, scene, {name: to_rgba(color) for name, color in colors.items()}, offset)
+
+    @staticmethod
+    def _write_ply(path, scene, colors, offset):
+        """ Binary little endian PLY, triangles of all classes with their class colour. """
+
+        vertices = np.concatenate([verts.reshape(-1, 3) for verts in scene.values()])
+        n_faces = len(vertices) // 3
+        rgb = np.concatenate([np.tile(np.round(np.array(colors[name][:3]) * 255), (len(verts), 1)) for name, verts in scene.items()])
+
+        faces = np.zeros(n_faces, dtype=[("n", "u1"), ("v", "<i4", 3), ("rgb", "u1", 3)])
+        faces["n"] = 3
+        faces["v"] = np.arange(3 * n_faces).reshape(-1, 3)
+        faces["rgb"] = rgb
+
+        header = (
+            "ply\nformat binary_little_endian 1.0\n"
+            f"comment offset {offset[0]} {offset[1]} {offset[2]}\n"
+            f"element vertex {len(vertices)}\nproperty float x\nproperty float y\nproperty float z\n"
+            f"element face {n_faces}\nproperty list uchar int vertex_indices\n"
+            "property uchar red\nproperty uchar green\nproperty uchar blue\nend_header\n"
+        )
+
+        with open(path, "wb") as f:
+            f.write(header.encode("ascii"))
+            f.write(vertices.astype("<f4").tobytes())
+            f.write(faces.tobytes())
+
+    @staticmethod
+    def _write_glb(path, scene, colors, offset):
+        """ Binary glTF 2.0, one mesh (and material) for each surface class. The z axis is turned to the glTF y (up) axis. """
+
+        import struct
+
+        buffer, buffer_views, accessors, meshes, materials, nodes = b"", [], [], [], [], []
+        for name, verts in scene.items():
+            if len(verts) == 0:
+                continue
+            positions = verts.reshape(-1, 3)[:, [0, 2, 1]] * np.array([1, 1, -1], dtype=np.float32)  # x, z, -y
+
+            buffer_views.append({"buffer": 0, "byteOffset": len(buffer), "byteLength": positions.nbytes, "target": 34962})
+            buffer += positions.astype("<f4").tobytes()
+            accessors.append({"bufferView": len(buffer_views) - 1, "componentType": 5126, "count": len(positions), "type": "VEC3",
+                              "min": positions.min(axis=0).tolist(), "max": positions.max(axis=0).tolist()})
+            materials.append({"name": name, "doubleSided": True,
+                              "pbrMetallicRoughness": {"baseColorFactor": list(colors[name]), "metallicFactor": 0, "roughnessFactor": 1}})
+            meshes.append({"name": name, "primitives": [{"attributes": {"POSITION": len(accessors) - 1}, "material": len(materials) - 1}]})
+            nodes.append({"name": name, "mesh": len(meshes) - 1})
+
+        # parent node with the offset of the coordinates (x, z, -y)
+        nodes.append({"name": "scene", "children": list(range(len(nodes))), "translation": [offset[0], offset[2], -offset[1]]})
+        gltf = {"asset": {"version": "2.0"}, "scene": 0, "scenes": [{"nodes": [len(nodes) - 1]}], "nodes": nodes,
+                "meshes": meshes, "materials": materials, "accessors": accessors, "bufferViews": buffer_views,
+                "buffers": [{"byteLength": len(buffer)}]}
+
+        content = json.dumps(gltf).encode("utf-8")
+        content += b" " * (-len(content) % 4)
+        buffer += b"\x00" * (-len(buffer) % 4)
+
+        with open(path, "wb") as f:
+            f.write(struct.pack("<III", 0x46546C67, 2, 12 + 8 + len(content) + 8 + len(buffer)))
+            f.write(struct.pack("<II", len(content), 0x4E4F534A) + content)
+            f.write(struct.pack("<II", len(buffer), 0x004E4942) + buffer)
+
+    def get_adjacency(self):
+        """ Sparse adjacency of the triangles sharing an edge, rows in the order of surfmesh (built only once per mesh). """
+        if self.adjacency is None:
+            self.adjacency = triangle_adjacency(self.surfmesh.geometry.values)
+        return self.adjacency
 
     def plot_by_height(self):
         """ Plot 2D plot of surface mesh colored by height. """
@@ -664,6 +1316,7 @@ class SurfaceMesh():
         plt.show()
 
     
+    @timed("classify_surfaces")
     def _classify_surfaces(self):
 
         outpath = Path("paraviewplus/cache")
@@ -674,7 +1327,13 @@ class SurfaceMesh():
         ground_path = Path(f"{outpath}/ground.shp")
 
         if roof_path.is_file():
-            return gpd.read_file(wall_path), gpd.read_file(ground_path), gpd.read_file(roof_path)
+            # classes already read in this process are shared by all instances (until the cache files change)
+            count("cache hits")
+            key = (str(roof_path.resolve()), roof_path.stat().st_mtime_ns)
+            if key not in SurfaceMesh._classified:
+                SurfaceMesh._classified[key] = gpd.read_file(wall_path), gpd.read_file(ground_path), gpd.read_file(roof_path)
+            return SurfaceMesh._classified[key]
+        count("cache misses")
 
         def _calculate_normal_vector(triangle):
             """Calculate the normal vector of a triangle using its vertices."""
@@ -708,6 +1367,7 @@ class SurfaceMesh():
         surftypes = [[], [], []]
         surfnames = ['walls', 'ground', 'rooftops']
         outfiles = []
+        outpath.mkdir(parents=True, exist_ok=True)  # no folder structure needed (e.g. the first run of a batch job)
 
         for i, surftype in enumerate(self.surfmesh['surftype'].unique()):
             cluster = self.surfmesh[self.surfmesh['surftype'] == surftype].geometry
@@ -723,9 +1383,465 @@ class SurfaceMesh():
             outfiles.append(gdf)
             gdf.to_file(Path(f"{outpath}/{surfnames[i]}.shp"))
 
+        SurfaceMesh._classified[(str(roof_path.resolve()), roof_path.stat().st_mtime_ns)] = tuple(outfiles)
+
         return outfiles
     
 
     
 
 
+
+
+class Scenario():
+    """
+    Simulation scenario (design variant) which references a baseline simulation and stores only the changed
+    variables (overrides) or the changes of the variables (deltas). The geometry, cell_ID and Time columns are
+    shared with the baseline, the values are materialized only when asked for (e.g. per timestep).
+
+    Can be used instead of a pd.DataFrame in SimulationComparison.add_simulation() and ComparisonMap.add_simulation().
+
+    Attributes
+    ----------
+    baseline : pd.DataFrame | Scenario
+        Simulation the scenario is derived from (Ferda folder: surface_data_2021_07_15.csv).
+    name : str
+        Name of the scenario.
+    """
+
+    def __init__(self, baseline, name : str = None) -> None:
+        self.baseline = baseline
+        self.name = name
+
+        self.overrides = {}  # variable name -> values (same length as baseline)
+        self.deltas = {}  # variable name -> change of the baseline values (scalar or same length as baseline)
+        self.version = 0  # incremented with every change of the values (see data_version())
+
+        self._time_rows = None  # positions of the rows of each timestep, computed when needed
+
+    def set_variable(self, variable_name, values):
+        """ Replace values of variable (scalar or array with the length of the baseline). """
+        self.overrides[variable_name] = np.broadcast_to(np.asarray(values), (len(self),))
+        self.deltas.pop(variable_name, None)
+        self.version += 1
+
+    def add_delta(self, variable_name, delta):
+        """ Change the values of variable by delta (scalar or array with the length of the baseline). """
+        if variable_name not in self.columns:
+            raise ValueError(f"Variable {variable_name} not in the baseline simulation.")
+        if variable_name in self.overrides:
+            self.overrides[variable_name] = self.overrides[variable_name] + np.asarray(delta)
+        else:
+            self.deltas[variable_name] = self.deltas.get(variable_name, 0) + np.asarray(delta)
+        self.version += 1
+
+    def remove_variable(self, variable_name):
+        """ Reset variable to the baseline values. """
+        self.overrides.pop(variable_name, None)
+        self.deltas.pop(variable_name, None)
+        self.version += 1
+
+    @property
+    def columns(self):
+        columns = [c for c in self.baseline.columns]
+        return columns + [c for c in self.overrides.keys() if c not in columns]
+
+    def __len__(self):
+        return len(self.baseline)
+
+    def get_variable(self, variable_name, rows=None):
+        """
+        Materialize values of variable.
+
+        Params:
+        -------
+        - variable_name: str
+        - rows: positions of the rows (defaults to all rows)
+
+        Returns:
+        --------
+        np.ndarray of the values.
+        """
+
+        if variable_name in self.overrides:
+            values = self.overrides[variable_name]
+            return values if rows is None else values[rows]
+
+        if isinstance(self.baseline, Scenario):
+            values = self.baseline.get_variable(variable_name, rows)
+        else:
+            values = self.baseline[variable_name].values
+            values = values if rows is None else values[rows]
+
+        if variable_name in self.deltas:
+            delta = self.deltas[variable_name]
+            values = values + (delta if (delta.ndim == 0 or rows is None) else delta[rows])
+
+        return values
+
+    def _index(self):
+        """ Index of the baseline (shared by all the scenarios derived from it). """
+        return self.baseline._index() if isinstance(self.baseline, Scenario) else self.baseline.index
+
+    def to_dataframe(self, columns=None, rows=None):
+        """ Materialize the scenario (or selected columns/rows of it) as pd.DataFrame. """
+
+        if columns is None:
+            columns = self.columns
+        index = self._index() if rows is None else self._index()[rows]
+
+        return pd.DataFrame({c: self.get_variable(c, rows) for c in columns}, index=index)
+
+    def get_timestep(self, time, columns=None):
+        """ Materialize only the rows of the selected timestep as pd.DataFrame. """
+
+        if self._time_rows is None:
+            times = self.get_variable("Time")
+            order = np.argsort(times, kind="stable")
+            unique, starts = np.unique(times[order], return_index=True)
+            self._time_rows = dict(zip(unique, np.split(order, starts[1:])))
+
+        rows = self._time_rows.get(time, np.array([], dtype=int))
+
+        return self.to_dataframe(columns, rows)
+
+    def __getitem__(self, key):
+        """ Select like from pd.DataFrame: a column name, a list of column names or a boolean mask of rows. """
+
+        if isinstance(key, str):
+            return pd.Series(self.get_variable(key), index=self._index(), name=key)
+        elif isinstance(key, list):
+            return self.to_dataframe(key)
+        else:
+            return self.to_dataframe(rows=np.flatnonzero(np.asarray(key)))
+
+    def memory_usage(self):
+        """ Number of bytes stored by the scenario itself (without the baseline). """
+        return sum(np.asarray(v).nbytes for v in list(self.overrides.values()) + list(self.deltas.values()))
+
+
+def data_version(data):
+    """
+    Key of the state of simulation data for the caches of derived arrays: the object, and for a Scenario the version
+    of its values (and of the scenarios it is derived from), so the caches are rebuilt after add_delta() or set_variable().
+    """
+    if isinstance(data, Scenario):
+        return (id(data), data.version, data_version(data.baseline))
+    return (id(data),)
+
+
+class SimulationCatalog():
+    """
+    Simulation results of several days (e.g. a heat wave of 7-14 days) on one time axis. The per-day data files of a
+    Ferda output folder (surface_data_2021_07_15.csv, surface_data_2021_07_16.csv, ...) are discovered, and the
+    Time of the rows becomes the hours since the midnight before the first day (Time 1 of the second day is 25), so
+    base_date + Time hours is the datetime of a row (see to_datetime()) and all the classes run over several days.
+
+    The days are read only when a requested time range touches them (several days in parallel) and are kept in
+    memory until clear().
+
+        catalog = SimulationCatalog("paraviewplus/shp", "surface")
+        surfdata = catalog.load("2021-07-15 12:00", "2021-07-18 18:00")
+        tsd = TimeSeriesDemonstration(surfpoints, surfdata, airpoints, airdata, surfmesh, base_date=catalog.base_date)
+
+    Attributes
+    ----------
+    folder : Path
+        Ferda output folder.
+    dataset : str
+        "surface" or "air" (prefix of the data files).
+    files : dict
+        Data file of each day (datetime.date -> Path).
+    base_date : datetime
+        Midnight before the first day (Time 0 of the axis).
+    """
+
+    def __init__(self, folder : str = "paraviewplus/shp", dataset : str = "surface", columns : list = None, workers : int = 4) -> None:
+        """
+        Params:
+        -------
+        - folder: str, Ferda output folder
+        - dataset: str, "surface" or "air"
+        - columns: list of variables to read (defaults to all, cell_ID and Time are always read)
+        - workers: int, days read in parallel
+        """
+
+        self.folder = Path(folder)
+        self.dataset = dataset
+        self.columns = None if columns is None else ["cell_ID", "Time"] + [c for c in columns if c not in ["cell_ID", "Time"]]
+        self.workers = workers
+
+        pattern = re.compile(rf"{re.escape(dataset)}_data_(\d{{4}})_(\d{{2}})_(\d{{2}})\.csv")
+        self.files = {}
+        for path in self.folder.glob(f"{dataset}_data_*.csv"):
+            match = pattern.fullmatch(path.name)
+            if match is not None:
+                self.files[datetime(*map(int, match.groups())).date()] = path
+        self.files = dict(sorted(self.files.items()))
+        if len(self.files) == 0:
+            raise FileNotFoundError(f"No {dataset}_data_YYYY_MM_DD.csv files in {self.folder}.")
+
+        self.base_date = datetime.combine(self.days[0], datetime.min.time())
+
+        self._data = {}  # day -> rows of the day (Time on the axis of the catalog)
+        self._lock = threading.Lock()
+
+    @property
+    def days(self):
+        """ Days of the catalog (datetime.date), sorted. """
+        return list(self.files.keys())
+
+    def to_datetime(self, times):
+        """ Datetimes of times on the axis (hours since base_date): pd.Timestamp or pd.DatetimeIndex. """
+        if np.ndim(times) == 0:
+            return pd.Timestamp(self.base_date) + pd.to_timedelta(float(times), unit="h")
+        return pd.Timestamp(self.base_date) + pd.to_timedelta(np.asarray(times, dtype=float), unit="h")
+
+    def to_time(self, when):
+        """
+        Time on the axis (hours since base_date) of datetimes.
+
+        Params:
+        -------
+        - when: number (already a time), str ("2021-07-15 12:00"), datetime, pd.Timestamp or list of them
+
+        Returns:
+        --------
+        float or np.ndarray of floats.
+        """
+
+        if isinstance(when, (int, float, np.number)):
+            return float(when)
+        if np.ndim(when) > 0:
+            return np.array([self.to_time(w) for w in when])
+
+        return (pd.Timestamp(when) - pd.Timestamp(self.base_date)) / pd.Timedelta(hours=1)
+
+    def _offset(self, day):
+        """ Hours of the axis before the day. """
+        return 24 * (day - self.days[0]).days
+
+    def days_in_range(self, start=None, end=None):
+        """ Days whose times (Time 0-24 of the day) touch the range (start and end: see to_time(), None = open). """
+
+        start = -np.inf if start is None else self.to_time(start)
+        end = np.inf if end is None else self.to_time(end)
+
+        return [day for day in self.days if self._offset(day) <= end and self._offset(day) + 24 >= start]
+
+    def _read_day(self, day):
+        with span("read day"):
+            data = pd.read_csv(self.files[day], usecols=self.columns)
+        data["Time"] += self._offset(day)
+        count("days read")
+
+        return day, data
+
+    def load(self, start=None, end=None):
+        """
+        Rows of a time range, read from the days which are not in memory yet (in parallel).
+
+        Params:
+        -------
+        - start: first time (see to_time(), e.g. "2021-07-15 12:00" or hours on the axis), None from the first day
+        - end: last time, None until the last day
+
+        Returns:
+        --------
+        pd.DataFrame (cell_ID, Time in hours since base_date and the variables) like the data of one day. Raises ValueError
+        if the range contains no timestep.
+        """
+
+        days = self.days_in_range(start, end)
+        if len(days) == 0:
+            raise ValueError(f"No simulated day in the range {start} - {end}, the catalog has {self.days[0]} - {self.days[-1]}.")
+
+        with self._lock:
+            missing = [day for day in days if day not in self._data]
+            if len(missing) > 0:
+                with ThreadPoolExecutor(max(min(self.workers, len(missing)), 1)) as pool:
+                    self._data.update(pool.map(self._read_day, missing))
+
+        data = pd.concat([self._data[day] for day in days], ignore_index=True) if len(days) > 1 else self._data[days[0]].copy()
+        if start is not None or end is not None:
+            times = data["Time"].values
+            inside = (times >= (self.to_time(start) if start is not None else -np.inf)) & (times <= (self.to_time(end) if end is not None else np.inf))
+            if not inside.any():
+                raise ValueError(f"No timestep in the range {start} - {end}, the catalog has {self.days[0]} - {self.days[-1]}.")
+            if not inside.all():
+                data = data[inside].reset_index(drop=True)
+
+        return data
+
+    def get_datetimes(self, start=None, end=None):
+        """ Datetimes of the timesteps in the range (reads the days like load()), pd.DatetimeIndex. """
+        return self.to_datetime(np.unique(self.load(start, end)["Time"].values))
+
+    def clear(self):
+        """ Releases the days in memory. """
+        with self._lock:
+            self._data = {}
+
+
+class StatisticsCatalog():
+    """
+    Statistics (min, max, percentiles and number of nans) of each variable for each dataset (simulation, scenario)
+    and timestep, plus the same statistics over all the timesteps. Computed once when a dataset is added and saved
+    to the cache folder, so that the colour scales and axis limits of the plots are only looked up (and the same
+    for all the frames of a run).
+
+    Attributes
+    ----------
+    cache_folder : str
+        Folder where the statistics are saved (one json file per dataset).
+    percentiles : tuple
+        Percentiles which are computed.
+    """
+
+    def __init__(self, cache_folder : str = "paraviewplus/cache", percentiles : tuple = (1, 2, 5, 25, 50, 75, 95, 98, 99)) -> None:
+        self.cache_folder = cache_folder
+        self.percentiles = percentiles
+
+        self.stats = {}  # dataset name -> variable name -> statistics
+        self._sources = {}  # dataset name -> data_version() of the data the statistics were computed from
+
+    def _cache_path(self, name):
+        return Path(self.cache_folder) / Path("stats_" + "".join(c if c.isalnum() else "_" for c in str(name)) + ".json")
+
+    def _fingerprint(self, data, variables):
+        """
+        Fingerprint of the data (hash of all the values of cell_ID, Time and the variables, one column at a time), used
+        to check whether the cached statistics belong to the data. Hashing is cheap next to computing the statistics.
+        """
+
+        h = hashlib.sha1(f"{len(data)}-{'-'.join(variables)}".encode())
+        for column in ["cell_ID", "Time"] + variables:
+            values = data.get_variable(column) if isinstance(data, Scenario) else data[column].values
+            h.update(pd.util.hash_array(np.asarray(values)).tobytes())
+
+        return h.hexdigest()
+
+    def has_dataset(self, name, data=None):
+        """ Check if statistics of the dataset exist (and were computed from data, if it is given). """
+        if name not in self.stats:
+            return False
+        return data is None or self._sources.get(name) == data_version(data)
+
+    def add_dataset(self, data, name : str, variables : list = None):
+        """
+        Compute statistics of the dataset (or load them from the cache folder if they were computed for the same data).
+
+        Params:
+        -------
+        - data: pd.DataFrame | Scenario (long format Ferda data with columns cell_ID, Time and the variables)
+        - name: str (name of the dataset, e.g. "surface", "air" or name of the scenario)
+        - variables: list of variables (defaults to all numeric columns except cell_ID and Time)
+        """
+
+        if variables is None:
+            variables = [c for c in data.columns if c not in ["cell_ID", "Time"] and np.issubdtype(data[c].dtype, np.number)]
+
+        fingerprint = self._fingerprint(data, variables)
+
+        # cache
+        path = self._cache_path(name)
+        if path.is_file():
+            cached = json.loads(path.read_text())
+            if cached["fingerprint"] == fingerprint:
+                self.stats[name] = cached["variables"]
+                self._sources[name] = data_version(data)
+                return
+
+        timesteps = np.unique(data["Time"].values)
+        cell_IDs = np.unique(data["cell_ID"].values)
+
+        self.stats[name] = {}
+        for variable_name in variables:
+            values = cell_time_array(data, variable_name, cell_IDs, timesteps)
+            self.stats[name][variable_name] = self._statistics(values, timesteps)
+
+        self._sources[name] = data_version(data)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({"fingerprint": fingerprint, "variables": self.stats[name]}))
+
+    def _statistics(self, values, timesteps):
+        """ Statistics of a cells x timesteps array for each timestep (lists) and over all timesteps ("all"). """
+
+        nans = np.isnan(values)
+        valid = ~nans.all(axis=0)  # timesteps without any value get None
+
+        def _per_timestep(func):
+            result = np.full(values.shape[1], np.nan)
+            if valid.any():
+                result[valid] = func(values[:, valid])
+            return [None if np.isnan(v) else float(v) for v in result]
+
+        stats = {
+            "timesteps": [float(t) for t in timesteps],
+            "min": _per_timestep(lambda v: np.nanmin(v, axis=0)),
+            "max": _per_timestep(lambda v: np.nanmax(v, axis=0)),
+            "nans": [int(n) for n in nans.sum(axis=0)],
+            "count": [int(n) for n in (~nans).sum(axis=0)],
+        }
+        if valid.any():
+            per_timestep = np.full((len(self.percentiles), values.shape[1]), np.nan)
+            per_timestep[:, valid] = np.nanpercentile(values[:, valid], self.percentiles, axis=0)
+            overall = np.nanpercentile(values, self.percentiles)
+        else:
+            per_timestep = np.full((len(self.percentiles), values.shape[1]), np.nan)
+            overall = np.full(len(self.percentiles), np.nan)
+
+        stats["all"] = {"min": float(np.nanmin(values)) if valid.any() else None,
+                        "max": float(np.nanmax(values)) if valid.any() else None,
+                        "nans": int(nans.sum()), "count": int((~nans).sum())}
+        for p, row, value in zip(self.percentiles, per_timestep, overall):
+            stats[f"p{p}"] = [None if np.isnan(v) else float(v) for v in row]
+            stats["all"][f"p{p}"] = None if np.isnan(value) else float(value)
+
+        return stats
+
+    def get_statistic(self, variable_name, statistic, name, time=None):
+        """
+        Look up statistic of the variable in the dataset.
+
+        Params:
+        -------
+        - variable_name: str
+        - statistic: "min", "max", "nans", "count" or "p<percentile>" (e.g. "p98")
+        - name: name of the dataset
+        - time: timestep (defaults to the statistic over all the timesteps)
+        """
+
+        stats = self.stats[name][variable_name]
+        if time is None:
+            return stats["all"][statistic]
+
+        if float(time) not in stats["timesteps"]:
+            raise ValueError(f"Selected time not in timesteps!! You selected {time} but timesteps are: {stats['timesteps']}")
+        return stats[statistic][stats["timesteps"].index(float(time))]
+
+    def get_range(self, variable_name, names=None, time=None, percentiles=None):
+        """
+        Range of the variable over the datasets (same scale for all the compared simulations).
+
+        Params:
+        -------
+        - variable_name: str
+        - names: list of dataset names (defaults to all datasets with the variable)
+        - time: timestep (defaults to all the timesteps)
+        - percentiles: tuple (lower, upper) to use percentiles instead of min and max (e.g. (2, 98))
+
+        Returns:
+        --------
+        tuple (lower, upper)
+        """
+
+        if names is None:
+            names = [name for name in self.stats if variable_name in self.stats[name]]
+
+        lower, upper = ("min", "max") if percentiles is None else (f"p{percentiles[0]}", f"p{percentiles[1]}")
+        lowers = [self.get_statistic(variable_name, lower, name, time) for name in names]
+        uppers = [self.get_statistic(variable_name, upper, name, time) for name in names]
+
+        return (min(v for v in lowers if v is not None), max(v for v in uppers if v is not None))
@@ -0,0 +1,648 @@
+"""
+Spatial and temporal interpolation of the simulation results (probing at arbitrary locations).
+"""
+
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+import hashlib
+from pathlib import Path
+from scipy import sparse
+from scipy.spatial import cKDTree, Delaunay
+from scipy.interpolate import PchipInterpolator
+
+from inputs import cell_time_array
+from profiling import span, count
+from memory import budget
+
+
+def read_locations(path, x="x", y="y", z="z"):
+    """
+    Reads locations (e.g. sensors) from a csv file (columns x, y and optionally z) or from a point shapefile.
+
+    Returns:
+    --------
+    np.ndarray of shape (locations, 2) or (locations, 3).
+    """
+
+    if str(path).endswith(".csv"):
+        df = pd.read_csv(path)
+        columns = [x, y, z] if z in df.columns else [x, y]
+        return df[columns].values.astype(float)
+
+    gdf = gpd.read_file(path)
+    if gdf.geometry.has_z.all():
+        return np.column_stack([gdf.geometry.x, gdf.geometry.y, gdf.geometry.z])
+    return np.column_stack([gdf.geometry.x, gdf.geometry.y])
+
+
+class TemporalInterpolator():
+    """
+    Values of cells x timesteps arrays (any leading dimensions, time on the last axis) at arbitrary times, e.g. between
+    the hourly Ferda outputs for animations or at the timestamps of measurements. Many times are evaluated at once.
+
+    Missing values (nan) are skipped: a time between two valid values of a cell is interpolated between them, also
+    across gaps. Times before the first or after the last valid value of a cell are nan (no extrapolation).
+
+    Attributes
+    ----------
+    timesteps : np.ndarray
+        Sorted times of the values.
+    values : np.ndarray
+        Values of shape (..., timesteps).
+    method : str
+        "linear" or "cubic" (monotone piecewise cubic, PCHIP: no overshoots between the timesteps).
+    period : float
+        Period of cyclic values (e.g. 360 for wind directions), interpolated along the shorter arc. None otherwise.
+    """
+
+    METHODS = ("linear", "cubic")
+
+    def __init__(self, timesteps, values, method : str = "linear", period : float = None) -> None:
+        if method not in self.METHODS:
+            raise ValueError(f"Method can only be 'linear' or 'cubic', not {method}.")
+
+        self.timesteps = np.asarray(timesteps, dtype=float)
+        self.values = np.asarray(values)
+        if self.values.shape[-1] != len(self.timesteps):
+            raise ValueError(f"The last axis of the values ({self.values.shape[-1]}) has to match the timesteps ({len(self.timesteps)}).")
+        if np.any(np.diff(self.timesteps) <= 0):
+            raise ValueError("Timesteps have to be sorted and unique.")
+        self.method = method
+        self.period = period
+
+        # positions of the last valid value at or before and of the first valid value at or after each timestep
+        flat = self.values.reshape(-1, len(self.timesteps))
+        valid = ~np.isnan(flat)
+        positions = np.arange(len(self.timesteps))
+        self._previous = np.maximum.accumulate(np.where(valid, positions, -1), axis=1)
+        self._next = np.minimum.accumulate(np.where(valid, positions, len(positions))[:, ::-1], axis=1)[:, ::-1]
+        self._sources = None  # interpolated arrays (unit vector components of cyclic values) and their cubic splines
+
+    def __call__(self, times):
+        """
+        Interpolates the values at the times.
+
+        Params:
+        -------
+        - times: float or array of times (any order, timesteps are returned unchanged)
+
+        Returns:
+        --------
+        np.ndarray of shape (..., len(times)), or (...) for a single time.
+        """
+
+        scalar = np.ndim(times) == 0
+        times = np.atleast_1d(np.asarray(times, dtype=float))
+        sources = self._get_sources()
+
+        result = np.empty((len(sources[0][0]), len(times)), dtype=np.result_type(self.values.dtype, np.float32))
+        for chunk in budget.chunks(40 * len(result), len(times)):  # gathered positions, values and weights of a time
+            with span("temporal interpolation"):
+                if self.period is None:
+                    result[:, chunk] = self._interpolate(*sources[0], times[chunk])
+                else:
+                    # cyclic values: interpolate the unit vectors, the angle of the result follows the shorter arc
+                    x, y = (self._interpolate(*source, times[chunk]) for source in sources)
+                    result[:, chunk] = np.mod(np.arctan2(y, x) * self.period / (2 * np.pi), self.period)
+        count("interpolated values", result.size)
+
+        result = result.reshape(*self.values.shape[:-1], len(times))
+        return result[..., 0] if scalar else result
+
+    def _get_sources(self):
+        """ Arrays which are interpolated (values or unit vector components of cyclic values) and their cubic splines. """
+
+        if self._sources is None:
+            flat = self.values.reshape(-1, len(self.timesteps))
+            if self.period is not None:
+                angles = 2 * np.pi * flat / self.period
+                arrays = [np.cos(angles), np.sin(angles)]
+            else:
+                arrays = [flat]
+
+            # monotone cubic through the values with the gaps bridged linearly (and the ends held)
+            cubic = self.method == "cubic" and len(self.timesteps) >= 3
+            self._sources = [(array, PchipInterpolator(self.timesteps, self._filled(array), axis=1, extrapolate=False) if cubic else None)
+                             for array in arrays]
+
+        return self._sources
+
+    def _interpolate(self, flat, cubic, times):
+        n = len(self.timesteps)
+        before = np.searchsorted(self.timesteps, times, side="right") - 1  # last timestep at or before the time
+        after = np.searchsorted(self.timesteps, times, side="left")  # first timestep at or after the time
+
+        left = np.where(before >= 0, self._previous[:, np.clip(before, 0, n - 1)], -1)
+        right = np.where(after < n, self._next[:, np.clip(after, 0, n - 1)], n)
+        inside = (left >= 0) & (right < n)
+        left, right = np.clip(left, 0, n - 1), np.clip(right, 0, n - 1)
+
+        rows = np.arange(len(flat))[:, None]
+        t0, t1 = self.timesteps[left], self.timesteps[right]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weight = np.where(t1 > t0, (times - t0) / (t1 - t0), 0)
+        linear = flat[rows, left] + weight * (flat[rows, right] - flat[rows, left])
+        linear[~inside] = np.nan
+
+        if cubic is None:
+            return linear
+
+        # outside of the valid values of a cell the cubic result stays nan like the linear one
+        return np.where(inside, cubic(times), np.nan)
+
+    def _filled(self, flat):
+        """ Values with the gaps filled linearly and the values before the first / after the last valid value held. """
+
+        n = len(self.timesteps)
+        rows = np.arange(len(flat))[:, None]
+        left, right = self._previous, self._next
+        t0 = self.timesteps[np.clip(left, 0, n - 1)]
+        t1 = self.timesteps[np.clip(right, 0, n - 1)]
+        v0, v1 = flat[rows, np.clip(left, 0, n - 1)], flat[rows, np.clip(right, 0, n - 1)]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            gaps = np.where(t1 > t0, v0 + (self.timesteps - t0) / (t1 - t0) * (v1 - v0), v0)
+        filled = np.where(left < 0, v1, np.where(right >= n, v0, gaps))
+
+        return np.where(np.isnan(filled), 0, filled)  # cells without any value
+
+
+class SimulationInterpolator():
+    """
+    Simulation results at arbitrary times: the variables are pivoted once to cells x timesteps arrays (see
+    cell_time_array() in inputs.py) and interpolated in time with TemporalInterpolator.
+
+    Attributes
+    ----------
+    df : pd.DataFrame | Scenario
+        Simulation (Ferda folder: surface_data_2021_07_15.csv or air_data_2021_07_15.csv).
+    variables : list
+        Interpolated variables (defaults to all numeric columns except cell_ID and Time).
+    method : str
+        "linear" or "cubic" (see TemporalInterpolator).
+    """
+
+    # cyclic variables and their period
+    PERIODS = {"WindDirection": 360}
+
+    def __init__(self, df, variables : list = None, cell_IDs=None, method : str = "linear") -> None:
+        self.df = df
+        if variables is None:
+            variables = [c for c in df.columns if c not in ["cell_ID", "Time"] and np.issubdtype(df[c].dtype, np.number)]
+        self.variables = list(variables)
+        self.cell_IDs = np.unique(df["cell_ID"].values) if cell_IDs is None else np.asarray(cell_IDs)
+        self.timesteps = np.unique(df["Time"].values)
+        self.method = method
+
+        self.interpolators = {}  # variable name -> TemporalInterpolator, created when needed
+
+    def get_interpolator(self, variable_name):
+        if variable_name not in self.interpolators:
+            values = cell_time_array(self.df, variable_name, self.cell_IDs, self.timesteps)
+            self.interpolators[variable_name] = TemporalInterpolator(self.timesteps, values, self.method,
+                                                                     self.PERIODS.get(variable_name))
+        return self.interpolators[variable_name]
+
+    def values(self, variable_name, times):
+        """ Values of the variable at the times, np.ndarray of shape (cells, len(times)) in the order of cell_IDs. """
+        return self.get_interpolator(variable_name)(np.atleast_1d(times))
+
+    def frame(self, time, variables : list = None):
+        """
+        Rows of all the cells at a time, like the rows of one timestep of the simulation.
+
+        Params:
+        -------
+        - time: float, between the first and the last timestep
+        - variables: list (defaults to all the variables)
+
+        Returns:
+        --------
+        pd.DataFrame with the columns cell_ID, Time and the variables.
+        """
+
+        variables = self.variables if variables is None else variables
+        frame = pd.DataFrame({"cell_ID": self.cell_IDs, "Time": float(time)})
+        for variable_name in variables:
+            frame[variable_name] = self.get_interpolator(variable_name)(time)
+
+        return frame
+
+
+class PointProbe():
+    """
+    Extracts time series of all the variables at arbitrary locations (e.g. sensors for validation against field
+    measurements). A KD-tree over the cell coordinates is built once, the data is pivoted to a
+    variables x cells x timesteps array once, so thousands of locations are probed at once.
+
+    Attributes
+    ----------
+    gdf : gpd.GeoDataFrame
+        Points (Ferda folder: surface_point_shp.shp or air_point_shp.shp).
+    df : pd.DataFrame
+        Data of the points (Ferda folder: surface_data_2021_07_15.csv or air_data_2021_07_15.csv).
+    variables : list
+        Variables to extract (defaults to all numeric columns except cell_ID and Time).
+    dims : int
+        2 for nearest cells in x, y or 3 for nearest cells in x, y, z.
+    """
+
+    def __init__(self, gdf : gpd.GeoDataFrame, df : pd.DataFrame, variables : list = None, dims : int = 2) -> None:
+        self.gdf = gdf
+        self.df = df
+        self.dims = dims
+
+        if variables is None:
+            variables = [c for c in df.columns if c not in ["cell_ID", "Time"] and np.issubdtype(df[c].dtype, np.number)]
+        self.variables = variables
+        self.timesteps = [x for x in np.unique(df["Time"].values)]
+
+        coords = [gdf.geometry.x.values, gdf.geometry.y.values]
+        if dims == 3:
+            coords.append(gdf.geometry.z.values)
+        self.tree = cKDTree(np.column_stack(coords))
+
+        self.values = None  # variables x cells x timesteps, created when needed
+
+    def _get_values(self):
+        if self.values is None:
+            cell_IDs = self.gdf["cell_ID"].values
+            self.values = np.stack([cell_time_array(self.df, v, cell_IDs, self.timesteps, dtype=np.float32) for v in self.variables])
+        return self.values
+
+    def _locations(self, locations):
+        """ Converts locations (array, list of shapely points or GeoSeries/GeoDataFrame of points) to array of coordinates. """
+
+        if isinstance(locations, (gpd.GeoSeries, gpd.GeoDataFrame)):
+            locations = list(locations.geometry)
+        if len(locations) > 0 and hasattr(locations[0], "coords"):
+            locations = [p.coords[0] for p in locations]
+
+        return np.atleast_2d(np.asarray(locations, dtype=float))[:, :self.dims]
+
+    def nearest(self, locations, k=1):
+        """
+        Finds the k nearest cells of each location.
+
+        Returns:
+        --------
+        tuple (distances, positions of the cells in gdf), both of shape (locations, k).
+        """
+
+        distances, positions = self.tree.query(self._locations(locations), k=k)
+
+        return distances.reshape(-1, k), positions.reshape(-1, k)
+
+    def cell_series(self, cell_ID):
+        """ Time series of all the variables of a cell, np.ndarray of shape (timesteps, variables). """
+
+        position = np.flatnonzero(self.gdf["cell_ID"].values == cell_ID)
+        if len(position) == 0:
+            raise ValueError(f"Cell {cell_ID} not in the points.")
+
+        return self._get_values()[:, position[0], :].T
+
+    def probe(self, locations, method="nearest", k=4, power=2, times=None, interpolation="linear"):
+        """
+        Extracts the time series of all the variables at the locations.
+
+        Params:
+        -------
+        - locations: array of coordinates (locations x 2 or 3), list of shapely points or GeoSeries/GeoDataFrame of points
+        - method: "nearest" (value of the nearest cell) or "idw" (inverse distance weighted mean of the k nearest cells)
+        - k: number of cells for "idw"
+        - power: power of the distances for "idw"
+        - times: times of the values (e.g. timestamps of measurements in hours), interpolated between the timesteps
+          (defaults to the timesteps)
+        - interpolation: "linear" or "cubic" (monotone), see TemporalInterpolator
+
+        Returns:
+        --------
+        np.ndarray of shape (locations, timesteps or times, variables).
+        """
+
+        result = self._probe(locations, method, k, power)
+        if times is None:
+            return result
+
+        # interpolated after the spatial selection, only the time series of the locations
+        return np.stack([TemporalInterpolator(self.timesteps, result[:, :, i], interpolation, SimulationInterpolator.PERIODS.get(v))(np.atleast_1d(times))
+                         for i, v in enumerate(self.variables)], axis=2)
+
+    def _probe(self, locations, method, k, power):
+        values = self._get_values()
+
+        if method == "nearest":
+            distances, positions = self.nearest(locations, k=1)
+            return values[:, positions[:, 0], :].transpose(1, 2, 0)
+
+        elif method == "idw":
+            distances, positions = self.nearest(locations, k=k)
+
+            # weights (locations at a cell get only the value of the cell)
+            with np.errstate(divide="ignore"):
+                weights = 1 / distances ** power
+            exact = distances == 0
+            weights[exact.any(axis=1)] = exact[exact.any(axis=1)]
+
+            neighbours = values[:, positions, :]  # variables x locations x k x timesteps
+            valid = ~np.isnan(neighbours)
+            w = weights[None, :, :, None] * valid  # nans are left out of the weights
+            with np.errstate(invalid="ignore"):
+                result = (np.where(valid, neighbours, 0) * w).sum(axis=2) / w.sum(axis=2)
+
+            return result.transpose(1, 2, 0)
+
+        raise ValueError(f"Method can only be 'nearest' or 'idw', not {method}.")
+
+    def probe_dataframe(self, locations, method="nearest", k=4, power=2, times=None, interpolation="linear"):
+        """ Same as probe(), returned as long format pd.DataFrame (location, Time and the variables). """
+
+        result = self.probe(locations, method, k, power, times, interpolation)
+        n, t, _ = result.shape
+
+        df = pd.DataFrame(result.reshape(n * t, -1), columns=self.variables)
+        df.insert(0, "Time", np.tile(self.timesteps if times is None else np.atleast_1d(times), n))
+        df.insert(0, "location", np.repeat(np.arange(n), t))
+
+        return df
+
+
+class GridResampler():
+    """
+    Linear interpolation of point values onto a regular grid. The Delaunay triangulation of the points, the triangle
+    of each grid node and its barycentric weights are computed only once per point set and grid (cached in memory and
+    in the cache folder) and stored as a sparse matrix, any variable at any timestep or scenario is then resampled with
+    a sparse matrix product (no triangulation per frame).
+
+    Attributes
+    ----------
+    xy : np.ndarray
+        Coordinates of the points, shape (n, 2).
+    spacing : float
+        Distance of the grid nodes (m).
+    bounds : tuple
+        (xmin, ymin, xmax, ymax) of the grid, defaults to the bounds of the points.
+    cache_folder : str
+        Folder for the weights (None to keep them only in memory).
+    """
+
+    _cache = {}  # {key: (inside, vertices, weights)} shared by all the resamplers
+
+    def __init__(self, xy, spacing : float, bounds : tuple = None, cache_folder : str = "paraviewplus/cache") -> None:
+        self.xy = np.asarray(xy, dtype=np.float64)[:, :2]
+        self.spacing = spacing
+        self.cache_folder = cache_folder
+
+        xmin, ymin, xmax, ymax = bounds if bounds is not None else (*self.xy.min(axis=0), *self.xy.max(axis=0))
+        self.x = np.arange(xmin, xmax + spacing / 2, spacing)
+        self.y = np.arange(ymin, ymax + spacing / 2, spacing)
+        self.shape = (len(self.y), len(self.x))
+
+        self._load_weights()
+
+        # sparse matrix (grid nodes x points), rows of the nodes outside the convex hull are empty
+        rows = np.repeat(np.flatnonzero(self.inside), 3)
+        self.matrix = sparse.csr_matrix((self.weights.ravel(), (rows, self.vertices.ravel())), shape=(self.inside.size, len(self.xy)))
+
+    def _key(self):
+        """ Key of the point set and the grid. """
+        digest = hashlib.sha1(self.xy.tobytes())
+        digest.update(np.array([self.x[0], self.y[0], self.spacing, *self.shape], dtype=np.float64).tobytes())
+        return digest.hexdigest()[:16]
+
+    def _load_weights(self):
+        """ Weights from the memory or file cache, computed if they are not cached yet. """
+
+        key = self._key()
+        path = Path(f"{self.cache_folder}/grid_weights_{key}.npz") if self.cache_folder is not None else None
+
+        if key in self._cache:
+            count("cache hits")
+        else:
+            count("cache misses")
+            if path is not None and path.is_file():
+                cached = np.load(path)
+                self._cache[key] = (cached["inside"], cached["vertices"], cached["weights"])
+            else:
+                with span("grid weights"):
+                    self._cache[key] = self._compute_weights()
+                if path is not None:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    np.savez(path, inside=self._cache[key][0], vertices=self._cache[key][1], weights=self._cache[key][2])
+
+        self.inside, self.vertices, self.weights = self._cache[key]
+
+    def _compute_weights(self):
+        """ Triangle (3 point positions) and barycentric weights of each grid node inside the convex hull of the points. """
+
+        gx, gy = np.meshgrid(self.x, self.y)
+        nodes = np.column_stack([gx.ravel(), gy.ravel()])
+
+        triangulation = Delaunay(self.xy)
+        simplex = triangulation.find_simplex(nodes)
+        inside = simplex >= 0
+
+        transform = triangulation.transform[simplex[inside]]
+        barycentric = np.einsum("ijk,ik->ij", transform[:, :2], nodes[inside] - transform[:, 2])
+        vertices = triangulation.simplices[simplex[inside]]
+        weights = np.column_stack([barycentric, 1 - barycentric.sum(axis=1)])
+
+        return inside, vertices, weights
+
+    def get_grid(self):
+        """ Returns the coordinates of the grid nodes (X, Y) as 2D arrays of shape (ny, nx). """
+        return np.meshgrid(self.x, self.y)
+
+    def resample(self, values):
+        """
+        Interpolates values of the points onto the grid.
+
+        Params:
+        -------
+        - values: np.ndarray of shape (n,) or (n, k) (same order as xy)
+
+        Returns:
+        --------
+        np.ndarray of shape (ny, nx) or (ny, nx, k), nan outside the convex hull of the points (or if a vertex is nan).
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+        grid = self.matrix @ values.reshape(len(values), -1)
+        grid[~self.inside] = np.nan
+
+        return grid.reshape(self.shape + values.shape[1:])
+
+    def resample_variable(self, df, variable_name : str, cell_IDs, timesteps=None):
+        """
+        Interpolates the variable of a simulation onto the grid for all the timesteps at once.
+
+        Params:
+        -------
+        - df: pd.DataFrame | Scenario (long format data)
+        - variable_name: str
+        - cell_IDs: cell_IDs of the points (same order as xy)
+        - timesteps: defaults to all the timesteps of df
+
+        Returns:
+        --------
+        np.ndarray of shape (timesteps, ny, nx).
+        """
+
+        values = cell_time_array(df, variable_name, cell_IDs, timesteps)
+
+        return np.moveaxis(self.resample(values), -1, 0)
+
+    def difference(self, simulation, baseline, variable_name : str, cell_IDs, timesteps=None):
+        """ Grids of the difference of the variable (simulation - baseline) for the timesteps, shape (timesteps, ny, nx). """
+
+        if timesteps is None:
+            timesteps = np.unique(baseline["Time"].values)
+
+        return (self.resample_variable(simulation, variable_name, cell_IDs, timesteps)
+                - self.resample_variable(baseline, variable_name, cell_IDs, timesteps))
+
+    def smooth(self, grid, sigma : float):
+        """
+        Gaussian smoothing of a grid (or a stack of grids, shape (..., ny, nx)) ignoring nans.
+
+        Params:
+        -------
+        - sigma: standard deviation of the gaussian kernel (m)
+        """
+
+        from scipy.ndimage import gaussian_filter
+
+        sigma = [0] * (grid.ndim - 2) + [sigma / self.spacing] * 2
+        valid = ~np.isnan(grid)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            smoothed = gaussian_filter(np.where(valid, grid, 0), sigma) / gaussian_filter(valid.astype(np.float64), sigma)
+        smoothed[~valid] = np.nan
+
+        return smoothed
+
+    def export(self, path, grid, nodata : float = -9999):
+        """
+        Saves a grid (ny, nx) as ESRI ASCII grid (.asc, opens in GIS software) or as numpy array (.npy, any grid shape).
+        """
+
+        if str(path).endswith(".npy"):
+            np.save(path, grid)
+            return
+
+        header = (f"ncols {self.shape[1]}\nnrows {self.shape[0]}\nxllcenter {self.x[0]}\nyllcenter {self.y[0]}\n"
+                  f"cellsize {self.spacing}\nNODATA_value {nodata}\n")
+        with open(path, "w") as f:
+            f.write(header)
+            np.savetxt(f, np.where(np.isnan(grid), nodata, grid)[::-1], fmt="%.4f")  # first row is the north
+
+
+class WindField():
+    """
+    Wind field of the air points resampled onto a regular grid (one arrow per grid node instead of one per air point)
+    and streamlines traced for all the seeds at once.
+
+    Attributes
+    ----------
+    gdf : gpd.GeoDataFrame
+        Air points (e.g. the near ground subset used in AirPoints.plot_windflow()).
+    df : pd.DataFrame | Scenario
+        Air data with the columns WindX, WindY and WindSpeed.
+    spacing : float
+        Distance of the arrows (m).
+    """
+
+    def __init__(self, gdf : gpd.GeoDataFrame, df : pd.DataFrame, spacing : float = 10) -> None:
+        self.gdf = gdf
+        self.df = df
+        self.spacing = spacing
+        self.resampler = None
+
+    def set_spacing(self, spacing : float):
+        self.spacing = spacing
+        self.resampler = None
+
+    def get_resampler(self):
+        """ Grid resampler of the air points (weights computed once for the spacing). """
+        if self.resampler is None:
+            self.resampler = GridResampler(np.column_stack([self.gdf.geometry.x, self.gdf.geometry.y]), self.spacing)
+        return self.resampler
+
+    def vectors(self, time):
+        """
+        Wind on the grid at the timestep.
+
+        Returns:
+        --------
+        tuple (X, Y, U, V, speed) of 2D arrays (ny, nx), U and V are WindX and WindY, nan outside of the air points.
+        """
+
+        cell_IDs = self.gdf["cell_ID"].values
+        values = np.column_stack([cell_time_array(self.df, name, cell_IDs, [time])[:, 0] for name in ["WindX", "WindY", "WindSpeed"]])
+        grid = self.get_resampler().resample(values)
+        X, Y = self.get_resampler().get_grid()
+
+        return X, Y, grid[..., 0], grid[..., 1], grid[..., 2]
+
+    def _velocity(self, points, u, v):
+        """ Bilinear interpolation of the grid velocities at the points (nan outside of the grid). """
+
+        resampler = self.get_resampler()
+        fx = (points[:, 0] - resampler.x[0]) / self.spacing
+        fy = (points[:, 1] - resampler.y[0]) / self.spacing
+        outside = (fx < 0) | (fy < 0) | (fx > len(resampler.x) - 1) | (fy > len(resampler.y) - 1) | np.isnan(fx)
+
+        ix = np.clip(np.floor(np.nan_to_num(fx)).astype(int), 0, len(resampler.x) - 2)
+        iy = np.clip(np.floor(np.nan_to_num(fy)).astype(int), 0, len(resampler.y) - 2)
+        tx, ty = (fx - ix)[:, None], (fy - iy)[:, None]
+
+        field = np.stack([u, v], axis=-1)
+        velocity = (field[iy, ix] * (1 - tx) * (1 - ty) + field[iy, ix + 1] * tx * (1 - ty)
+                    + field[iy + 1, ix] * (1 - tx) * ty + field[iy + 1, ix + 1] * tx * ty)
+        velocity[outside] = np.nan
+
+        return velocity
+
+    def streamlines(self, time, seeds=None, n_steps : int = 100, step : float = None, method : str = "rk4"):
+        """
+        Traces streamlines from all the seeds at once (Runge-Kutta 2 or 4 over the gridded wind field).
+
+        Params:
+        -------
+        - time: timestep
+        - seeds: np.ndarray of shape (n, 2), defaults to every 4th grid node
+        - n_steps: int, number of integration steps
+        - step: float, integration time step (s), defaults to half a grid cell at the highest wind speed
+        - method: str, "rk2" (midpoint) or "rk4"
+
+        Returns:
+        --------
+        np.ndarray of shape (n_steps + 1, n, 2), positions of the seeds after each step (nan after a streamline leaves the wind field).
+        """
+
+        X, Y, u, v, speed = self.vectors(time)
+        u, v = u * speed, v * speed  # WindX, WindY are directions
+
+        if seeds is None:
+            seeds = np.column_stack([X[::4, ::4].ravel(), Y[::4, ::4].ravel()])
+            seeds = seeds[~np.isnan(speed[::4, ::4].ravel())]
+        if step is None:
+            step = 0.5 * self.spacing / max(np.nanmax(np.hypot(u, v)), 1e-6)
+
+        paths = np.full((n_steps + 1, len(seeds), 2), np.nan)
+        paths[0] = seeds
+        points = np.asarray(seeds, dtype=np.float64)
+        for i in range(n_steps):
+            k1 = self._velocity(points, u, v)
+            if method == "rk2":
+                points = points + step * self._velocity(points + 0.5 * step * k1, u, v)
+            elif method == "rk4":
+                k2 = self._velocity(points + 0.5 * step * k1, u, v)
+                k3 = self._velocity(points + 0.5 * step * k2, u, v)
+                k4 = self._velocity(points + step * k3, u, v)
+                points = points + step / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+            else:
+                raise ValueError(f"Unknown method {method}, use 'rk2' or 'rk4'.")
+            paths[i + 1] = points  # nan once a streamline left the field (nan propagates)
+
+        return paths
@@ -0,0 +1,532 @@
+"""
+Batch job runner: runs the exports of a whole report from one declarative job spec (JSON or YAML) with one data load.
+
+The inputs are read once into a session, the derived products (scenarios, surface classification, triangulation of the
+surface points, cells and weights of the areas of interest) are computed once in dependency order, and the exports run
+in parallel worker processes which share the session (forked after it was prepared).
+
+    python jobs.py nightly.json --workers 4
+
+Example job spec:
+
+    {
+        "inputs": {"folder": "paraviewplus/shp", "date": "2021_07_15"},
+        "output_folder": "paraviewplus/figs",
+        "aois": {"A": [[25496100, 6672050], [25496115, 6672000], [25496215, 6672070], [25496100, 6672050]],
+                 "P": [25496200, 6671900]},
+        "scenarios": {"+2 °C": {"delta": {"Tair": 2}, "recalculate_utci": true}},
+        "exports": [
+            {"type": "ComparisonMap", "simulations": ["+2 °C"], "settings": {"variable": "Tair", "mode": "difference"}},
+            {"type": "Frequency", "variable": "Tair", "aois": ["A", "P"], "settings": {"threshold": 26}},
+            {"type": "UTCICategory", "categories": ["moderate"], "method": "export_all_categories"}
+        ]
+    }
+
+With "start" and/or "end" in the inputs (e.g. "2021-07-15 12:00"), the data of that time range is read from the per-day
+files of the folder (see SimulationCatalog in inputs.py) instead of the files of one date. Scenarios simulated separately
+are then given by their folder ({"folder": "variant/paraviewplus/shp"}), which is read for the same range.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+import matplotlib.tri as tri
+from shapely import LineString, Point, Polygon
+
+from graphmaker import (AOIsOnMap, TimeSeriesDemonstration, SimulationResults, UTCICategory, SimulationComparison,
+                        Windrose, Slice, Frequency, ComparisonMap)
+from inputs import SurfacePoints, SurfaceMesh, Scenario, SimulationCatalog
+from utci import recalculate_utci
+from profiling import span
+from manifest import manifest
+from pipeline import pipeline
+
+import matplotlib.pyplot as plt
+
+try:
+    import yaml
+except ImportError:  # YAML job specs need PyYAML, JSON specs work without it
+    yaml = None
+
+
+def load_spec(path):
+    """
+    Reads a job spec.
+
+    Params:
+    -------
+    - path: str, .json or .yaml/.yml file
+
+    Returns:
+    --------
+    dict
+    """
+
+    path = Path(path)
+    if path.suffix.lower() in (".yaml", ".yml"):
+        if yaml is None:
+            raise ImportError("YAML job specs need PyYAML (pip install pyyaml), JSON specs work without it.")
+        return yaml.safe_load(path.read_text())
+
+    return json.loads(path.read_text())
+
+
+class Session:
+    """
+    Inputs and derived products shared by all the exports of a job. Every product is computed once, after the products
+    it depends on (see PRODUCTS); independent products are computed in parallel by prepare().
+
+    Attributes
+    ----------
+    spec : dict
+        Job spec (inputs, aois and scenarios are used).
+    products : dict
+        Computed products by name.
+    """
+
+    # product: products it depends on
+    PRODUCTS = {
+        "surfpoints": [],
+        "airpoints": [],
+        "surfmesh": [],
+        "surfdata": [],
+        "airdata": [],
+        "aois": [],
+        "scenarios": ["surfdata"],
+        "surface_classes": ["surfmesh", "surfdata"],
+        "triangulation": ["surfpoints"],
+        "aoi_index": ["surfpoints", "surfdata", "aois"],
+    }
+
+    # Ferda file names of the inputs
+    FILES = {
+        "surfpoints": "surface_point_SHP.shp",
+        "airpoints": "air_point_SHP.shp",
+        "surfmesh": "surface_triangle_SHP.shp",
+        "surfdata": "surface_data_{date}.csv",
+        "airdata": "air_data_{date}.csv",
+    }
+
+    def __init__(self, spec : dict) -> None:
+        self.spec = spec
+        self.products = {}
+        self.base_date = None  # Time 0 of the data read from several days (see SimulationCatalog)
+        self._locks = {name: threading.Lock() for name in self.PRODUCTS}
+
+    def get(self, name):
+        """ Returns the product, computed (after its dependencies) on the first request. """
+
+        if name not in self.products:
+            with self._locks[name]:
+                if name not in self.products:
+                    for dependency in self.PRODUCTS[name]:
+                        self.get(dependency)
+                    with span(f"product {name}"):
+                        self.products[name] = getattr(self, f"_build_{name}")()
+
+        return self.products[name]
+
+    def requirements(self, names):
+        """ The products and all the products they depend on, dependencies first. """
+
+        order = []
+
+        def visit(name):
+            if name in order:
+                return
+            for dependency in self.PRODUCTS[name]:
+                visit(dependency)
+            order.append(name)
+
+        for name in names:
+            visit(name)
+
+        return order
+
+    def prepare(self, names, workers : int = 4):
+        """ Computes the products and their dependencies, the independent ones (e.g. reading the inputs) in parallel. """
+
+        with ThreadPoolExecutor(max(workers, 1)) as pool:
+            list(pool.map(self.get, self.requirements(names)))
+
+    def _path(self, name):
+        inputs = self.spec.get("inputs", {})
+        if name in inputs:
+            return Path(inputs[name])
+        folder = Path(inputs.get("folder", "paraviewplus/shp"))
+        return folder / self.FILES[name].format(date=inputs.get("date", "2021_07_15"))
+
+    def _build_surfpoints(self):
+        return gpd.read_file(self._path("surfpoints"))
+
+    def _build_airpoints(self):
+        return gpd.read_file(self._path("airpoints"))
+
+    def _build_surfmesh(self):
+        return gpd.read_file(self._path("surfmesh"))
+
+    def _catalog(self, dataset, folder=None):
+        """
+        SimulationCatalog of the per-day files (of the inputs folder or another folder) if the inputs select a time range
+        ("start" and/or "end"), else None.
+        """
+
+        inputs = self.spec.get("inputs", {})
+        if "start" not in inputs and "end" not in inputs:
+            return None
+        return SimulationCatalog(folder or inputs.get("folder", "paraviewplus/shp"), dataset, workers=inputs.get("workers", 4))
+
+    def _build_surfdata(self):
+        catalog = self._catalog("surface")
+        if catalog is not None:
+            self.base_date = catalog.base_date
+            return catalog.load(self.spec["inputs"].get("start"), self.spec["inputs"].get("end"))
+        return pd.read_csv(self._path("surfdata"))
+
+    def _build_airdata(self):
+        catalog = self._catalog("air")
+        if catalog is not None:
+            return catalog.load(self.spec["inputs"].get("start"), self.spec["inputs"].get("end"))
+        return pd.read_csv(self._path("airdata"))
+
+    def _build_aois(self):
+        """ Areas of interest by name: coordinates of a polygon or a point, or a vector file (names from its name column). """
+
+        aois = self.spec.get("aois", {})
+        if isinstance(aois, str):
+            gdf = gpd.read_file(aois)
+            names = gdf["name"].astype(str) if "name" in gdf.columns else [str(i + 1) for i in range(len(gdf))]
+            return dict(zip(names, gdf.geometry))
+
+        return {name: Point(coords) if np.ndim(coords) == 1 else Polygon(coords) for name, coords in aois.items()}
+
+    def _build_scenarios(self):
+        """
+        Simulations compared with the surface data by name: a data file ({"file": "surface_data_variant.csv"}), the
+        folder of the data files of a variant ({"folder": "variant/paraviewplus/shp"}, read for the date or the time range
+        of the inputs) or a Scenario of the surface data ({"delta": {"Tair": 2}, "set": {"WindSpeed": 1},
+        "recalculate_utci": true}).
+        """
+
+        surfdata = self.get("surfdata")
+        inputs = self.spec.get("inputs", {})
+        scenarios = {}
+        for name, settings in self.spec.get("scenarios", {}).items():
+            if "folder" in settings:
+                catalog = self._catalog("surface", settings["folder"])
+                if catalog is None:
+                    scenarios[name] = pd.read_csv(Path(settings["folder"]) / self.FILES["surfdata"].format(date=inputs.get("date", "2021_07_15")))
+                    continue
+                data = catalog.load(inputs.get("start"), inputs.get("end"))
+                # on the time axis of the surface data (the variant may start on another day)
+                data["Time"] += (catalog.base_date - self.base_date) // pd.Timedelta(hours=1)
+                scenarios[name] = data
+                continue
+            if "file" in settings:
+                if self._catalog("surface") is not None:
+                    raise ValueError(f"Scenario {name}: a single data file does not match the time range of the inputs, "
+                                     "give the folder of its per-day files instead ({\"folder\": ...}).")
+                scenarios[name] = pd.read_csv(settings["file"])
+                continue
+
+            scenario = Scenario(surfdata, name)
+            deltas = settings.get("delta", {})
+            for variable_name, delta in deltas.items():
+                scenario.add_delta(variable_name, delta)
+            for variable_name, value in settings.get("set", {}).items():
+                scenario.set_variable(variable_name, value)
+            if settings.get("recalculate_utci", False):
+                # UTCI is not linear in its inputs, so it is recalculated from the changes of the scenario (deltas and set values)
+                changes = {variable_name: scenario.get_variable(variable_name) - surfdata[variable_name].values
+                           if variable_name in scenario.overrides or variable_name in scenario.deltas else 0
+                           for variable_name in ["Tair", "RelatHumid", "WindSpeed"]}
+                scenario.set_variable("UTCI", recalculate_utci(surfdata, tair=changes["Tair"], relat_humid=changes["RelatHumid"],
+                                                               wind_speed=changes["WindSpeed"]))
+            scenarios[name] = scenario
+
+        return scenarios
+
+    def _build_surface_classes(self):
+        # fills the in-process cache of SurfaceMesh, so the exports do not classify or read the classes again
+        return SurfaceMesh(self.get("surfmesh"), self.get("surfdata"))._classify_surfaces()
+
+    def _build_triangulation(self):
+        surfpoints = self.get("surfpoints")
+        return tri.Triangulation(surfpoints.geometry.x.values, surfpoints.geometry.y.values)
+
+    def _build_aoi_index(self):
+        """ Cells and weights of every area of interest in the surface points (SurfacePoints.aoi_weights). """
+
+        points = SurfacePoints(self.get("surfpoints"), self.get("surfdata"))
+        for aoi in self.get("aois").values():
+            points._get_aoi_weights(aoi)
+
+        return points.aoi_weights
+
+
+# export type: products it needs and the constructor
+EXPORTS = {
+    "AOIsOnMap": (["surfpoints", "surfdata", "surfmesh"],
+                  lambda s, job: AOIsOnMap(s.get("surfpoints"), s.get("surfdata"), s.get("surfmesh"))),
+    "ComparisonMap": (["surfpoints", "surfdata", "scenarios", "surface_classes", "triangulation"],
+                      lambda s, job: ComparisonMap(s.get("surfpoints"), s.get("surfdata"), base_date=job.get("base_date", s.base_date))),
+    "Frequency": (["surfpoints", "surfdata", "surfmesh", "surface_classes"],
+                  lambda s, job: Frequency(s.get("surfpoints"), s.get("surfdata"), job["variable"], s.get("surfmesh"))),
+    "SimulationComparison": (["surfpoints", "surfdata", "scenarios", "aoi_index"],
+                             lambda s, job: SimulationComparison(s.get("surfpoints"), s.get("surfdata"))),
+    "SimulationResults": (["surfpoints", "surfdata", "aoi_index"],
+                          lambda s, job: SimulationResults(s.get("surfpoints"), s.get("surfdata"), job["variable"])),
+    "Slice": (["airpoints", "airdata"],
+              lambda s, job: Slice(s.get("airpoints"), s.get("airdata"), LineString(job["line"]), job["variable"])),
+    "TimeSeriesDemonstration": (["surfpoints", "surfdata", "airpoints", "airdata", "surfmesh", "surface_classes"],
+                                lambda s, job: TimeSeriesDemonstration(s.get("surfpoints"), s.get("surfdata"), s.get("airpoints"), s.get("airdata"),
+                                                                       s.get("surfmesh"), base_date=job.get("base_date", s.base_date or "15.7.2021"))),
+    "UTCICategory": (["surfpoints", "surfdata", "surfmesh", "surface_classes", "triangulation"],
+                     lambda s, job: UTCICategory(s.get("surfpoints"), s.get("surfdata"), s.get("surfmesh"))),
+    "Windrose": (["airpoints", "airdata"],
+                 lambda s, job: Windrose(s.get("airpoints"), s.get("airdata"))),
+}
+
+
+# job of the running batch, inherited by the forked worker processes
+_ACTIVE = None
+
+
+def _run_export(index):
+    return _ACTIVE.run_export(index)
+
+
+class BatchJob:
+    """
+    Runs the exports of a job spec on one shared session.
+
+    Every export of the spec is a dict with:
+    - type: class name (see EXPORTS)
+    - name: name in the report (defaults to <type>_<position>)
+    - variable, line, base_date: constructor arguments of the classes which need them
+    - aois, simulations: names of the areas of interest and scenarios to add
+    - variables, categories: values for add_variable() and add_category()
+    - settings: {"threshold": 26} calls set_threshold(26) etc.
+    - output_folder: defaults to the output_folder of the spec
+    - method, args: export method and its keyword arguments (defaults to export())
+
+    With "incremental": true (or a manifest path) in the spec, only the figures whose inputs changed are rendered again
+    (see manifest.py). "pipeline": {"workers": 2, "compress_level": 1, "format": "png"} writes the figures in background
+    threads (see pipeline.py).
+
+    Attributes
+    ----------
+    spec : dict
+        Job spec (see load_spec()).
+    session : Session
+        Inputs and derived products shared by the exports.
+    """
+
+    def __init__(self, spec : dict | str) -> None:
+        self.spec = spec if isinstance(spec, dict) else load_spec(spec)
+        self.session = Session(self.spec)
+        self.workers = self.spec.get("workers", os.cpu_count() or 1)
+        self.output_folder = self.spec.get("output_folder", "paraviewplus/figs")
+        self.incremental = self.spec.get("incremental", False)
+        self.pipeline = self.spec.get("pipeline", None)
+        self.dry_run = False
+        self.results = []
+
+        self.exports = []
+        for i, job in enumerate(self.spec.get("exports", [])):
+            if job.get("type") not in EXPORTS:
+                raise ValueError(f"Unknown export type {job.get('type')}, available: {', '.join(EXPORTS)}")
+            self.exports.append({"name": f"{job['type']}_{i + 1}", **job})
+
+    def set_workers(self, workers : int):
+        """ Number of export processes (1 runs the exports one by one in this process). """
+        self.workers = workers
+
+    def set_output_folder(self, output_folder):
+        """ Default output folder of the exports. """
+        self.output_folder = output_folder
+
+    def set_incremental(self, incremental : bool | str = True, dry_run : bool = False):
+        """
+        Skips the figures whose inputs did not change (see manifest.py).
+
+        Params:
+        -------
+        - incremental: bool or str (path of the manifest, defaults to paraviewplus/cache/export_manifest.json)
+        - dry_run: bool, only lists the figures which would be rebuilt
+        """
+        self.incremental = incremental or dry_run
+        self.dry_run = dry_run
+
+    def set_pipeline(self, settings : dict = None):
+        """
+        Writes the figures in background threads while the next ones are rendered (see pipeline.py).
+
+        Params:
+        -------
+        - settings: dict, arguments of pipeline.enable() (workers, max_pending, compress_level, format), None turns
+          the pipeline off
+        """
+        self.pipeline = settings
+
+    def select(self, names):
+        """ Keeps only the exports with these names. """
+        self.exports = [job for job in self.exports if job["name"] in names]
+
+    def products(self):
+        """ Products needed by the exports. """
+        return sorted({product for job in self.exports for product in EXPORTS[job["type"]][0]})
+
+    def _create(self, job):
+        """ Instance of the export class configured from the job. """
+
+        session = self.session
+        instance = EXPORTS[job["type"]][1](session, job)
+
+        # shared products instead of computing them per instance
+        if isinstance(instance, SurfacePoints) and instance.gdf is session.products.get("surfpoints"):
+            if hasattr(instance, "triang") and "triangulation" in session.products:
+                instance.triang = session.products["triangulation"]
+            if instance.weighting_mesh is None and "aoi_index" in session.products:
+                instance.aoi_weights = session.products["aoi_index"]
+
+        aois = session.get("aois") if "aois" in job else {}
+        for name in job.get("aois", []):
+            (instance.add_area_of_interest if hasattr(instance, "add_area_of_interest") else instance.add_aoi)(aois[name])
+        scenarios = session.get("scenarios") if "simulations" in job else {}
+        for name in job.get("simulations", []):
+            instance.add_simulation(scenarios[name])
+        for variable_name in job.get("variables", []):
+            instance.add_variable(variable_name)
+        for category in job.get("categories", []):
+            instance.add_category(category)
+        for setting, value in job.get("settings", {}).items():
+            getattr(instance, f"set_{setting}")(value)
+
+        output_folder = Path(job.get("output_folder", self.output_folder))
+        output_folder.mkdir(parents=True, exist_ok=True)
+        instance.set_output_folder(str(output_folder))
+
+        return instance
+
+    def run_export(self, index):
+        """
+        Runs one export.
+
+        Returns:
+        --------
+        dict with the name, type, runtime (s) and error (None if the export finished).
+        """
+
+        job = self.exports[index]
+        error = None
+        manifest.reset_run()
+        start = time.perf_counter()
+        try:
+            instance = self._create(job)
+            getattr(instance, job.get("method", "export"))(**job.get("args", {}))
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+        plt.close("all")
+
+        result = {"name": job["name"], "type": job["type"], "runtime": time.perf_counter() - start, "error": error}
+        if manifest.enabled:
+            result.update({"rebuilt": list(manifest.pending), "up_to_date": len(manifest.skipped)})
+
+        return result
+
+    def run(self):
+        """
+        Loads the inputs, computes the products and runs the exports (in parallel with more than one worker where
+        processes can be forked). Saves the report to <output_folder>/job_report.json.
+
+        Returns:
+        --------
+        list of dicts (see run_export()).
+        """
+
+        global _ACTIVE
+
+        plt.switch_backend("Agg")  # batch exports do not open windows
+        start = time.perf_counter()
+
+        if self.incremental:
+            manifest.enable(**({"path": self.incremental} if isinstance(self.incremental, str) else {}), dry_run=self.dry_run)
+        if self.pipeline:
+            pipeline.enable(**(self.pipeline if isinstance(self.pipeline, dict) else {}))
+
+        self.session.prepare(self.products(), self.workers)
+        prepared = time.perf_counter() - start
+        print(f"{'session':<40} {prepared:8.2f} s  {', '.join(self.session.products)}")
+
+        results = [None] * len(self.exports)
+        if self.workers > 1 and len(self.exports) > 1 and "fork" in multiprocessing.get_all_start_methods():
+            _ACTIVE = self
+            try:
+                context = multiprocessing.get_context("fork")
+                with ProcessPoolExecutor(min(self.workers, len(self.exports)), mp_context=context) as pool:
+                    futures = {pool.submit(_run_export, i): i for i in range(len(self.exports))}
+                    for future in as_completed(futures):
+                        results[futures[future]] = self._report(future.result())
+            finally:
+                _ACTIVE = None
+        else:
+            for i in range(len(self.exports)):
+                results[i] = self._report(self.run_export(i))
+
+        self.results = results
+        total = time.perf_counter() - start
+        failed = sum(result["error"] is not None for result in results)
+        print(f"{len(results)} exports in {total:.2f} s, {failed} failed")
+
+        report = {"session": prepared, "total": total, "workers": self.workers, "exports": results}
+        Path(self.output_folder).mkdir(parents=True, exist_ok=True)
+        (Path(self.output_folder) / "job_report.json").write_text(json.dumps(report, indent=2))
+
+        return results
+
+    def _report(self, result):
+        status = result["error"] if result["error"] else "ok"
+        if "rebuilt" in result:
+            status += f", {'would rebuild' if self.dry_run else 'rebuilt'} {len(result['rebuilt'])}, up to date {result['up_to_date']}"
+        print(f"{result['name']:<40} {result['runtime']:8.2f} s  {status}")
+        if self.dry_run:
+            for name in result["rebuilt"]:
+                print(f"  {name}")
+        return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the exports of a job spec (JSON or YAML) with one data load.")
+    parser.add_argument("spec", help="job spec (.json, .yaml or .yml)")
+    parser.add_argument("--workers", type=int, default=None, help="export processes (default: workers of the spec or all cores)")
+    parser.add_argument("--only", nargs="+", default=None, help="run only the exports with these names")
+    parser.add_argument("--incremental", action="store_true", help="render only the figures whose inputs changed")
+    parser.add_argument("--dry-run", action="store_true", help="list the figures which would be rebuilt, render nothing")
+    parser.add_argument("--writers", type=int, default=0, help="write the figures in this many background threads per export process")
+    args = parser.parse_args()
+
+    job = BatchJob(args.spec)
+    if args.workers is not None:
+        job.set_workers(args.workers)
+    if args.only is not None:
+        job.select(args.only)
+    if args.incremental or args.dry_run:
+        job.set_incremental(job.incremental or True, args.dry_run)
+    if args.writers > 0:
+        job.set_pipeline({**(job.pipeline if isinstance(job.pipeline, dict) else {}), "workers": args.writers})
+
+    results = job.run()
+    sys.exit(1 if any(result["error"] is not None for result in results) else 0)
@@ -8,7 +8,8 @@ from pathlib import Path
 plt.rcParams.update({'font.family': 'DejaVu Sans'})
 
 from graphmaker import SimulationResults, TimeSeriesDemonstration, UTCICategory, SimulationComparison, AOIsOnMap, Windrose, Slice, Frequency, ComparisonMap
-from inputs import VariableChars
+from inputs import VariableChars, Scenario
+from utci import recalculate_utci
 
 import customtkinter as ctk
 
@@ -23,15 +24,16 @@ def main():
     surfdata = pd.read_csv("paraviewplus/shp/surface_data_2021_07_15.csv")
     airdata = pd.read_csv("paraviewplus/shp/air_data_2021_07_15.csv")
 
-    surfdata2 = surfdata.copy()
-    surfdata2["Tair"] = [x + 2 for x in surfdata["Tair"].values]
-    surfdata2["UTCI"] = [x + 2 for x in surfdata["UTCI"].values]
+    # scenarios store only the changed variables, the rest is shared with surfdata
+    surfdata2 = Scenario(surfdata, "+2 °C")
+    surfdata2.add_delta("Tair", 2)
+    surfdata2.set_variable("UTCI", recalculate_utci(surfdata, tair=2))  # UTCI is not linear in Tair, so it is recalculated
 
-    surfdata3 = surfdata.copy()
-    surfdata3["Tair"] = [x + 4 for x in surfdata["Tair"].values]
+    surfdata3 = Scenario(surfdata, "+4 °C")
+    surfdata3.add_delta("Tair", 4)
 
-    surfdata4 = surfdata.copy()
-    surfdata4["Tair"] = [x + 6 for x in surfdata["Tair"].values]
+    surfdata4 = Scenario(surfdata, "+6 °C")
+    surfdata4.add_delta("Tair", 6)
 
     aoi1 = Polygon(((25496100, 6672050), (25496115, 6672000), (25496215, 6672070), (25496190, 6672100), (25496100, 6672050)))
     aoi2 = Polygon(((25496200, 6672050), (25496215, 6672000), (25496315, 6672070), (25496290, 6672100), (25496200, 6672050)))
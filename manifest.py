@@ -0,0 +1,212 @@
+"""
+Incremental export: a manifest which records for every exported figure a fingerprint of its input data slices and
+render parameters. While it is enabled, the exports skip the figures whose fingerprint did not change since they were
+written, and a dry run only lists the figures which would be rebuilt.
+
+    from manifest import manifest
+    manifest.enable()                # paraviewplus/cache/export_manifest.json
+    cm.export()                      # renders only the changed timesteps
+    manifest.enable(dry_run=True)
+    cm.export()
+    print(manifest.report())         # figures which would be rebuilt
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+import shapely
+from matplotlib.colors import Colormap
+
+from inputs import Scenario
+
+try:
+    import fcntl
+except ImportError:  # no file locking (windows): parallel exports may lose manifest entries, which are then re-rendered
+    fcntl = None
+
+
+def _update(h, obj):
+    """ Feeds obj into the hash h (data by value, so equal data gives the same fingerprint in every run). """
+
+    if obj is None or isinstance(obj, (str, int, float, bool, np.generic)):
+        h.update(f"{type(obj).__name__}:{obj!r};".encode())
+    elif isinstance(obj, (bytes, bytearray)):
+        h.update(obj)
+    elif isinstance(obj, np.ndarray):
+        if obj.dtype == object:
+            _update(h, obj.tolist())
+        else:
+            h.update(f"{obj.dtype}{obj.shape};".encode())
+            h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, gpd.GeoSeries):
+        _update(h, shapely.to_wkb(obj.values))
+    elif isinstance(obj, gpd.GeoDataFrame):
+        _update(h, obj.geometry)
+        _update(h, pd.DataFrame(obj.drop(columns=obj.geometry.name)))
+    elif isinstance(obj, (pd.DataFrame, pd.Series)):
+        _update(h, list(obj.columns) if isinstance(obj, pd.DataFrame) else obj.name)
+        if obj.shape[-1 if isinstance(obj, pd.DataFrame) else 0] == 0:
+            return  # pandas cannot hash a frame without columns
+        h.update(pd.util.hash_pandas_object(obj, index=False).values.tobytes())
+    elif isinstance(obj, shapely.Geometry):
+        h.update(obj.wkb)
+    elif isinstance(obj, Scenario):
+        _update(h, [obj.name, obj.baseline, obj.overrides, obj.deltas])
+    elif isinstance(obj, Colormap):
+        _update(h, [obj.name, getattr(obj, "colors", None)])
+    elif isinstance(obj, dict):
+        for key in sorted(obj, key=str):
+            _update(h, [key, obj[key]])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f"[{len(obj)};".encode())
+        for item in obj:
+            _update(h, item)
+    else:
+        h.update(repr(obj).encode())
+
+
+def fingerprint(*parts):
+    """
+    Fingerprint of the inputs of a figure.
+
+    Params:
+    -------
+    - parts: render parameters (str, numbers, lists, dicts, colormaps) and data (np.ndarray, pd.DataFrame, gpd.GeoDataFrame,
+      Scenario, shapely geometries)
+
+    Returns:
+    --------
+    str (sha1 hex digest)
+    """
+
+    h = hashlib.sha1()
+    _update(h, parts)
+    return h.hexdigest()
+
+
+class ExportManifest:
+    """
+    Fingerprints of the exported figures (disabled by default, use the module level manifest instance).
+
+    Attributes
+    ----------
+    path : Path
+        JSON file of the manifest.
+    dry_run : bool
+        Nothing is rendered, the figures which would be rebuilt are listed in pending.
+    pending : list
+        Figures rebuilt (or to rebuild in a dry run) since enable() or reset_run().
+    skipped : list
+        Figures skipped since enable() or reset_run() because their inputs did not change.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.dry_run = False
+        self.path = None
+        self.entries = {}
+        self._lock = threading.Lock()
+        self.reset_run()
+
+    def enable(self, path : str = "paraviewplus/cache/export_manifest.json", dry_run : bool = False):
+        """
+        Starts skipping unchanged figures.
+
+        Params:
+        -------
+        - path: str, JSON file of the manifest (created with the first export)
+        - dry_run: bool, only list the figures which would be rebuilt
+        """
+        self.enabled = True
+        self.dry_run = dry_run
+        self.path = Path(path)
+        self.entries = self._read()
+        self.reset_run()
+
+    def disable(self):
+        """ Exports render every figure again. """
+        self.enabled = False
+        self.dry_run = False
+
+    def reset_run(self):
+        """ Clears the lists of rebuilt and skipped figures. """
+        self.pending = []
+        self.skipped = []
+
+    def clear(self):
+        """ Forgets all the fingerprints (the next exports render every figure). """
+        self.entries = {}
+        if self.path is not None and self.path.is_file():
+            self.path.unlink()
+
+    @staticmethod
+    def _name(output):
+        return Path(os.path.normpath(output)).as_posix()
+
+    def is_current(self, output, key):
+        """
+        Checks whether a figure can be skipped.
+
+        Params:
+        -------
+        - output: path of the figure
+        - key: str, fingerprint of its inputs (see fingerprint()). The exports compute it only while the manifest is enabled
+          (hashing the data slices takes time), otherwise they pass None
+
+        Returns:
+        --------
+        True if the figure exists and was written from the same inputs, or in a dry run (the figure is then listed in
+        pending if it would be rebuilt). False if it has to be rendered (always without a manifest).
+        """
+
+        if not self.enabled:
+            return False
+
+        name = self._name(output)
+        if self.entries.get(name) == key and Path(output).is_file():
+            self.skipped.append(name)
+            return True
+
+        self.pending.append(name)
+        return self.dry_run
+
+    def record(self, output, key):
+        """ Stores the fingerprint of a written figure. """
+
+        if not self.enabled or self.dry_run:
+            return
+
+        # merge with the entries written by other processes (and writer threads, see pipeline.py) in the meantime
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.path.with_suffix(".lock"), "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = self._read()
+            entries[self._name(output)] = key
+            temporary = self.path.with_suffix(f".{os.getpid()}.tmp")
+            temporary.write_text(json.dumps(entries, indent=1))
+            os.replace(temporary, self.path)
+        self.entries = entries
+
+    def _read(self):
+        if self.path is None or not self.path.is_file():
+            return {}
+        return json.loads(self.path.read_text())
+
+    def report(self):
+        """ The rebuilt (or, in a dry run, to rebuild) and skipped figures as text. """
+
+        verb = "would rebuild" if self.dry_run else "rebuilt"
+        lines = [f"{verb} {len(self.pending)}, up to date {len(self.skipped)}"]
+        lines += [f"  {name}" for name in self.pending]
+
+        return "\n".join(lines)
+
+
+manifest = ExportManifest()
@@ -0,0 +1,206 @@
+"""
+Memory accounting and the memory budget of the export pipeline.
+
+With a budget (set_max_memory()), the data is pivoted in row chunks and stored as float32, the cells x timesteps arrays
+are processed in timestep chunks that fit into the free budget, and the peak memory of every export is recorded (see
+MemoryBudget.report()).
+"""
+
+import os
+import re
+import threading
+import tracemalloc
+import resource
+from functools import wraps
+
+import numpy as np
+
+
+_UNITS = {"": 1, "B": 1, "K": 2**10, "KB": 2**10, "M": 2**20, "MB": 2**20, "G": 2**30, "GB": 2**30}
+
+
+def parse_size(size):
+    """
+    Size in bytes.
+
+    Params:
+    -------
+    - size: int (bytes) or str with a unit, e.g. "512MB" or "4 GB"
+
+    Returns:
+    --------
+    int
+    """
+
+    if size is None or isinstance(size, (int, float)):
+        return None if size is None else int(size)
+
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMG]?B?)\s*", size.upper())
+    if match is None:
+        raise ValueError(f"Invalid memory size: {size}")
+
+    return int(float(match.group(1)) * _UNITS[match.group(2)])
+
+
+def current_rss():
+    """ Resident set size of the process (bytes), the maximum so far where /proc is not available. """
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryMonitor:
+    """
+    Context manager tracking the peak memory of a block: the resident set size sampled in a background thread and,
+    optionally, the peak of the python and numpy allocations traced with tracemalloc (exact, but slower).
+
+        with MemoryMonitor() as monitor:
+            cm.export()
+        print(monitor.peak_rss, monitor.peak_traced)
+    """
+
+    def __init__(self, interval : float = 0.05, traced : bool = False):
+        self.interval = interval
+        self.traced = traced
+        self.start_rss = None
+        self.peak_rss = None
+        self.peak_traced = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, current_rss())
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = current_rss()
+        self._started_tracing = self.traced and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        if self.traced:
+            tracemalloc.reset_peak()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, current_rss())
+        if self.traced:
+            self.peak_traced = tracemalloc.get_traced_memory()[1]
+            if self._started_tracing:
+                tracemalloc.stop()
+        return False
+
+
+class MemoryBudget:
+    """
+    Memory budget of the export pipeline (inactive by default). Use the module level budget instance:
+
+        from memory import budget
+        budget.set_max_memory("4GB")
+    """
+
+    def __init__(self):
+        self.max_memory = None
+        self.last_peak = None  # peak resident set size of the last export (bytes)
+        self.peaks = {}  # {export: highest peak resident set size} since reset_peaks()
+
+    def set_max_memory(self, max_memory):
+        """
+        Sets the memory budget of the process.
+
+        Params:
+        -------
+        - max_memory: int (bytes), str with a unit ("4GB") or None to turn the budget off
+        """
+        self.max_memory = parse_size(max_memory)
+
+    @property
+    def active(self):
+        return self.max_memory is not None
+
+    @property
+    def dtype(self):
+        """ Storage type of the pivoted values: float32 under the budget, float64 otherwise. """
+        return np.float32 if self.active else np.float64
+
+    def available(self):
+        """ Free memory of the budget (bytes), None without a budget. """
+        if not self.active:
+            return None
+        return max(self.max_memory - current_rss(), 0)
+
+    def chunk_size(self, item_bytes : int, n_items : int, share : float = 0.5, minimum : int = 1):
+        """
+        Number of items (rows, timesteps, ...) processed at once.
+
+        Params:
+        -------
+        - item_bytes: int, working memory of one item
+        - n_items: int, number of items
+        - share: float, share of the free budget used for one chunk
+        - minimum: int, smallest chunk (keeps the loops vectorized when the budget is exhausted)
+
+        Returns:
+        --------
+        int between minimum and n_items (n_items without a budget).
+        """
+
+        if not self.active or n_items == 0:
+            return max(n_items, 1)
+
+        return int(min(max(share * self.available() // max(item_bytes, 1), minimum, 1), n_items))
+
+    def chunks(self, item_bytes : int, n_items : int, share : float = 0.5, minimum : int = 1):
+        """ Slices of the items processed at once (see chunk_size()). """
+
+        size = self.chunk_size(item_bytes, n_items, share, minimum)
+        return [slice(start, min(start + size, n_items)) for start in range(0, n_items, size)]
+
+    def reset_peaks(self):
+        """ Forgets the recorded peaks of the exports. """
+        self.peaks = {}
+        self.last_peak = None
+
+    def report(self):
+        """ The peak memory of every export since reset_peaks() against the budget, as text. """
+
+        lines = []
+        for name, peak in self.peaks.items():
+            status = "within" if peak <= self.max_memory else "ABOVE"
+            lines.append(f"{name}: peak memory {peak / 2**20:.0f} MB, {status} the budget of {self.max_memory / 2**20:.0f} MB")
+
+        return "\n".join(lines)
+
+
+budget = MemoryBudget()
+
+
+def budgeted(function):
+    """
+    Decorator of the exports: under a memory budget, tracks the resident set size of the call and records the peak
+    reached (budget.last_peak and budget.peaks, see MemoryBudget.report()). Without a budget, the function is called
+    directly.
+    """
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if not budget.active:
+            return function(*args, **kwargs)
+
+        with MemoryMonitor() as monitor:
+            result = function(*args, **kwargs)
+
+        name = function.__qualname__
+        budget.last_peak = monitor.peak_rss
+        budget.peaks[name] = max(budget.peaks.get(name, 0), monitor.peak_rss)
+
+        return result
+
+    return wrapper
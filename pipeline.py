@@ -0,0 +1,215 @@
+"""
+Pipelined export: the main thread renders each figure into its RGBA buffer and hands it to a bounded pool of writer
+threads, which compress (PNG or lossless WebP) and write it while the main thread prepares and renders the next frames.
+
+    from pipeline import pipeline
+    pipeline.enable(workers=2, compress_level=1)   # or format="webp"
+    cm.export()                                     # returns after all the frames are written
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from pathlib import Path
+
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image
+
+from profiling import span, count
+
+
+def render_rgba(fig=None):
+    """
+    Renders a figure with Agg.
+
+    Params:
+    -------
+    - fig: plt.Figure (defaults to the current figure)
+
+    Returns:
+    --------
+    np.ndarray (height x width x 4, uint8), a copy which stays valid after the figure is closed or redrawn
+    """
+
+    fig = plt.gcf() if fig is None else fig
+    canvas = fig.canvas if isinstance(fig.canvas, FigureCanvasAgg) else FigureCanvasAgg(fig)
+    with span("render"):
+        canvas.draw()
+        return np.array(canvas.buffer_rgba())
+
+
+class ExportPipeline:
+    """
+    Writer pool of the exports (disabled by default, use the module level pipeline instance).
+
+    Attributes
+    ----------
+    workers : int
+        Writer threads (PNG and WebP encoding release the GIL, so they run in parallel with the rendering).
+    max_pending : int
+        Rendered frames waiting to be written at most; the rendering waits when the writers fall behind (each frame
+        holds width x height x 4 bytes).
+    compress_level : int
+        PNG compression level 0 (fastest, largest files) to 9 (slowest, smallest files).
+    format : str
+        "png" or "webp" (lossless, written with the .webp suffix).
+    """
+
+    FORMATS = ("png", "webp")
+
+    def __init__(self):
+        self.enabled = False
+        self.workers = 2
+        self.max_pending = 4
+        self.compress_level = 6
+        self.format = "png"
+        self._executor = None
+        self._slots = None
+        self._futures = []
+        self._lock = threading.Lock()
+        self._depth = 0
+
+    def enable(self, workers : int = 2, max_pending : int = 4, compress_level : int = 6, format : str = "png"):
+        """
+        Starts writing the figures in the background.
+
+        Params:
+        -------
+        - workers: int, writer threads
+        - max_pending: int, rendered frames waiting to be written at most
+        - compress_level: int, PNG compression level 0-9 (matplotlib writes with 6)
+        - format: str, "png" or "webp" (lossless)
+        """
+
+        if format not in self.FORMATS:
+            raise ValueError(f"Invalid format {format}, available: {', '.join(self.FORMATS)}")
+        if not 0 <= compress_level <= 9:
+            raise ValueError("compress_level has to be between 0 and 9")
+
+        self.flush()
+        self._shutdown()
+        self.enabled = True
+        self.workers = max(workers, 1)
+        self.max_pending = max(max_pending, 1)
+        self.compress_level = compress_level
+        self.format = format
+
+    def disable(self):
+        """ Writes the pending frames, then figures are saved with plt.savefig again. """
+        self.flush()
+        self._shutdown()
+        self.enabled = False
+
+    def output_path(self, path):
+        """ Path of the written file (the suffix changes to .webp in the WebP format). """
+        if self.enabled and self.format == "webp":
+            return str(Path(path).with_suffix(".webp"))
+        return path
+
+    def submit(self, path, on_written=None):
+        """
+        Renders the current figure and queues it for writing.
+
+        Params:
+        -------
+        - path: path of the figure (see output_path())
+        - on_written: function called with the path of the file after it was written (in a writer thread)
+
+        Returns:
+        --------
+        Path of the written file.
+        """
+
+        fig = plt.gcf()
+        path = self.output_path(path)
+        if not isinstance(fig.canvas, FigureCanvasAgg) or matplotlib.rcParams["savefig.dpi"] != "figure":
+            # figures which are not rendered by Agg at their own resolution are saved directly
+            with span("savefig"):
+                plt.savefig(path)
+            count("frames written")
+            if on_written is not None:
+                on_written(path)
+            return path
+
+        rgba, dpi = render_rgba(fig), fig.dpi
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="writer")
+            self._slots = threading.BoundedSemaphore(self.max_pending)
+
+        with span("wait for writer"):
+            self._slots.acquire()
+        future = self._executor.submit(self._write, rgba, dpi, path, on_written)
+        with self._lock:
+            self._futures.append(future)
+
+        return path
+
+    def _write(self, rgba, dpi, path, on_written):
+        try:
+            with span("encode and write"):
+                image = Image.fromarray(rgba, "RGBA")
+                if self.format == "webp":
+                    image.save(path, "WEBP", lossless=True)
+                else:
+                    image.save(path, "PNG", compress_level=self.compress_level, dpi=(dpi, dpi))
+            count("frames written")
+            if on_written is not None:
+                on_written(path)
+        finally:
+            self._slots.release()
+
+    def flush(self):
+        """ Waits until all the queued frames are written, raises the first error of the writers. """
+
+        with self._lock:
+            futures, self._futures = self._futures, []
+        errors = [future.exception() for future in futures]
+        errors = [error for error in errors if error is not None]
+        if errors:
+            raise errors[0]
+
+    def _shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _after_fork(self):
+        # the writer threads are not copied into forked processes, each process starts its own pool
+        self._executor = None
+        self._futures = []
+        self._lock = threading.Lock()
+
+
+pipeline = ExportPipeline()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=pipeline._after_fork)
+
+
+def pipelined(function):
+    """
+    Decorator of the exports: returns after all the frames of the export (and of the exports it calls) are written.
+    """
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if not pipeline.enabled:
+            return function(*args, **kwargs)
+
+        pipeline._depth += 1
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            pipeline._depth -= 1
+            if pipeline._depth == 0:
+                with span("flush writers"):
+                    pipeline.flush()
+
+        return result
+
+    return wrapper
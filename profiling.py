@@ -0,0 +1,265 @@
+"""
+Profiling of the export pipeline: spans time the load, prepare, render and save stages into a nested timing tree,
+counters record e.g. points rendered, frames written and cache hits. Disabled by default (the spans are then no-ops), use
+the module level profiler instance and its shortcuts span (context manager), timed (decorator) and count.
+
+    from profiling import profiler
+    profiler.enable(trace=True)
+    cm.export()
+    print(profiler.report())                                  # timing tree and counters
+    profiler.export_chrome_trace("paraviewplus/trace.json")   # chrome://tracing or ui.perfetto.dev
+"""
+
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import nullcontext
+from functools import wraps
+from pathlib import Path
+
+from memory import current_rss
+
+
+# shared no-op span returned while the profiler is disabled (no allocation, no clock reads)
+_NULL_SPAN = nullcontext()
+
+
+class _Node:
+    """ One node of the timing tree: the calls of a stage under the same parent stage. """
+
+    __slots__ = ("name", "calls", "total", "peak_memory", "rss", "children")
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total = 0.0
+        self.peak_memory = 0  # peak of the traced allocations above the start of the stage (bytes)
+        self.rss = 0  # maximum resident set size at the end of the stage (bytes)
+        self.children = {}
+
+    def child(self, name):
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = _Node(name)
+        return node
+
+    def to_dict(self):
+        return {"name": self.name, "calls": self.calls, "total": self.total, "peak_memory": self.peak_memory, "rss": self.rss,
+                "children": [child.to_dict() for child in self.children.values()]}
+
+
+class _Span:
+    """ Context manager timing one stage, created by Profiler.span() while the profiler is enabled. """
+
+    __slots__ = ("profiler", "name", "args", "node", "parent", "start", "start_memory", "peak")
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        stack = self.profiler._stack()
+        self.parent = stack[-1]
+        self.node = self.parent.node.child(self.name)
+        if self.profiler.memory:
+            # the peak of the parent so far is kept before the peak is reset for this stage
+            current, peak = tracemalloc.get_traced_memory()
+            self.parent.peak = max(self.parent.peak, peak)
+            tracemalloc.reset_peak()
+            self.start_memory = self.peak = current
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.profiler._stack().pop()
+        self.node.calls += 1
+        self.node.total += end - self.start
+        if self.profiler.memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            self.parent.peak = max(self.parent.peak, self.peak)
+            self.node.peak_memory = max(self.node.peak_memory, self.peak - self.start_memory)
+            self.node.rss = max(self.node.rss, current_rss())
+        if self.profiler.trace:
+            self.profiler._event(self.name, self.start, end, self.args)
+        return False
+
+
+class _Root:
+    """ Bottom of the span stack of a thread. """
+
+    __slots__ = ("node", "peak")
+
+    def __init__(self, node):
+        self.node = node
+        self.peak = 0
+
+
+class Profiler:
+    """
+    Lightweight instrumentation of the load, prepare, render and save stages.
+
+    Stages are timed with spans (context manager or decorator) that nest into a per-run timing tree; counters record
+    e.g. points rendered, frames written and cache hits. While disabled (default), span() returns a shared no-op
+    context manager and count() returns immediately, so the instrumentation can stay in the hot paths.
+
+        from profiling import profiler
+        profiler.enable(trace=True)
+        cm.export()
+        print(profiler.report())
+        profiler.export_chrome_trace("paraviewplus/trace.json")  # open in chrome://tracing or ui.perfetto.dev
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace = False
+        self.memory = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self, trace : bool = False, memory : bool = False):
+        """
+        Starts recording.
+
+        Params:
+        -------
+        - trace: bool, also record every span as Chrome trace event (memory grows with the number of spans)
+        - memory: bool, also record the peak memory of every stage (traced with tracemalloc, slows down allocations)
+          and the resident set size at its end
+        """
+        self.enabled = True
+        self.trace = trace
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def disable(self):
+        """ Stops recording, the results are kept until reset(). """
+        self.enabled = False
+        self.trace = False
+        self.memory = False
+        if getattr(self, "_started_tracing", False):
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def reset(self):
+        """ Clears the timing tree, the counters and the trace events. """
+        self.root = _Node("total")
+        self.counters = {}
+        self.events = []
+        self.t0 = time.perf_counter()
+        self._local = threading.local()
+
+    def _stack(self):
+        # each thread nests its spans under the root
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            with self._lock:
+                root = self.root.child(threading.current_thread().name) if threading.current_thread() is not threading.main_thread() else self.root
+            stack = self._local.stack = [_Root(root)]
+        return stack
+
+    def _event(self, name, start, end, args):
+        event = {"name": name, "ph": "X", "ts": 1e6 * (start - self.t0), "dur": 1e6 * (end - start),
+                 "pid": 0, "tid": threading.get_ident()}
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+
+    def span(self, name : str, **args):
+        """
+        Times a stage: with profiler.span("tricontourf"): ...
+
+        Params:
+        -------
+        - name: str, name of the stage
+        - args: extra information stored in the trace event (e.g. time=12)
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def timed(self, name : str = None):
+        """ Decorator timing every call of the function as a stage (default name: the qualified function name). """
+
+        def decorator(function):
+            stage = name or function.__qualname__
+
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _Span(self, stage, None):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def count(self, name : str, n : int = 1):
+        """ Adds n to the counter name (e.g. "points rendered", "frames written", "cache hits"). """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self, min_share : float = 0.0):
+        """
+        Timing tree and counters as text.
+
+        Params:
+        -------
+        - min_share: float, hides the stages that took less than this share of their parent stage
+
+        Returns:
+        --------
+        str
+        """
+
+        total = sum(child.total for child in self.root.children.values())
+        memory = any(node.rss > 0 for node in self.root.children.values())
+        lines = [f"{'stage':<50} {'calls':>7} {'total (s)':>10} {'share':>7}" + (f" {'peak (MB)':>10} {'rss (MB)':>9}" if memory else "")]
+
+        def walk(node, depth, parent_total):
+            for child in sorted(node.children.values(), key=lambda c: -c.total):
+                share = child.total / parent_total if parent_total > 0 else 0
+                if share < min_share:
+                    continue
+                lines.append(f"{'  ' * depth + child.name:<50} {child.calls:>7} {child.total:>10.3f} {100 * share:>6.1f}%"
+                             + (f" {child.peak_memory / 2**20:>10.1f} {child.rss / 2**20:>9.0f}" if memory else ""))
+                walk(child, depth + 1, child.total)
+
+        walk(self.root, 0, total)
+        for name, value in self.counters.items():
+            lines.append(f"{name:<50} {value:>7}")
+
+        return "\n".join(lines)
+
+    def to_dict(self):
+        """ Timing tree and counters as dict (JSON serializable). """
+        return {"tree": self.root.to_dict()["children"], "counters": dict(self.counters)}
+
+    def export(self, path):
+        """ Writes the timing tree and the counters to a JSON file. """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(self.to_dict(), indent=2))
+
+    def export_chrome_trace(self, path):
+        """ Writes the recorded spans (enable(trace=True)) and the counters as Chrome trace-event JSON. """
+        events = list(self.events)
+        end = max((event["ts"] + event["dur"] for event in events), default=0)
+        events += [{"name": name, "ph": "C", "ts": end, "pid": 0, "args": {name: value}} for name, value in self.counters.items()]
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+
+
+profiler = Profiler()
+span = profiler.span
+timed = profiler.timed
+count = profiler.count
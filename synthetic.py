@@ -0,0 +1,293 @@
+"""
+Synthetic Ferda-like datasets of configurable size (surface points, surface triangle mesh with buildings, air points
+on a voxel grid and long format data CSVs) for benchmarking without the real simulation outputs.
+
+The files have the same names and columns as the Ferda folder, so they can be used instead of paraviewplus/shp:
+
+    python synthetic.py bench/10k --cells 10000 --timesteps 24
+"""
+
+import argparse
+import json
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+import shapely
+
+from utci import utci
+
+
+CRS = "EPSG:3879"
+ORIGIN = (25496000.0, 6671700.0)
+
+
+def _ground_height(x, y):
+    """ Slightly sloped ground (the ground triangles must not be horizontal, horizontal triangles are rooftops). """
+    return 0.02 * x + 0.01 * y + 0.5 * np.sin(x / 37) * np.cos(y / 53)
+
+
+def _pattern(x, y, scale):
+    """ Smooth spatial pattern in [-1, 1]. """
+    return np.sin(x / scale + 0.3) * np.cos(y / (1.3 * scale) + 1.1)
+
+
+def _buildings(n, rng):
+    """
+    Rectangular buildings on the n x n ground cells.
+
+    Returns:
+    --------
+    np.ndarray (n, n) with the height of the building above the ground (0 for the ground).
+    """
+
+    heights = np.zeros((n, n))
+    margin = 2
+    for _ in range(max(n * n // 150, 1)):
+        width, depth = rng.integers(3, 13, size=2)
+        if n - 2 * margin - max(width, depth) <= 0:
+            continue
+        i, j = rng.integers(margin, n - margin - max(width, depth), size=2)
+        heights[i:i + width, j:j + depth] = np.maximum(heights[i:i + width, j:j + depth], rng.uniform(6, 40))
+
+    return heights
+
+
+def _walls(a_low, b_low, a_high, b_high):
+    """ Two vertical triangles for each wall segment (arrays of shape (k, 3)). """
+    return np.concatenate([np.stack([a_low, b_low, b_high], axis=1), np.stack([a_low, b_high, a_high], axis=1)])
+
+
+def generate_mesh(n_cells : int = 10_000, spacing : float = 2, seed : int = 0):
+    """
+    Generates the surface triangle mesh: a sloped ground grid with flat roofs of rectangular buildings and vertical walls.
+
+    Params:
+    -------
+    - n_cells: int, approximate number of triangles
+    - spacing: float, size of the ground grid cells (m)
+    - seed: int, random seed
+
+    Returns:
+    --------
+    tuple (triangles as np.ndarray of shape (n, 3, 3), building height above the ground for each grid cell)
+    """
+
+    rng = np.random.default_rng(seed)
+    n = max(int(np.sqrt(n_cells / 3.3)), 8)  # ~2 triangles per ground cell + walls
+    heights = _buildings(n, rng)
+
+    # vertices of the grid cells (i along x, j along y)
+    coords = np.arange(n + 1) * spacing
+    gx, gy = np.meshgrid(coords, coords, indexing="ij")
+    gz = _ground_height(gx, gy)
+
+    # roofs are flat: highest ground vertex of the cell + building height
+    cell_ground = np.maximum.reduce([gz[:-1, :-1], gz[1:, :-1], gz[:-1, 1:], gz[1:, 1:]])
+    roof = np.where(heights > 0, cell_ground + heights, np.nan)
+
+    def corner(di, dj):
+        """ Corner of all the cells, on the roof for the building cells. """
+        z = np.where(heights > 0, roof, gz[di:n + di, dj:n + dj])
+        return np.stack([gx[di:n + di, dj:n + dj], gy[di:n + di, dj:n + dj], z], axis=-1).reshape(-1, 3)
+
+    v00, v10, v11, v01 = corner(0, 0), corner(1, 0), corner(1, 1), corner(0, 1)
+    surfaces = [np.stack([v00, v10, v11], axis=1), np.stack([v00, v11, v01], axis=1)]
+
+    # walls between the cells of different height, along x (edge at i + 1) and along y (edge at j + 1)
+    top = np.where(heights > 0, roof, np.nan)
+    for axis in (0, 1):
+        first = np.take(top, np.arange(n - 1), axis=axis)
+        second = np.take(top, np.arange(1, n), axis=axis)
+        i, j = np.nonzero(np.nan_to_num(first, nan=-np.inf) != np.nan_to_num(second, nan=-np.inf))
+        if axis == 0:
+            a, b = (i + 1, j), (i + 1, j + 1)
+        else:
+            a, b = (i, j + 1), (i + 1, j + 1)
+
+        # the wall goes from the ground (or the lower roof) to the higher roof
+        z1, z2 = first[i, j], second[i, j]
+        on_ground = np.isnan(z1) | np.isnan(z2)
+        za_low = np.where(on_ground, gz[a], np.fmin(z1, z2))
+        zb_low = np.where(on_ground, gz[b], np.fmin(z1, z2))
+        z_high = np.fmax(z1, z2)
+
+        pa, pb = np.stack([gx[a], gy[a]], axis=1), np.stack([gx[b], gy[b]], axis=1)
+        surfaces.append(_walls(np.column_stack([pa, za_low]), np.column_stack([pb, zb_low]),
+                               np.column_stack([pa, z_high]), np.column_stack([pb, z_high])))
+
+    triangles = np.concatenate(surfaces)
+    triangles[..., 0] += ORIGIN[0]
+    triangles[..., 1] += ORIGIN[1]
+
+    # same order of the surface classes as in the Ferda mesh (walls, ground, rooftops), SurfaceMesh._classify_surfaces()
+    # names the classes in the order of their first appearance
+    classes = surface_classes(triangles)
+    order = np.argsort(np.select([classes == "walls", classes == "ground"], [0, 1], 2), kind="stable")
+
+    return triangles[order], heights
+
+
+def surface_classes(triangles):
+    """ Class of each triangle from its normal vector: horizontal are rooftops, vertical are walls, the rest is ground. """
+
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    nz = normals[:, 2] / np.linalg.norm(normals, axis=1)
+
+    return np.where(np.abs(nz) == 1, "rooftops", np.where(nz == 0, "walls", "ground"))
+
+
+def generate_air_points(heights, spacing : float, n_air : int = 10_000, n_levels : int = 10):
+    """
+    Air points on a voxel grid above the ground (points inside the buildings are left out).
+
+    Params:
+    -------
+    - heights: building heights of the ground cells (see generate_mesh())
+    - spacing: size of the ground grid cells (m)
+    - n_air: int, approximate number of air points
+    - n_levels: int, number of levels (heights above the ground)
+
+    Returns:
+    --------
+    np.ndarray of shape (n, 3) with the coordinates of the air points.
+    """
+
+    n = len(heights)
+    extent = n * spacing
+    air_spacing = max(extent / np.sqrt(max(n_air / n_levels, 1)), spacing / 2)
+
+    coords = np.arange(air_spacing / 2, extent, air_spacing)
+    x, y, level = (a.ravel() for a in np.meshgrid(coords, coords, np.arange(n_levels), indexing="ij"))
+    ground = _ground_height(x, y)
+    z = ground + 1 + 3 * level  # 1 m, 4 m, 7 m... above the ground
+
+    cells = np.minimum((np.column_stack([x, y]) // spacing).astype(int), n - 1)
+    inside = z < ground + heights[cells[:, 0], cells[:, 1]] + 1
+    x, y, z = x[~inside], y[~inside], z[~inside]
+
+    return np.column_stack([x + ORIGIN[0], y + ORIGIN[1], z])
+
+
+def _surface_data(points, kinds, time, rng):
+    """ Surface data of one timestep (diurnal cycle, smooth spatial patterns and noise). """
+
+    hour = (time - 1) % 24
+    day = (time - 1) // 24
+    x, y = points[:, 0] - ORIGIN[0], points[:, 1] - ORIGIN[1]
+    sun = max(np.sin(np.pi * (hour - 6) / 14), 0)  # 0 at night
+
+    tair = 18 + day * 0.3 + 7 * np.sin(np.pi * (hour - 9) / 12) + 1.5 * _pattern(x, y, 60) + 0.2 * rng.standard_normal(len(x))
+    surface_heating = np.select([kinds == "rooftops", kinds == "walls"], [12, 4], 8)
+    tsurf = tair + sun * surface_heating * (0.6 + 0.4 * _pattern(y, x, 25))
+    relat_humid = np.clip(65 - 2 * (tair - 18) + 5 * _pattern(x, y, 90), 10, 100) / 100  # fraction, like Ferda
+    wind_speed = np.clip(1.5 + _pattern(x, y, 40) + 0.3 * rng.standard_normal(len(x)), 0.5, None)
+    tmrt = tsurf + sun * 15
+    utci_values = utci(tair, tmrt, wind_speed, relat_humid)
+
+    return {"Tair": tair, "Tsurf": tsurf, "RelatHumid": relat_humid, "WindSpeed": wind_speed, "UTCI": utci_values}
+
+
+def _air_data(points, time, rng):
+    """ Air data of one timestep (wind turning slowly during the day, stronger with the height). """
+
+    hour = (time - 1) % 24
+    x, y, z = points[:, 0] - ORIGIN[0], points[:, 1] - ORIGIN[1], points[:, 2]
+    height = z - _ground_height(x, y)
+
+    direction = np.radians(200 + 40 * np.sin(np.pi * hour / 12)) + 0.4 * _pattern(x, y, 50)
+    wind_speed = np.clip((1 + 2 * np.log1p(height) / np.log(30)) * (1 + 0.3 * _pattern(y, x, 45)) + 0.2 * rng.standard_normal(len(x)), 0, None)
+    tair = 18 + 7 * np.sin(np.pi * (hour - 9) / 12) - 0.0065 * height + 1.2 * _pattern(x, y, 60)
+
+    return {"Tair": tair, "RelatHumid": np.clip(65 - 2 * (tair - 18), 10, 100) / 100, "WindSpeed": wind_speed,
+            "WindX": np.cos(direction), "WindY": np.sin(direction), "WindZ": 0.05 * rng.standard_normal(len(x))}
+
+
+def _write_data(path, points, n_timesteps, create):
+    """ Writes the long format data CSV one timestep at a time (the memory use does not grow with the number of timesteps). """
+
+    cell_IDs = np.arange(len(points))
+    for time in range(1, n_timesteps + 1):
+        data = pd.DataFrame({"cell_ID": cell_IDs, "Time": time, **create(time)})
+        data.to_csv(path, mode="w" if time == 1 else "a", header=time == 1, index=False, float_format="%.3f")
+
+
+def generate_dataset(output_folder, n_cells : int = 10_000, n_timesteps : int = 24, n_air : int = None,
+                     spacing : float = 2, date : str = "2021_07_15", seed : int = 0, n_days : int = 1):
+    """
+    Generates a consistent Ferda-like dataset: surface_triangle_SHP.shp, surface_point_SHP.shp, air_point_SHP.shp,
+    surface_data_<date>.csv and air_data_<date>.csv in <output_folder>/paraviewplus/shp (the folder structure used by
+    the plotting classes) and synthetic.json with the parameters. With several days, one pair of data files is written
+    for each day (the days get warmer, e.g. a heat wave for SimulationCatalog).
+
+    Params:
+    -------
+    - output_folder: str
+    - n_cells: int, approximate number of surface triangles/points (10k to 2M)
+    - n_timesteps: int, number of hourly timesteps (24 to 168)
+    - n_air: int, approximate number of air points (defaults to n_cells)
+    - spacing: float, size of the ground grid cells (m)
+    - date: str, date in the names of the data files
+    - seed: int, random seed
+    - n_days: int, number of consecutive days starting at date (n_timesteps per day)
+
+    Returns:
+    --------
+    dict {name: path} of the generated files.
+    """
+
+    rng = np.random.default_rng(seed)
+    folder = Path(output_folder) / "paraviewplus" / "shp"
+    folder.mkdir(parents=True, exist_ok=True)
+
+    paths = {
+        "surfmesh": folder / "surface_triangle_SHP.shp",
+        "surfpoints": folder / "surface_point_SHP.shp",
+        "airpoints": folder / "air_point_SHP.shp",
+        "surfdata": folder / f"surface_data_{date}.csv",
+        "airdata": folder / f"air_data_{date}.csv",
+    }
+
+    # surface mesh and surface points (centroids of the triangles)
+    triangles, heights = generate_mesh(n_cells, spacing, seed)
+    closed = np.concatenate([triangles, triangles[:, :1]], axis=1)
+    cell_IDs = np.arange(len(triangles))
+    gpd.GeoDataFrame({"cell_ID": cell_IDs}, geometry=shapely.polygons(closed), crs=CRS).to_file(paths["surfmesh"])
+
+    centroids = triangles.mean(axis=1)
+    gpd.GeoDataFrame({"cell_ID": cell_IDs}, geometry=shapely.points(centroids), crs=CRS).to_file(paths["surfpoints"])
+
+    kinds = surface_classes(triangles)
+
+    # air points
+    air = generate_air_points(heights, spacing, n_air if n_air is not None else n_cells)
+    gpd.GeoDataFrame({"cell_ID": np.arange(len(air))}, geometry=shapely.points(air), crs=CRS).to_file(paths["airpoints"])
+
+    # data (the time of the later days continues the diurnal cycle, so the days warm up)
+    days = [(datetime.strptime(date, "%Y_%m_%d") + timedelta(days=k)).strftime("%Y_%m_%d") for k in range(n_days)]
+    for k, day in enumerate(days):
+        offset = 24 * k
+        _write_data(folder / f"surface_data_{day}.csv", centroids, n_timesteps, lambda time: _surface_data(centroids, kinds, offset + time, rng))
+        _write_data(folder / f"air_data_{day}.csv", air, n_timesteps, lambda time: _air_data(air, offset + time, rng))
+
+    metadata = {"n_cells": len(triangles), "n_air": len(air), "n_timesteps": n_timesteps, "spacing": spacing,
+                "date": date, "days": days, "seed": seed, "files": {name: str(path) for name, path in paths.items()}}
+    with open(Path(output_folder) / "synthetic.json", "w") as f:
+        json.dump(metadata, f, indent=2)
+
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates a synthetic Ferda-like dataset.")
+    parser.add_argument("output_folder")
+    parser.add_argument("--cells", type=int, default=10_000, help="approximate number of surface cells")
+    parser.add_argument("--timesteps", type=int, default=24, help="number of hourly timesteps")
+    parser.add_argument("--air", type=int, default=None, help="approximate number of air points (default: cells)")
+    parser.add_argument("--days", type=int, default=1, help="number of days (one pair of data files per day)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate_dataset(args.output_folder, args.cells, args.timesteps, args.air, seed=args.seed, n_days=args.days)
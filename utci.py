@@ -0,0 +1,335 @@
+"""
+Vectorized calculation of UTCI (Universal Thermal Climate Index, felt temperature) for whole
+cells x timesteps arrays, e.g. for recomputing UTCI of scenarios with perturbed air temperature,
+humidity or wind speed.
+
+Uses the 6th order polynomial approximation of UTCI by Broede et al. (2012), Int J Biometeorol 56:481-494.
+"""
+
+import hashlib
+
+import numpy as np
+
+
+# Coefficients of the UTCI polynomial (UTCI - Tair). Keys are the powers of (wind speed, Tmrt - Tair, vapour pressure),
+# values are the coefficients of Tair^0, Tair^1, ... for that combination of powers.
+_COEFFICIENTS = {
+    (0, 0, 0): (6.07562052e-01, -2.27712343e-02, 8.06470249e-04, -1.54271372e-04, -3.24651735e-06, 7.32602852e-08, 1.35959073e-09),
+    (1, 0, 0): (-2.25836520e+00, 8.80326035e-02, 2.16844454e-03, -1.53347087e-05, -5.72983704e-07, -2.55090145e-09),
+    (2, 0, 0): (-7.51269505e-01, -4.08350271e-03, -5.21670675e-05, 1.94544667e-06, 1.14099531e-08),
+    (3, 0, 0): (1.58137256e-01, -6.57263143e-05, 2.22697524e-07, -4.16117031e-08),
+    (4, 0, 0): (-1.27762753e-02, 9.66891875e-06, 2.52785852e-09),
+    (5, 0, 0): (4.56306672e-04, -1.74202546e-07),
+    (6, 0, 0): (-5.91491269e-06,),
+    (0, 1, 0): (3.98374029e-01, 1.83945314e-04, -1.73754510e-04, -7.60781159e-07, 3.77830287e-08, 5.43079673e-10),
+    (1, 1, 0): (-2.00518269e-02, 8.92859837e-04, 3.45433048e-06, -3.77925774e-07, -1.69699377e-09),
+    (2, 1, 0): (1.69992415e-04, -4.99204314e-05, 2.47417178e-07, 1.07596466e-08),
+    (3, 1, 0): (8.49242932e-05, 1.35191328e-06, -6.21531254e-09),
+    (4, 1, 0): (-4.99410301e-06, -1.89489258e-08),
+    (5, 1, 0): (8.15300114e-08,),
+    (0, 2, 0): (7.55043090e-04, -5.65095215e-05, -4.52166564e-07, 2.46688878e-08, 2.42674348e-10),
+    (1, 2, 0): (1.54547250e-04, 5.24110970e-06, -8.75874982e-08, -1.50743064e-09),
+    (2, 2, 0): (-1.56236307e-05, -1.33895614e-07, 2.49709824e-09),
+    (3, 2, 0): (6.51711721e-07, 1.94960053e-09),
+    (4, 2, 0): (-1.00361113e-08,),
+    (0, 3, 0): (-1.21206673e-05, -2.18203660e-07, 7.51269482e-09, 9.79063848e-11),
+    (1, 3, 0): (1.25006734e-06, -1.81584736e-09, -3.52197671e-10),
+    (2, 3, 0): (-3.36514630e-08, 1.35908359e-10),
+    (3, 3, 0): (4.17032620e-10,),
+    (0, 4, 0): (-1.30369025e-09, 4.13908461e-10, 9.22652254e-12),
+    (1, 4, 0): (-5.08220384e-09, -2.24730961e-11),
+    (2, 4, 0): (1.17139133e-10,),
+    (0, 5, 0): (6.62154879e-10, 4.03863260e-13),
+    (1, 5, 0): (1.95087203e-12,),
+    (0, 6, 0): (-4.73602469e-12,),
+    (0, 0, 1): (5.12733497e+00, -3.12788561e-01, -1.96701861e-02, 9.99690870e-04, 9.51738512e-06, -4.66426341e-07),
+    (1, 0, 1): (5.48050612e-01, -3.30552823e-03, -1.64119440e-03, -5.16670694e-06, 9.52692432e-07),
+    (2, 0, 1): (-4.29223622e-02, 5.00845667e-03, 1.00601257e-06, -1.81748644e-06),
+    (3, 0, 1): (-1.25813502e-03, -1.79330391e-04, 2.34994441e-06),
+    (4, 0, 1): (1.29735808e-04, 1.29064870e-06),
+    (5, 0, 1): (-2.28558686e-06,),
+    (0, 1, 1): (-3.69476348e-02, 1.62325322e-03, -3.14279680e-05, 2.59835559e-06, -4.77136523e-08),
+    (1, 1, 1): (8.64203390e-03, -6.87405181e-04, -9.13863872e-06, 5.15916806e-07),
+    (2, 1, 1): (-3.59217476e-05, 3.28696511e-05, -7.10542454e-07),
+    (3, 1, 1): (-1.24382300e-05, -7.38584400e-09),
+    (4, 1, 1): (2.20609296e-07,),
+    (0, 2, 1): (-7.32469180e-04, -1.87381964e-05, 4.80925239e-06, -8.75492040e-08),
+    (1, 2, 1): (2.77862930e-05, -5.06004592e-06, 1.14325367e-07),
+    (2, 2, 1): (2.53016723e-06, -1.72857035e-08),
+    (3, 2, 1): (-3.95079398e-08,),
+    (0, 3, 1): (-3.59413173e-07, 7.04388046e-07, -1.89309167e-08),
+    (1, 3, 1): (-4.79768731e-07, 7.96079978e-09),
+    (2, 3, 1): (1.62897058e-09,),
+    (0, 4, 1): (3.94367674e-08, -1.18566247e-09),
+    (1, 4, 1): (3.34678041e-10,),
+    (0, 5, 1): (-1.15606447e-10,),
+    (0, 0, 2): (-2.80626406e+00, 5.48712484e-01, -3.99428410e-03, -9.54009191e-04, 1.93090978e-05),
+    (1, 0, 2): (-3.08806365e-01, 1.16952364e-02, 4.95271903e-04, -1.90710882e-05),
+    (2, 0, 2): (2.10787756e-03, -6.98445738e-04, 2.30109073e-05),
+    (3, 0, 2): (4.17856590e-04, -1.27043871e-05),
+    (4, 0, 2): (-3.04620472e-06,),
+    (0, 1, 2): (5.14507424e-02, -4.32510997e-03, 8.99281156e-05, -7.14663943e-07),
+    (1, 1, 2): (-2.66016305e-04, 2.63789586e-04, -7.01199003e-06),
+    (2, 1, 2): (-1.06823306e-04, 3.61341136e-06),
+    (3, 1, 2): (2.29748967e-07,),
+    (0, 2, 2): (3.04788893e-04, -6.42070836e-05, 1.16257971e-06),
+    (1, 2, 2): (7.68023384e-06, -5.47446896e-07),
+    (2, 2, 2): (-3.59937910e-08,),
+    (0, 3, 2): (-4.36497725e-06, 1.68737969e-07),
+    (1, 3, 2): (2.67489271e-08,),
+    (0, 4, 2): (3.23926897e-09,),
+    (0, 0, 3): (-3.53874123e-02, -2.21201190e-01, 1.55126038e-02, -2.63917279e-04),
+    (1, 0, 3): (4.53433455e-02, -4.32943862e-03, 1.45389826e-04),
+    (2, 0, 3): (2.17508610e-04, -6.66724702e-05),
+    (3, 0, 3): (3.33217140e-05,),
+    (0, 1, 3): (-2.26921615e-03, 3.80261982e-04, -5.45314314e-09),
+    (1, 1, 3): (-7.96355448e-04, 2.53458034e-05),
+    (2, 1, 3): (-6.31223658e-06,),
+    (0, 2, 3): (3.02122035e-04, -4.77403547e-06),
+    (1, 2, 3): (1.73825715e-06,),
+    (0, 3, 3): (-4.09087898e-07,),
+    (0, 0, 4): (6.14155345e-01, -6.16755931e-02, 1.33374846e-03),
+    (1, 0, 4): (3.55375387e-03, -5.13027851e-04),
+    (2, 0, 4): (1.02449757e-04,),
+    (0, 1, 4): (-1.48526421e-03, -4.11469183e-05),
+    (1, 1, 4): (-6.80434415e-06,),
+    (0, 2, 4): (-9.77675906e-06,),
+    (0, 0, 5): (8.82773108e-02, -3.01859306e-03),
+    (1, 0, 5): (1.04452989e-03,),
+    (0, 1, 5): (2.47090539e-04,),
+    (0, 0, 6): (1.48348065e-03,),
+}
+
+CHUNK_SIZE = 2**16  # approximate number of values evaluated at once (keeps the temporary arrays small)
+
+_TMRT_CACHE = {}  # {hash of UTCI, Tair, WindSpeed and RelatHumid: Tmrt} of the last simulations (see recalculate_utci())
+_TMRT_CACHE_SIZE = 4
+
+
+def saturation_vapour_pressure(tair):
+    """
+    Saturation vapour pressure over water (hPa) for air temperature in degrees Celsius (Hardy 1998, as used by UTCI).
+    """
+
+    g = (-2836.5744, -6028.076559, 19.54263612, -0.02737830188, 0.000016261698, 7.0229056e-10, -1.8680009e-13)
+
+    tk = np.asarray(tair, dtype=np.float64) + 273.15
+    es = 2.7150305 * np.log(tk)
+    for i, c in enumerate(g):
+        es += c * tk ** (i - 2)
+
+    return np.exp(es) * 0.01
+
+
+def _powers(values, n=6):
+    """ Returns list of values^0 ... values^n (the first one is None, it is never used). """
+    powers = [None, values]
+    for i in range(2, n + 1):
+        powers.append(powers[-1] * values)
+    return powers
+
+
+def _polynomial(coefficients, ta, va, dt, pa):
+    """ Evaluates the UTCI polynomial (or its derivative) on 1D arrays. """
+
+    va_powers, dt_powers, pa_powers = _powers(va), _powers(dt), _powers(pa)
+
+    result = np.zeros_like(ta)
+    for (i, k, l), ta_coefficients in coefficients.items():
+
+        # polynomial in Tair (horner scheme)
+        term = np.full_like(ta, ta_coefficients[-1])
+        for c in ta_coefficients[-2::-1]:
+            term *= ta
+            term += c
+
+        # multiply by the powers of the other variables
+        for powers, p in ((va_powers, i), (dt_powers, k), (pa_powers, l)):
+            if p > 0:
+                term *= powers[p]
+
+        result += term
+
+    return result
+
+
+def _dt_polynomial(ta, va, pa):
+    """
+    Collapses the UTCI polynomial for fixed Tair, wind speed and vapour pressure into a polynomial in Tmrt - Tair
+    (for inverting UTCI to mean radiant temperature).
+
+    Returns:
+    --------
+    list of 1D arrays c, the polynomial is sum(c[k] * dt**k).
+    """
+
+    va_powers, pa_powers = _powers(va), _powers(pa)
+
+    result = [np.zeros_like(ta) for _ in range(max(k for _, k, _ in _COEFFICIENTS) + 1)]
+    for (i, k, l), ta_coefficients in _COEFFICIENTS.items():
+
+        # polynomial in Tair (horner scheme)
+        term = np.full_like(ta, ta_coefficients[-1])
+        for c in ta_coefficients[-2::-1]:
+            term *= ta
+            term += c
+
+        for powers, p in ((va_powers, i), (pa_powers, l)):
+            if p > 0:
+                term *= powers[p]
+
+        result[k] += term
+
+    return result
+
+
+def _dtype(tair, dtype):
+    """ Defaults to the dtype of tair (float32 or float64), float64 for other inputs. """
+    if dtype is not None:
+        return dtype
+    return np.asarray(tair).dtype if np.asarray(tair).dtype in (np.float32, np.float64) else np.float64
+
+
+def _chunks(arrays, dtype, chunk_size):
+    """
+    Broadcasts the arrays and yields (slice, list of flattened chunks) along the first axis, each chunk has
+    about chunk_size values. Only the chunks are copied, not the whole (broadcasted) arrays.
+    """
+
+    arrays = np.broadcast_arrays(*[np.atleast_1d(np.asarray(a)) for a in arrays])
+    row_size = int(np.prod(arrays[0].shape[1:]))
+    step = max(1, chunk_size // max(row_size, 1))
+
+    for start in range(0, arrays[0].shape[0], step):
+        s = slice(start, start + step)
+        yield s, [np.ascontiguousarray(a[s], dtype=dtype).ravel() for a in arrays]
+
+
+def _variables(ta, tmrt, wind_speed, relat_humid, dtype):
+    """ Converts the inputs to the variables of the polynomial (wind speed, Tmrt - Tair, vapour pressure in kPa). """
+
+    va = np.clip(wind_speed, 0.5, 17)  # validity range of the approximation
+    dt = tmrt - ta
+    pa = (saturation_vapour_pressure(ta) * relat_humid / 10).astype(dtype)
+
+    return va, dt, pa
+
+
+def utci(tair, tmrt, wind_speed, relat_humid, dtype=None, chunk_size=CHUNK_SIZE):
+    """
+    Calculates UTCI for arrays of any (broadcastable) shape, e.g. cells x timesteps. The arrays are evaluated
+    in chunks so that the temporary arrays stay small.
+
+    Params:
+    -------
+    - tair: air temperature (degrees Celsius)
+    - tmrt: mean radiant temperature (degrees Celsius)
+    - wind_speed: wind speed (m/s), clipped to the validity range of the approximation (0.5 - 17 m/s)
+    - relat_humid: relative humidity (0 - 1, same as RelatHumid in Ferda outputs)
+    - dtype: np.float32 or np.float64 (defaults to the dtype of tair)
+    - chunk_size: approximate number of values evaluated at once
+
+    Returns:
+    --------
+    np.ndarray of UTCI (degrees Celsius) with the broadcasted shape of the inputs.
+    """
+
+    dtype = _dtype(tair, dtype)
+    shape = np.broadcast(tair, tmrt, wind_speed, relat_humid).shape
+
+    result = np.empty(np.broadcast(np.atleast_1d(tair), tmrt, wind_speed, relat_humid).shape, dtype=dtype)
+    for s, (ta, tr, ws, rh) in _chunks([tair, tmrt, wind_speed, relat_humid], dtype, chunk_size):
+        va, dt, pa = _variables(ta, tr, ws, rh, dtype)
+        result[s] = (ta + _polynomial(_COEFFICIENTS, ta, va, dt, pa)).reshape(result[s].shape)
+
+    return result.reshape(shape)
+
+
+def mean_radiant_temperature(utci_values, tair, wind_speed, relat_humid, dtype=None, chunk_size=CHUNK_SIZE, iterations=4):
+    """
+    Inverts UTCI to mean radiant temperature (Ferda outputs contain UTCI, but not Tmrt). The polynomial is collapsed
+    into a polynomial in Tmrt - Tair once per chunk, the newton iterations then only evaluate that (degree 6).
+
+    Params:
+    -------
+    - utci_values: UTCI (degrees Celsius)
+    - tair, wind_speed, relat_humid: same as in utci()
+    - iterations: number of newton iterations
+
+    Returns:
+    --------
+    np.ndarray of mean radiant temperature (degrees Celsius) with the broadcasted shape of the inputs.
+    """
+
+    dtype = _dtype(tair, dtype)
+    shape = np.broadcast(utci_values, tair, wind_speed, relat_humid).shape
+
+    result = np.empty(np.broadcast(np.atleast_1d(utci_values), tair, wind_speed, relat_humid).shape, dtype=dtype)
+    for s, (target, ta, ws, rh) in _chunks([utci_values, tair, wind_speed, relat_humid], dtype, chunk_size):
+        va, _, pa = _variables(ta, ta, ws, rh, dtype)
+
+        c = _dt_polynomial(ta, va, pa)
+
+        # initial guess from the linear term of Tmrt - Tair, then newton iterations (horner scheme with the derivative)
+        dt = (target - ta - c[0]) / c[1]
+        for _ in range(iterations):
+            value, slope = c[-1].copy(), np.zeros_like(dt)
+            for ck in c[-2::-1]:
+                slope = slope * dt + value
+                value = value * dt + ck
+            dt -= (ta + value - target) / slope
+
+        result[s] = (ta + dt).reshape(result[s].shape)
+
+    return result.reshape(shape)
+
+
+def _simulation_tmrt(df, dtype=None):
+    """ Mean radiant temperature of a simulation inverted from UTCI, once per data (the values are hashed). """
+
+    columns = [np.ascontiguousarray(df[c].values) for c in ("UTCI", "Tair", "WindSpeed", "RelatHumid")]
+    h = hashlib.sha1(str(dtype).encode())
+    for values in columns:
+        h.update(f"{values.dtype}{values.shape}".encode())
+        h.update(values)
+    key = h.hexdigest()
+
+    if key not in _TMRT_CACHE:
+        if len(_TMRT_CACHE) >= _TMRT_CACHE_SIZE:
+            del _TMRT_CACHE[next(iter(_TMRT_CACHE))]
+        tmrt = mean_radiant_temperature(*columns, dtype=dtype)
+        tmrt.flags.writeable = False  # shared by all the scenarios of the simulation
+        _TMRT_CACHE[key] = tmrt
+
+    return _TMRT_CACHE[key]
+
+
+def recalculate_utci(df, tair=0, relat_humid=0, wind_speed=0, tmrt=None, dtype=None):
+    """
+    Recalculates UTCI of a simulation after perturbing its inputs (what-if scenarios).
+
+    Params:
+    -------
+    - df: pd.DataFrame with the columns Tair, RelatHumid, WindSpeed and UTCI (Tmrt is used if it exists, otherwise
+      it is derived from UTCI, only once for the scenarios of the same simulation)
+    - tair, relat_humid, wind_speed: change of the variable (scalar or array with the length of df)
+    - tmrt: mean radiant temperature of the scenario (defaults to the one of df)
+    - dtype: np.float32 or np.float64 (defaults to the dtype of Tair)
+
+    Returns:
+    --------
+    np.ndarray of UTCI for the perturbed inputs (same order as the rows of df).
+    """
+
+    required_columns = {'Tair', 'RelatHumid', 'WindSpeed', 'UTCI'}
+    if not required_columns.issubset(df.columns):
+        raise ValueError(f"DataFrame must contain the columns: {required_columns}")
+
+    if tmrt is None:
+        if "Tmrt" in df.columns:
+            tmrt = df["Tmrt"].values
+        else:
+            tmrt = _simulation_tmrt(df, dtype)
+
+    return utci(df["Tair"].values + tair, tmrt, df["WindSpeed"].values + wind_speed,
+                np.clip(df["RelatHumid"].values + relat_humid, 0, 1), dtype)